@@ -0,0 +1,28 @@
+"""
+add codepoints coverage to fonts
+
+Revision ID: 0006_add_font_codepoints
+Revises: 0005_add_first_page_side
+Create Date: 2026-10-19 10:00:00.000000
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_add_font_codepoints'
+down_revision = '0005_add_first_page_side'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Покрытие шрифта: диапазоны кодовых точек cmap ('20-7e,401,410-44f').
+    # Для старых записей остаётся NULL — индекс покрытия читает cmap из файла.
+    op.execute(
+        "ALTER TABLE fonts ADD COLUMN IF NOT EXISTS codepoints TEXT"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('fonts', 'codepoints')
@@ -0,0 +1,37 @@
+"""
+add user state columns created at runtime before
+
+Revision ID: 0007_add_user_state_columns
+Revises: 0006_add_font_codepoints
+Create Date: 2026-10-19 12:00:00.000000
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_add_user_state_columns'
+down_revision = '0006_add_font_codepoints'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Раньше эти колонки добавлялись из кода бота при первом обращении (ALTER TABLE
+    # в запросах). Теперь схема фиксируется миграциями, IF NOT EXISTS — для баз,
+    # где колонки уже созданы старым кодом.
+    op.execute(
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS variant_fonts JSONB DEFAULT '[]'::jsonb"
+    )
+    op.execute(
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS instruction_seen BOOLEAN DEFAULT FALSE"
+    )
+    op.execute(
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS pdf_mode_enabled BOOLEAN DEFAULT FALSE"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'pdf_mode_enabled')
+    op.drop_column('users', 'instruction_seen')
+    op.drop_column('users', 'variant_fonts')
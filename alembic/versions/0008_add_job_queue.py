@@ -0,0 +1,70 @@
+"""
+turn jobs into a persistent render queue
+
+Revision ID: 0008_add_job_queue
+Revises: 0007_add_user_state_columns
+Create Date: 2026-10-19 14:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008_add_job_queue'
+down_revision = '0007_add_user_state_columns'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Куда отправить результат и с какими настройками рендерить
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS chat_id BIGINT")
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS render_params JSONB")
+    # Аренда задачи воркером и повторы
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0")
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS max_attempts INTEGER NOT NULL DEFAULT 3")
+    op.execute(
+        "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS available_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP"
+    )
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS leased_until TIMESTAMP")
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS leased_by TEXT")
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS started_at TIMESTAMP")
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS error_message TEXT")
+    # Когда бот забрал результат для отправки пользователю
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS notified_at TIMESTAMP")
+
+    # Старые задачи: незавершённые генерировались внутри хендлера и уже потеряны,
+    # завершённые не нужно отправлять повторно
+    op.execute(
+        """
+        UPDATE jobs
+        SET status = 'failed', completed_at = COALESCE(completed_at, CURRENT_TIMESTAMP)
+        WHERE status NOT IN ('completed', 'failed')
+        """
+    )
+    op.execute("UPDATE jobs SET notified_at = COALESCE(completed_at, created_at) WHERE notified_at IS NULL")
+
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_queue_pending_idx ON jobs (available_at, id) "
+        "WHERE status = 'pending'"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_queue_leased_idx ON jobs (leased_until) "
+        "WHERE status = 'processing'"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_unnotified_idx ON jobs (id) "
+        "WHERE notified_at IS NULL AND status IN ('completed', 'failed')"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS jobs_unnotified_idx")
+    op.execute("DROP INDEX IF EXISTS jobs_queue_leased_idx")
+    op.execute("DROP INDEX IF EXISTS jobs_queue_pending_idx")
+    for column in (
+        'notified_at', 'error_message', 'started_at', 'leased_by', 'leased_until',
+        'available_at', 'max_attempts', 'attempts', 'render_params', 'chat_id',
+    ):
+        op.drop_column('jobs', column)
@@ -0,0 +1,91 @@
+"""
+move job texts into a compressed content-addressed table
+
+Revision ID: 0009_move_job_texts
+Revises: 0008_add_job_queue
+Create Date: 2026-10-19 15:00:00.000000
+"""
+
+import hashlib
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009_move_job_texts'
+down_revision = '0008_add_job_queue'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS job_texts (
+            text_hash BYTEA PRIMARY KEY,          -- sha256 исходного текста
+            body BYTEA NOT NULL,                  -- текст UTF-8, сжатый zlib
+            original_size INTEGER NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_used_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS job_texts_last_used_idx ON job_texts (last_used_at)")
+    op.execute(
+        "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS text_hash BYTEA "
+        "REFERENCES job_texts(text_hash) ON DELETE SET NULL"
+    )
+    # Для ON DELETE SET NULL и проверки «текст нужен незавершённой задаче» при очистке
+    op.execute("CREATE INDEX IF NOT EXISTS jobs_text_hash_idx ON jobs (text_hash)")
+
+    # Переносим тексты существующих задач пачками
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.text(
+                "SELECT id, text_content FROM jobs WHERE id > :last_id ORDER BY id LIMIT :limit"
+            ),
+            {"last_id": last_id, "limit": BATCH_SIZE},
+        ).fetchall()
+        if not rows:
+            break
+        for job_id, text_content in rows:
+            raw = (text_content or "").encode("utf-8")
+            digest = hashlib.sha256(raw).digest()
+            bind.execute(
+                sa.text(
+                    """
+                    INSERT INTO job_texts (text_hash, body, original_size)
+                    VALUES (:hash, :body, :size)
+                    ON CONFLICT (text_hash) DO NOTHING
+                    """
+                ),
+                {"hash": digest, "body": zlib.compress(raw, 6), "size": len(raw)},
+            )
+            bind.execute(
+                sa.text("UPDATE jobs SET text_hash = :hash WHERE id = :id"),
+                {"hash": digest, "id": job_id},
+            )
+        last_id = rows[-1][0]
+
+    op.execute("ALTER TABLE jobs DROP COLUMN IF EXISTS text_content")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS text_content TEXT")
+    bind = op.get_bind()
+    rows = bind.execute(sa.text("SELECT text_hash, body FROM job_texts")).fetchall()
+    for digest, body in rows:
+        bind.execute(
+            sa.text("UPDATE jobs SET text_content = :text WHERE text_hash = :hash"),
+            {"text": zlib.decompress(bytes(body)).decode("utf-8"), "hash": digest},
+        )
+    op.execute("UPDATE jobs SET text_content = '' WHERE text_content IS NULL")
+    op.execute("ALTER TABLE jobs ALTER COLUMN text_content SET NOT NULL")
+    op.execute("ALTER TABLE jobs DROP COLUMN IF EXISTS text_hash")
+    op.execute("DROP TABLE IF EXISTS job_texts")
@@ -0,0 +1,169 @@
+"""
+partition jobs by month and add indexes for stats queries
+
+Revision ID: 0010_jobs_partitioning
+Revises: 0009_move_job_texts
+Create Date: 2026-10-19 16:00:00.000000
+
+jobs становится таблицей, секционированной по created_at (месяц на секцию,
+плюс секция по умолчанию). Новые секции заранее создаёт
+database/partitions.ensure_job_partitions. Требуется PostgreSQL 12+.
+"""
+
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010_jobs_partitioning'
+down_revision = '0009_move_job_texts'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 2
+
+JOB_COLUMNS = (
+    "id, user_id, pdf_path, created_at, completed_at, execution_time_ms, status, "
+    "chat_id, render_params, attempts, max_attempts, available_at, leased_until, "
+    "leased_by, started_at, error_message, notified_at, text_hash"
+)
+
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _create_job_indexes() -> None:
+    # Очередь (как в 0008/0009)
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_queue_pending_idx ON jobs (available_at, id) "
+        "WHERE status = 'pending'"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_queue_leased_idx ON jobs (leased_until) "
+        "WHERE status = 'processing'"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_unnotified_idx ON jobs (id) "
+        "WHERE notified_at IS NULL AND status IN ('completed', 'failed')"
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS jobs_text_hash_idx ON jobs (text_hash)")
+    # Статистика: PDF за сегодня / всего, последние пользователи, PDF пользователя
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_completed_created_idx ON jobs (created_at) "
+        "WHERE status = 'completed'"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_completed_at_idx ON jobs (completed_at DESC NULLS LAST) "
+        "WHERE status = 'completed'"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_user_completed_idx ON jobs (user_id, completed_at) "
+        "WHERE status = 'completed'"
+    )
+
+
+def upgrade() -> None:
+    # users: активные/новые за сегодня и последние визиты
+    op.execute("CREATE INDEX IF NOT EXISTS users_last_seen_idx ON users (last_seen_at DESC NULLS LAST)")
+    op.execute("CREATE INDEX IF NOT EXISTS users_created_at_idx ON users (created_at)")
+
+    # jobs: перекладываем в секционированную таблицу
+    op.execute("UPDATE jobs SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+    op.execute("ALTER TABLE jobs RENAME TO jobs_unpartitioned")
+    op.execute("ALTER INDEX IF EXISTS jobs_pkey RENAME TO jobs_unpartitioned_pkey")
+    op.execute(
+        """
+        CREATE TABLE jobs (
+            id INTEGER NOT NULL DEFAULT nextval('jobs_id_seq'),
+            user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            pdf_path TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP,
+            execution_time_ms INTEGER,
+            status VARCHAR(20) DEFAULT 'pending',
+            chat_id BIGINT,
+            render_params JSONB,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            available_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            leased_until TIMESTAMP,
+            leased_by TEXT,
+            started_at TIMESTAMP,
+            error_message TEXT,
+            notified_at TIMESTAMP,
+            text_hash BYTEA REFERENCES job_texts(text_hash) ON DELETE SET NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute("ALTER SEQUENCE jobs_id_seq OWNED BY jobs.id")
+
+    bind = op.get_bind()
+    oldest = bind.execute(sa.text("SELECT MIN(created_at) FROM jobs_unpartitioned")).scalar()
+    today = date.today()
+    month = date((oldest or today).year, (oldest or today).month, 1)
+    last = _add_months(date(today.year, today.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        next_month = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE IF NOT EXISTS jobs_y{month.year}m{month.month:02d} PARTITION OF jobs "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+        )
+        month = next_month
+    op.execute("CREATE TABLE IF NOT EXISTS jobs_default PARTITION OF jobs DEFAULT")
+
+    op.execute(f"INSERT INTO jobs ({JOB_COLUMNS}) SELECT {JOB_COLUMNS} FROM jobs_unpartitioned")
+    op.execute("DROP TABLE jobs_unpartitioned")
+    _create_job_indexes()
+    op.execute("ANALYZE jobs")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE jobs RENAME TO jobs_partitioned")
+    op.execute("ALTER INDEX IF EXISTS jobs_pkey RENAME TO jobs_partitioned_pkey")
+    op.execute(
+        """
+        CREATE TABLE jobs (
+            id INTEGER PRIMARY KEY DEFAULT nextval('jobs_id_seq'),
+            user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            pdf_path TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP,
+            execution_time_ms INTEGER,
+            status VARCHAR(20) DEFAULT 'pending',
+            chat_id BIGINT,
+            render_params JSONB,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            available_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            leased_until TIMESTAMP,
+            leased_by TEXT,
+            started_at TIMESTAMP,
+            error_message TEXT,
+            notified_at TIMESTAMP,
+            text_hash BYTEA REFERENCES job_texts(text_hash) ON DELETE SET NULL
+        )
+        """
+    )
+    op.execute(f"INSERT INTO jobs ({JOB_COLUMNS}) SELECT {JOB_COLUMNS} FROM jobs_partitioned")
+    op.execute("ALTER SEQUENCE jobs_id_seq OWNED BY jobs.id")
+    op.execute("DROP TABLE jobs_partitioned")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_queue_pending_idx ON jobs (available_at, id) "
+        "WHERE status = 'pending'"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_queue_leased_idx ON jobs (leased_until) "
+        "WHERE status = 'processing'"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_unnotified_idx ON jobs (id) "
+        "WHERE notified_at IS NULL AND status IN ('completed', 'failed')"
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS jobs_text_hash_idx ON jobs (text_hash)")
+    op.execute("DROP INDEX IF EXISTS users_created_at_idx")
+    op.execute("DROP INDEX IF EXISTS users_last_seen_idx")
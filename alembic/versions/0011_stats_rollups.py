@@ -0,0 +1,193 @@
+"""
+add incrementally maintained statistics rollups
+
+Revision ID: 0011_stats_rollups
+Revises: 0010_jobs_partitioning
+Create Date: 2026-10-19 17:00:00.000000
+
+stats_daily и stats_totals обновляются триггерами на users и jobs при каждом
+изменении, поэтому бот статистики читает пару строк вместо подсчёта по
+сырым таблицам. users.pdfs_completed и users.last_pdf_at обслуживают список
+последних пользователей с PDF.
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0011_stats_rollups'
+down_revision = '0010_jobs_partitioning'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day DATE PRIMARY KEY,
+            new_users INTEGER NOT NULL DEFAULT 0,
+            active_users INTEGER NOT NULL DEFAULT 0,    -- пользователи, заходившие в этот день
+            pdfs_completed INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stats_totals (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),  -- всегда одна строка
+            users BIGINT NOT NULL DEFAULT 0,
+            pdfs_completed BIGINT NOT NULL DEFAULT 0
+        )
+        """
+    )
+    op.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS pdfs_completed INTEGER NOT NULL DEFAULT 0")
+    op.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_pdf_at TIMESTAMP")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS users_last_pdf_idx ON users (last_pdf_at DESC) "
+        "WHERE last_pdf_at IS NOT NULL"
+    )
+
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION stats_bump_daily(
+            p_day DATE, p_new_users INTEGER, p_active_users INTEGER, p_pdfs INTEGER
+        ) RETURNS void AS $$
+        BEGIN
+            INSERT INTO stats_daily (day, new_users, active_users, pdfs_completed)
+            VALUES (p_day, p_new_users, p_active_users, p_pdfs)
+            ON CONFLICT (day) DO UPDATE SET
+                new_users = stats_daily.new_users + EXCLUDED.new_users,
+                active_users = stats_daily.active_users + EXCLUDED.active_users,
+                pdfs_completed = stats_daily.pdfs_completed + EXCLUDED.pdfs_completed;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    # Активность считается при переходе last_seen_at на новый день: так каждый
+    # пользователь попадает в active_users дня ровно один раз
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION stats_users_trigger() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM stats_bump_daily(COALESCE(NEW.created_at, CURRENT_TIMESTAMP)::date, 1, 0, 0);
+                PERFORM stats_bump_daily(NEW.last_seen_at::date, 0, 1, 0);
+                UPDATE stats_totals SET users = users + 1;
+            ELSIF TG_OP = 'UPDATE' THEN
+                IF NEW.last_seen_at::date > OLD.last_seen_at::date THEN
+                    PERFORM stats_bump_daily(NEW.last_seen_at::date, 0, 1, 0);
+                END IF;
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE stats_totals SET users = users - 1;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION stats_jobs_trigger() RETURNS trigger AS $$
+        DECLARE
+            done_at TIMESTAMP := COALESCE(NEW.completed_at, CURRENT_TIMESTAMP);
+        BEGIN
+            IF NEW.status = 'completed' AND OLD.status IS DISTINCT FROM 'completed' THEN
+                PERFORM stats_bump_daily(done_at::date, 0, 0, 1);
+                UPDATE stats_totals SET pdfs_completed = pdfs_completed + 1;
+                UPDATE users
+                SET pdfs_completed = pdfs_completed + 1,
+                    last_pdf_at = GREATEST(last_pdf_at, done_at)
+                WHERE user_id = NEW.user_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+
+    # Без записей в users/jobs, пока ставим триггеры и заполняем сводки
+    op.execute("LOCK TABLE users, jobs IN SHARE ROW EXCLUSIVE MODE")
+    op.execute(
+        """
+        CREATE TRIGGER stats_users_rollup
+        AFTER INSERT OR DELETE OR UPDATE OF last_seen_at ON users
+        FOR EACH ROW EXECUTE FUNCTION stats_users_trigger()
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER stats_jobs_rollup
+        AFTER UPDATE OF status ON jobs
+        FOR EACH ROW EXECUTE FUNCTION stats_jobs_trigger()
+        """
+    )
+
+    op.execute(
+        """
+        INSERT INTO stats_totals (id, users, pdfs_completed)
+        SELECT TRUE,
+               (SELECT COUNT(*) FROM users),
+               (SELECT COUNT(*) FROM jobs WHERE status = 'completed')
+        ON CONFLICT (id) DO UPDATE SET
+            users = EXCLUDED.users,
+            pdfs_completed = EXCLUDED.pdfs_completed
+        """
+    )
+    op.execute("DELETE FROM stats_daily")
+    op.execute(
+        """
+        INSERT INTO stats_daily (day, new_users)
+        SELECT COALESCE(created_at, CURRENT_TIMESTAMP)::date, COUNT(*)
+        FROM users
+        GROUP BY 1
+        """
+    )
+    # По прошлым дням известен только последний визит, поэтому active_users
+    # за историю — нижняя оценка; с этого момента счёт точный
+    op.execute(
+        """
+        INSERT INTO stats_daily (day, active_users)
+        SELECT last_seen_at::date, COUNT(*)
+        FROM users
+        GROUP BY 1
+        ON CONFLICT (day) DO UPDATE SET active_users = EXCLUDED.active_users
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO stats_daily (day, pdfs_completed)
+        SELECT COALESCE(completed_at, created_at)::date, COUNT(*)
+        FROM jobs
+        WHERE status = 'completed'
+        GROUP BY 1
+        ON CONFLICT (day) DO UPDATE SET pdfs_completed = EXCLUDED.pdfs_completed
+        """
+    )
+    op.execute(
+        """
+        UPDATE users u
+        SET pdfs_completed = j.cnt,
+            last_pdf_at = j.last_at
+        FROM (
+            SELECT user_id, COUNT(*) AS cnt, MAX(COALESCE(completed_at, created_at)) AS last_at
+            FROM jobs
+            WHERE status = 'completed'
+            GROUP BY user_id
+        ) j
+        WHERE u.user_id = j.user_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS stats_jobs_rollup ON jobs")
+    op.execute("DROP TRIGGER IF EXISTS stats_users_rollup ON users")
+    op.execute("DROP FUNCTION IF EXISTS stats_jobs_trigger()")
+    op.execute("DROP FUNCTION IF EXISTS stats_users_trigger()")
+    op.execute("DROP FUNCTION IF EXISTS stats_bump_daily(DATE, INTEGER, INTEGER, INTEGER)")
+    op.execute("DROP INDEX IF EXISTS users_last_pdf_idx")
+    op.execute("ALTER TABLE users DROP COLUMN IF EXISTS last_pdf_at")
+    op.execute("ALTER TABLE users DROP COLUMN IF EXISTS pdfs_completed")
+    op.execute("DROP TABLE IF EXISTS stats_totals")
+    op.execute("DROP TABLE IF EXISTS stats_daily")
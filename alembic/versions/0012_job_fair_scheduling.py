@@ -0,0 +1,52 @@
+"""
+add fair scheduling columns to jobs
+
+Revision ID: 0012_job_fair_scheduling
+Revises: 0011_stats_rollups
+Create Date: 2026-10-19 18:00:00.000000
+
+Задачи выбираются по fair_key (см. utils/job_scheduling.py), а не по
+времени постановки.
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0012_job_fair_scheduling'
+down_revision = '0011_stats_rollups'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS priority_class VARCHAR(16) NOT NULL DEFAULT 'standard'")
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS text_length INTEGER")
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS fair_key DOUBLE PRECISION")
+    # Задачи, уже стоящие в очереди, сохраняют прежний порядок
+    op.execute(
+        "UPDATE jobs SET fair_key = EXTRACT(EPOCH FROM available_at) "
+        "WHERE status IN ('pending', 'processing')"
+    )
+    op.execute("DROP INDEX IF EXISTS jobs_queue_pending_idx")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_queue_fair_idx ON jobs (fair_key, id) "
+        "WHERE status = 'pending'"
+    )
+    # Последний fair_key пользователя в классе при постановке в очередь
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_user_active_idx ON jobs (user_id, priority_class) "
+        "WHERE status IN ('pending', 'processing')"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS jobs_user_active_idx")
+    op.execute("DROP INDEX IF EXISTS jobs_queue_fair_idx")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_queue_pending_idx ON jobs (available_at, id) "
+        "WHERE status = 'pending'"
+    )
+    op.execute("ALTER TABLE jobs DROP COLUMN IF EXISTS fair_key")
+    op.execute("ALTER TABLE jobs DROP COLUMN IF EXISTS text_length")
+    op.execute("ALTER TABLE jobs DROP COLUMN IF EXISTS priority_class")
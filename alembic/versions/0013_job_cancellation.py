@@ -0,0 +1,39 @@
+"""
+add job cancellation and render timeout statuses
+
+Revision ID: 0013_job_cancellation
+Revises: 0012_job_fair_scheduling
+Create Date: 2026-10-19 19:00:00.000000
+
+Новые статусы jobs: cancelled (отменена пользователем) и timeout (истёк
+JOB_RENDER_TIMEOUT). О timeout пользователю сообщает бот, поэтому такие
+задачи входят в выборку неотправленных результатов.
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0013_job_cancellation'
+down_revision = '0012_job_fair_scheduling'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS cancel_requested_at TIMESTAMP")
+    op.execute("DROP INDEX IF EXISTS jobs_unnotified_idx")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_unnotified_idx ON jobs (id) "
+        "WHERE notified_at IS NULL AND status IN ('completed', 'failed', 'timeout')"
+    )
+
+
+def downgrade() -> None:
+    op.execute("UPDATE jobs SET status = 'failed' WHERE status IN ('cancelled', 'timeout')")
+    op.execute("DROP INDEX IF EXISTS jobs_unnotified_idx")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_unnotified_idx ON jobs (id) "
+        "WHERE notified_at IS NULL AND status IN ('completed', 'failed')"
+    )
+    op.execute("ALTER TABLE jobs DROP COLUMN IF EXISTS cancel_requested_at")
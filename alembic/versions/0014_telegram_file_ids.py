@@ -0,0 +1,38 @@
+"""
+cache telegram file_id of sent documents
+
+Revision ID: 0014_telegram_file_ids
+Revises: 0013_job_cancellation
+Create Date: 2026-10-19 20:00:00.000000
+
+После первой загрузки PDF задачи его file_id хранится в jobs, поэтому
+повторная отправка идёт по ссылке без загрузки файла. Для статических
+документов (шаблоны из templates/) — таблица telegram_files.
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0014_telegram_file_ids'
+down_revision = '0013_job_cancellation'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS telegram_file_id TEXT")
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS telegram_files (
+            file_key TEXT PRIMARY KEY,          -- id бота, путь, размер и время изменения файла
+            file_id TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS telegram_files")
+    op.execute("ALTER TABLE jobs DROP COLUMN IF EXISTS telegram_file_id")
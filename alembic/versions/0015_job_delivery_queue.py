@@ -0,0 +1,33 @@
+"""
+durable delivery queue for job results
+
+Revision ID: 0015_job_delivery_queue
+Revises: 0014_telegram_file_ids
+Create Date: 2026-10-19 21:00:00.000000
+
+Отправка результата пользователю стала очередью на строке задачи:
+notified_at ставится только после успешной отправки (или отказа от неё),
+неудачные попытки откладываются через delivery_available_at, а
+delivery_leased_until не даёт двум процессам бота отправлять одно и то же.
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0015_job_delivery_queue'
+down_revision = '0014_telegram_file_ids'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS delivery_attempts INTEGER NOT NULL DEFAULT 0")
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS delivery_available_at TIMESTAMP")
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS delivery_leased_until TIMESTAMP")
+    op.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS delivery_error TEXT")
+
+
+def downgrade() -> None:
+    for column in ('delivery_error', 'delivery_leased_until', 'delivery_available_at', 'delivery_attempts'):
+        op.execute(f"ALTER TABLE jobs DROP COLUMN IF EXISTS {column}")
@@ -0,0 +1,37 @@
+"""
+per-minute rate limit counters shared by bot processes
+
+Revision ID: 0016_rate_limit_hits
+Revises: 0015_job_delivery_queue
+Create Date: 2026-10-19 22:00:00.000000
+
+Счётчики запросов пользователей по минутам для RATE_LIMIT_BACKEND=postgres.
+Строки старше часа удаляет периодическая очистка бота.
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0016_rate_limit_hits'
+down_revision = '0015_job_delivery_queue'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS rate_limit_hits (
+            user_id BIGINT NOT NULL,
+            bucket TIMESTAMP NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, bucket)
+        )
+        """
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS rate_limit_hits_bucket_idx ON rate_limit_hits (bucket)")
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS rate_limit_hits")
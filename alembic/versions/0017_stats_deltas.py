@@ -0,0 +1,175 @@
+"""
+append-only statistics deltas folded into rollups by the leader
+
+Revision ID: 0017_stats_deltas
+Revises: 0016_rate_limit_hits
+Create Date: 2026-10-19 23:00:00.000000
+
+Триггеры 0011 обновляли stats_totals (одна строка) и stats_daily (строка
+дня) в каждой транзакции, меняющей users или jobs: все записи выстраивались
+в очередь за этими строками, а пакетный UPDATE last_seen_at (много строк
+users, затем stats_daily) и завершение задачи (stats_daily, затем users)
+брали блокировки в противоположном порядке и могли взаимно блокироваться.
+
+Теперь триггеры только добавляют строки в stats_deltas — без блокировок
+общих строк. Процесс-лидер бота раз в STATS_FOLD_INTERVAL переносит их в
+stats_daily / stats_totals (stats_fold_deltas), бот статистики читает
+сводки вместе с ещё не перенесёнными строками.
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0017_stats_deltas'
+down_revision = '0016_rate_limit_hits'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stats_deltas (
+            id BIGSERIAL PRIMARY KEY,
+            day DATE NOT NULL,
+            new_users INTEGER NOT NULL DEFAULT 0,
+            active_users INTEGER NOT NULL DEFAULT 0,
+            pdfs_completed INTEGER NOT NULL DEFAULT 0,
+            users INTEGER NOT NULL DEFAULT 0    -- изменение stats_totals.users
+        )
+        """
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION stats_users_trigger() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO stats_deltas (day, new_users, users)
+                VALUES (COALESCE(NEW.created_at, CURRENT_TIMESTAMP)::date, 1, 1);
+                INSERT INTO stats_deltas (day, active_users) VALUES (NEW.last_seen_at::date, 1);
+            ELSIF TG_OP = 'UPDATE' THEN
+                IF NEW.last_seen_at::date > OLD.last_seen_at::date THEN
+                    INSERT INTO stats_deltas (day, active_users) VALUES (NEW.last_seen_at::date, 1);
+                END IF;
+            ELSIF TG_OP = 'DELETE' THEN
+                INSERT INTO stats_deltas (day, users) VALUES (CURRENT_DATE, -1);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION stats_jobs_trigger() RETURNS trigger AS $$
+        DECLARE
+            done_at TIMESTAMP := COALESCE(NEW.completed_at, CURRENT_TIMESTAMP);
+        BEGIN
+            IF NEW.status = 'completed' AND OLD.status IS DISTINCT FROM 'completed' THEN
+                INSERT INTO stats_deltas (day, pdfs_completed) VALUES (done_at::date, 1);
+                UPDATE users
+                SET pdfs_completed = pdfs_completed + 1,
+                    last_pdf_at = GREATEST(last_pdf_at, done_at)
+                WHERE user_id = NEW.user_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    # Переносит видимые строки stats_deltas в сводки; строки, добавленные
+    # параллельно, остаются до следующего вызова
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION stats_fold_deltas() RETURNS integer AS $$
+        DECLARE
+            folded INTEGER;
+        BEGIN
+            WITH moved AS (
+                DELETE FROM stats_deltas RETURNING *
+            ), daily AS (
+                INSERT INTO stats_daily (day, new_users, active_users, pdfs_completed)
+                SELECT day, SUM(new_users), SUM(active_users), SUM(pdfs_completed)
+                FROM moved
+                GROUP BY day
+                ORDER BY day
+                ON CONFLICT (day) DO UPDATE SET
+                    new_users = stats_daily.new_users + EXCLUDED.new_users,
+                    active_users = stats_daily.active_users + EXCLUDED.active_users,
+                    pdfs_completed = stats_daily.pdfs_completed + EXCLUDED.pdfs_completed
+            ), totals AS (
+                UPDATE stats_totals
+                SET users = users + (SELECT COALESCE(SUM(users), 0) FROM moved),
+                    pdfs_completed = pdfs_completed + (SELECT COALESCE(SUM(pdfs_completed), 0) FROM moved)
+            )
+            SELECT COUNT(*) INTO folded FROM moved;
+            RETURN folded;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute("DROP FUNCTION IF EXISTS stats_bump_daily(DATE, INTEGER, INTEGER, INTEGER)")
+
+
+def downgrade() -> None:
+    # Без записей в users/jobs, пока переносим остаток и возвращаем триггеры
+    op.execute("LOCK TABLE users, jobs IN SHARE ROW EXCLUSIVE MODE")
+    op.execute("SELECT stats_fold_deltas()")
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION stats_bump_daily(
+            p_day DATE, p_new_users INTEGER, p_active_users INTEGER, p_pdfs INTEGER
+        ) RETURNS void AS $$
+        BEGIN
+            INSERT INTO stats_daily (day, new_users, active_users, pdfs_completed)
+            VALUES (p_day, p_new_users, p_active_users, p_pdfs)
+            ON CONFLICT (day) DO UPDATE SET
+                new_users = stats_daily.new_users + EXCLUDED.new_users,
+                active_users = stats_daily.active_users + EXCLUDED.active_users,
+                pdfs_completed = stats_daily.pdfs_completed + EXCLUDED.pdfs_completed;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION stats_users_trigger() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM stats_bump_daily(COALESCE(NEW.created_at, CURRENT_TIMESTAMP)::date, 1, 0, 0);
+                PERFORM stats_bump_daily(NEW.last_seen_at::date, 0, 1, 0);
+                UPDATE stats_totals SET users = users + 1;
+            ELSIF TG_OP = 'UPDATE' THEN
+                IF NEW.last_seen_at::date > OLD.last_seen_at::date THEN
+                    PERFORM stats_bump_daily(NEW.last_seen_at::date, 0, 1, 0);
+                END IF;
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE stats_totals SET users = users - 1;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION stats_jobs_trigger() RETURNS trigger AS $$
+        DECLARE
+            done_at TIMESTAMP := COALESCE(NEW.completed_at, CURRENT_TIMESTAMP);
+        BEGIN
+            IF NEW.status = 'completed' AND OLD.status IS DISTINCT FROM 'completed' THEN
+                PERFORM stats_bump_daily(done_at::date, 0, 0, 1);
+                UPDATE stats_totals SET pdfs_completed = pdfs_completed + 1;
+                UPDATE users
+                SET pdfs_completed = pdfs_completed + 1,
+                    last_pdf_at = GREATEST(last_pdf_at, done_at)
+                WHERE user_id = NEW.user_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute("DROP FUNCTION IF EXISTS stats_fold_deltas()")
+    op.execute("DROP TABLE IF EXISTS stats_deltas")
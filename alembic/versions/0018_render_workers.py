@@ -0,0 +1,37 @@
+"""
+live render worker registry for admission capacity
+
+Revision ID: 0018_render_workers
+Revises: 0017_stats_deltas
+Create Date: 2026-10-20 10:00:00.000000
+
+Каждый процесс с воркерами генерации (бот с INLINE_RENDER_WORKERS > 0 и
+render_worker.py) периодически записывает сюда число своих слотов. Допуск
+задач (utils/admission.py) делит ожидающую работу на сумму слотов живых
+процессов вместо настройки ADMISSION_RENDER_CAPACITY.
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0018_render_workers'
+down_revision = '0017_stats_deltas'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS render_workers (
+            worker_id TEXT PRIMARY KEY,    -- хост:pid процесса
+            slots INTEGER NOT NULL,        -- основные слоты + быстрая полоса
+            heartbeat_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS render_workers")
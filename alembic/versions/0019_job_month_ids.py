@@ -0,0 +1,52 @@
+"""
+encode the creation month in jobs.id
+
+Revision ID: 0019_job_month_ids
+Revises: 0018_render_workers
+Create Date: 2026-10-20 12:00:00.000000
+
+PRIMARY KEY jobs — (id, created_at), поэтому запрос WHERE id = %s проверял
+индекс каждой месячной секции. Теперь старшие биты id — месяц создания
+(job_month_id), и по id известны границы его секции: запросы по одной
+задаче (database/partitions.JOB_BY_ID) добавляют условие на created_at, и
+планировщик оставляет одну секцию. Соответствие id и created_at проверяет
+ограничение jobs_id_month_check. У задач, созданных до миграции, старшие
+биты нулевые: их по-прежнему ищут во всех секциях.
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0019_job_month_ids'
+down_revision = '0018_render_workers'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Месяц — (год * 12 + месяц - 1) в битах 40+, номер из jobs_id_seq — в младших 40 битах
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION job_month_id(created TIMESTAMP, seq BIGINT) RETURNS BIGINT AS $$
+            SELECT ((EXTRACT(YEAR FROM created)::bigint * 12 + EXTRACT(MONTH FROM created)::bigint - 1) << 40) | seq
+        $$ LANGUAGE sql IMMUTABLE
+        """
+    )
+    op.execute("ALTER SEQUENCE jobs_id_seq AS BIGINT")
+    op.execute("ALTER TABLE jobs ALTER COLUMN id TYPE BIGINT")
+    # LOCALTIMESTAMP — то же время, что DEFAULT CURRENT_TIMESTAMP у created_at
+    op.execute("ALTER TABLE jobs ALTER COLUMN id SET DEFAULT job_month_id(LOCALTIMESTAMP, nextval('jobs_id_seq'))")
+    op.execute(
+        """
+        ALTER TABLE jobs ADD CONSTRAINT jobs_id_month_check
+        CHECK (id < (1::bigint << 40) OR id >> 40 = job_month_id(created_at, 0) >> 40)
+        """
+    )
+
+
+def downgrade() -> None:
+    # id остаются BIGINT: новые значения не помещаются в INTEGER
+    op.execute("ALTER TABLE jobs DROP CONSTRAINT IF EXISTS jobs_id_month_check")
+    op.execute("ALTER TABLE jobs ALTER COLUMN id SET DEFAULT nextval('jobs_id_seq')")
+    op.execute("DROP FUNCTION IF EXISTS job_month_id(TIMESTAMP, BIGINT)")
@@ -30,19 +30,49 @@ logger = logging.getLogger(__name__)
 
 
 async def periodic_cleanup():
-    """Периодическая очистка старых файлов"""
+    """Периодическая очистка старых файлов (только в процессе-лидере)"""
     from utils.cleanup import cleanup_old_pdfs
+    from utils.cluster import leader
+    from utils.executors import db_executor
     
     while True:
         await asyncio.sleep(3600)  # Каждый час
         try:
+            # Оценка времени генерации у каждого процесса своя
+            from utils.job_queue import seed_render_cost_model
+            await asyncio.get_running_loop().run_in_executor(db_executor, seed_render_cost_model)
+            if not leader.is_leader:
+                continue
             deleted = cleanup_old_pdfs(days_old=7)
             if deleted > 0:
                 logger.info(f"✓ Очищено {deleted} старых PDF файлов")
+            from utils.job_texts import purge_job_texts
+            await asyncio.get_running_loop().run_in_executor(db_executor, purge_job_texts)
+            from database.partitions import ensure_job_partitions
+            await asyncio.get_running_loop().run_in_executor(db_executor, ensure_job_partitions)
+            from utils.rate_limit import purge_rate_limit_hits
+            await asyncio.get_running_loop().run_in_executor(db_executor, purge_rate_limit_hits)
         except Exception as e:
             logger.error(f"Ошибка в периодической очистке: {e}")
 
 
+async def fold_statistics():
+    """Переносит изменения статистики в сводки (только в процессе-лидере)"""
+    from config import STATS_FOLD_INTERVAL
+    from database.stats_rollups import fold_stats_deltas
+    from utils.cluster import leader
+    from utils.executors import db_executor
+
+    while True:
+        await asyncio.sleep(STATS_FOLD_INTERVAL)
+        if not leader.is_leader:
+            continue
+        try:
+            await asyncio.get_running_loop().run_in_executor(db_executor, fold_stats_deltas)
+        except Exception as e:
+            logger.error(f"Ошибка переноса статистики в сводки: {e}")
+
+
 async def log_statistics():
     """Периодически выводит статистику производительности"""
     from utils.metrics import metrics
@@ -51,6 +81,37 @@ async def log_statistics():
         await asyncio.sleep(300)  # Каждые 5 минут
         try:
             metrics.log_stats()
+            from database.connection import get_pool_stats
+            from utils.cluster import leader
+            if leader.is_leader:
+                # Очередь общая для всех процессов — сводку пишет один из них
+                from utils.db_async import get_queue_depth
+                depth = await get_queue_depth()
+                logger.info(
+                    f"   Очередь PDF: ждут {depth['pending']} {depth['pending_by_class']}, "
+                    f"в работе {depth['processing']}"
+                )
+            from utils.job_scheduling import cost_model
+            logger.info(
+                f"   Оценка генерации: {cost_model.per_char_ms:.3f} мс/символ, "
+                f"быстрая полоса — тексты до {cost_model.fast_lane_max_chars()} символов"
+            )
+            if WEBHOOK_URL:
+                from utils.webhook_queue import update_queue
+                queue_stats = update_queue.stats()
+                logger.info(
+                    f"   Очередь апдейтов: {queue_stats['depth']} ждут, {queue_stats['processing']} в обработке, "
+                    f"самый старый {queue_stats['oldest_age_s']}с"
+                )
+            pool_stats = get_pool_stats()
+            if pool_stats:
+                logger.info(
+                    f"   Пул БД: занято {pool_stats['in_use']}, свободно {pool_stats['idle']} "
+                    f"из {pool_stats['maxconn']}; ожиданий {pool_stats['waits']} "
+                    f"(среднее {pool_stats['avg_wait_ms']}ms, макс {round(pool_stats['max_wait_ms'], 1)}ms), "
+                    f"таймаутов {pool_stats['timeouts']}, пересоздано {pool_stats['recycled']}, "
+                    f"битых {pool_stats['broken']}"
+                )
         except Exception as e:
             logger.error(f"Ошибка при выводе статистики: {e}")
 
@@ -75,7 +136,32 @@ async def main():
         logger.error("Запустите: python database/db_init.py")
         import sys
         sys.exit(1)
-    
+
+    # Схему проверяем один раз при старте — дальше запросы не обращаются к information_schema
+    try:
+        from database.schema import verify_schema_version
+        revision = verify_schema_version()
+        logger.info(f"✓ Схема БД актуальна ({revision})")
+    except Exception as e:
+        logger.error(f"✗ {e}")
+        import sys
+        sys.exit(1)
+
+    # Секции jobs на ближайшие месяцы
+    from database.partitions import ensure_job_partitions
+    ensure_job_partitions()
+
+    # Оценка времени генерации (планирование, допуск в очередь, быстрая полоса) — по истории задач
+    from utils.job_queue import seed_render_cost_model
+    seed_render_cost_model()
+
+    # Каталог шрифтов создателя строим заранее, чтобы кнопка «Попробовать шрифт создателя» отвечала сразу
+    try:
+        from utils.creator_fonts import get_creator_catalogue
+        await asyncio.to_thread(get_creator_catalogue)
+    except Exception as e:
+        logger.warning(f"Не удалось построить каталог шрифтов создателя: {e}")
+
     # Определяем режим работы: webhook (прод) или polling (локально)
     use_webhook = bool((WEBHOOK_URL or '').strip())
     lock_conn = None
@@ -83,7 +169,6 @@ async def main():
         # Глобальная защита от параллельного запуска только для polling
         try:
             from database.connection import get_db_connection
-            import psycopg2
             lock_conn = get_db_connection()
             lock_conn.autocommit = True
             with lock_conn.cursor() as cur:
@@ -105,13 +190,24 @@ async def main():
         token=BOT_TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
+    # Все исходящие запросы проходят через общий и по-чатовые лимиты
+    from utils.telegram_limiter import TelegramRateLimitMiddleware
+    bot.session.middleware(TelegramRateLimitMiddleware())
     dp = Dispatcher()
     
     # Регистрируем middleware для обновления last_seen_at
     from utils.last_seen_middleware import LastSeenMiddleware
+    from utils.last_seen_buffer import last_seen_buffer
     dp.message.middleware(LastSeenMiddleware())
     dp.callback_query.middleware(LastSeenMiddleware())
+    # Остаток буфера last_seen_at записываем при остановке (polling и webhook)
+    dp.shutdown.register(last_seen_buffer.flush)
     # edited_message обрабатывается через message.middleware
+
+    # Контекст пользователя (профиль, настройки, шрифты) — одним запросом на апдейт
+    from utils.user_context_middleware import UserContextMiddleware
+    dp.message.middleware(UserContextMiddleware())
+    dp.callback_query.middleware(UserContextMiddleware())
     
     # Регистрируем роутеры (важен порядок!)
     # grid.router должен быть до menu.router, чтобы обрабатывать toggle_grid callback
@@ -132,40 +228,119 @@ async def main():
     
     logger.info(f"✓ Зарегистрировано роутеров: {len(dp.sub_routers)}")
     
+    # Фоновые задачи на весь кластер выполняет один процесс — держатель advisory lock
+    from utils.cluster import cluster_worker_index, leader
+    asyncio.create_task(leader.run())
+    worker_index = cluster_worker_index()
+
     # Запускаем периодическую очистку в фоне
     asyncio.create_task(periodic_cleanup())
     logger.info("✓ Периодическая очистка файлов запущена")
+    asyncio.create_task(fold_statistics())
+    
+    # Пакетная запись last_seen_at
+    asyncio.create_task(last_seen_buffer.run_periodic())
+    logger.info("✓ Буфер last_seen_at запущен")
     
     # Запускаем логирование статистики
     asyncio.create_task(log_statistics())
     logger.info("✓ Логирование метрик запущено")
     
+    # Очередь генерации PDF: уведомления о завершённых задачах и встроенные воркеры
+    from config import INLINE_RENDER_WORKERS, FAST_LANE_PROCESS, FAST_LANE_WORKERS
+    from utils.pg_listener import PgListener
+    from utils.job_queue import JOB_EVENTS_CHANNEL, RENDER_JOBS_CHANNEL
+    from utils.job_delivery import DeliveryQueue
+    delivery_queue = DeliveryQueue(bot)
+    listener = PgListener()
+    listener.subscribe(JOB_EVENTS_CHANNEL, delivery_queue.on_job_event)
+    listener.on_reconnect(delivery_queue.refill)
+    if worker_index is not None:
+        # Изменения пользователей в других процессах сбрасывают кэши этого
+        from utils.cluster import USER_CONTEXT_CHANNEL, on_user_change, user_change_publisher
+        from utils.user_context import set_change_publisher
+        user_change_publisher.start()
+        set_change_publisher(user_change_publisher.publish)
+        listener.subscribe(USER_CONTEXT_CHANNEL, on_user_change)
+    fast_lane = None
+    if INLINE_RENDER_WORKERS > 0:
+        from utils.render_workers import FastLaneProcess, InlineRenderWorkers
+        if FAST_LANE_PROCESS and FAST_LANE_WORKERS > 0:
+            # Свой процесс: короткие задачи не делят GIL с длинными генерациями
+            fast_lane = FastLaneProcess(FAST_LANE_WORKERS)
+            asyncio.create_task(fast_lane.run())
+        render_workers = InlineRenderWorkers(INLINE_RENDER_WORKERS, 0 if fast_lane else FAST_LANE_WORKERS)
+        listener.subscribe(RENDER_JOBS_CHANNEL, render_workers.wake)
+        asyncio.create_task(render_workers.run())
+        logger.info(
+            f"✓ Воркеры генерации в процессе бота: {INLINE_RENDER_WORKERS} "
+            f"+ быстрая полоса {FAST_LANE_WORKERS} ({'отдельный процесс' if fast_lane else 'потоки'})"
+        )
+    else:
+        logger.info("✓ Генерация PDF — только в отдельных render_worker.py")
+    asyncio.create_task(listener.run())
+    asyncio.create_task(delivery_queue.run())
+    logger.info(f"✓ Очередь отправки результатов: {delivery_queue.concurrency} отправителей")
+    
     if use_webhook:
         # WEBHOOK режим: поднимаем aiohttp-сервер и устанавливаем webhook
         from aiohttp import web
-        from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+        from aiogram.webhook.aiohttp_server import setup_application
+        from utils.webhook_queue import QueuedRequestHandler
 
         final_webhook_url = WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH
-        try:
-            await bot.set_webhook(final_webhook_url, secret_token=(WEBHOOK_SECRET or None), drop_pending_updates=True)
-            logger.info(f"✓ Webhook установлен: {final_webhook_url}")
-        except Exception as e:
-            logger.error(f"✗ Не удалось установить webhook: {e}")
-            import sys
-            sys.exit(1)
+        # В кластере webhook один раз устанавливает супервизор (utils/cluster.py)
+        if worker_index is None:
+            try:
+                await bot.set_webhook(final_webhook_url, secret_token=(WEBHOOK_SECRET or None), drop_pending_updates=True)
+                logger.info(f"✓ Webhook установлен: {final_webhook_url}")
+            except Exception as e:
+                logger.error(f"✗ Не удалось установить webhook: {e}")
+                import sys
+                sys.exit(1)
 
         app = web.Application()
-        SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=(WEBHOOK_SECRET or None)).register(app, path=WEBHOOK_PATH)
+        # Ответ Telegram — сразу, апдейты обрабатываются из очереди с порядком внутри чата
+        QueuedRequestHandler(dispatcher=dp, bot=bot, secret_token=(WEBHOOK_SECRET or None)).register(app, path=WEBHOOK_PATH)
         setup_application(app, dp, bot=bot)
 
-        logger.info(f"HTTP сервер для webhook слушает {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+        host, port = WEBAPP_HOST, WEBAPP_PORT
+        if worker_index is not None:
+            # Снаружи принимает супервизор (utils/cluster.py), процесс слушает только локально
+            from utils.cluster import worker_address
+            host, port = worker_address(worker_index)
+        logger.info(f"HTTP сервер для webhook слушает {host}:{port}{WEBHOOK_PATH}")
         runner = web.AppRunner(app)
         await runner.setup()
-        site = web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT)
+        site = web.TCPSite(runner, host=host, port=port)
         await site.start()
 
-        logger.info("Бот запущен в режиме WEBHOOK и готов к работе!")
-        await asyncio.Event().wait()  # бесконечно держим процесс
+        if worker_index is None:
+            logger.info("Бот запущен в режиме WEBHOOK и готов к работе!")
+        else:
+            logger.info(f"Процесс webhook #{worker_index} запущен и готов к работе!")
+        # Работаем до SIGTERM/SIGINT, затем штатно останавливаем aiohttp: on_shutdown
+        # дорабатывает очередь апдейтов (webhook_queue) и вызывает dp.shutdown
+        import signal
+        from config import WEBHOOK_SHUTDOWN_TIMEOUT
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop_event.set)
+        await stop_event.wait()
+        logger.info("Получен сигнал остановки, завершаем обработку апдейтов...")
+        try:
+            await asyncio.wait_for(runner.cleanup(), timeout=WEBHOOK_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Остановка webhook-сервера не уложилась в {WEBHOOK_SHUTDOWN_TIMEOUT}с")
+        # dp.shutdown уже сбросил буфер, если cleanup успел; повторный сброс пустого буфера бесплатен
+        try:
+            await last_seen_buffer.flush()
+        except Exception as e:
+            logger.warning(f"Не удалось записать last_seen_at при остановке: {e}")
+        if fast_lane is not None:
+            await fast_lane.stop()
+        logger.info("Бот остановлен")
     else:
         # POLLING режим: убедимся, что webhook отключен, чтобы не конфликтовать
         try:
@@ -180,19 +355,28 @@ async def main():
         try:
             await dp.start_polling(bot)
         finally:
+            if fast_lane is not None:
+                await fast_lane.stop()
             # Освобождаем advisory lock при завершении
             try:
                 if lock_conn is not None:
                     with lock_conn.cursor() as cur:
                         LOCK_KEY = 8149608598
                         cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
-                    lock_conn.close()
+                    from database.connection import return_db_connection
+                    return_db_connection(lock_conn, close=True)
                     logger.info("✓ Advisory lock освобождён")
             except Exception as e:
                 logger.warning(f"Не удалось освободить advisory lock: {e}")
 
 
 if __name__ == "__main__":
+    from config import WEBHOOK_PROCESSES
+    from utils.cluster import cluster_worker_index, run_webhook_cluster
+    if WEBHOOK_URL and WEBHOOK_PROCESSES > 1 and cluster_worker_index() is None:
+        # Супервизор: сам апдейты не обрабатывает
+        import sys
+        sys.exit(run_webhook_cluster(WEBHOOK_PROCESSES))
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -20,6 +20,19 @@ DB_USER = os.getenv('DB_USER', 'postgres')
 DB_PASSWORD = os.getenv('DB_PASSWORD', '')
 DB_HOST = os.getenv('DB_HOST', 'localhost')
 DB_PORT = os.getenv('DB_PORT', '5432')
+# Размер пула соединений и число потоков для запросов из асинхронных хендлеров
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '20'))
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '8'))
+# Пул соединений: ожидание свободного соединения, срок жизни, проверка простаивающих (секунды)
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', '1800'))
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', '30'))
+# Время последнего визита копится в памяти и пишется в БД пачкой раз в N секунд
+LAST_SEEN_FLUSH_INTERVAL = float(os.getenv('LAST_SEEN_FLUSH_INTERVAL', '5'))
+# Кэш контекста пользователя (настройки и шрифты) в памяти процесса
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '300'))
+USER_CACHE_MAX_SIZE = int(os.getenv('USER_CACHE_MAX_SIZE', '10000'))
 
 # Webhook/Deploy Configuration
 # Если задан WEBHOOK_URL — запускаем режим webhook (VPS/прод), иначе — polling (локально)
@@ -28,6 +41,25 @@ WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '').strip()  # рекомендуе
 WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')  # хост HTTP-сервера для webhook
 WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', '8080'))       # порт HTTP-сервера для webhook
 WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')      # путь, по которому Telegram стучится
+# Процессов, принимающих webhook (utils/cluster.py); 1 — всё в одном процессе
+WEBHOOK_PROCESSES = int(os.getenv('WEBHOOK_PROCESSES', '1'))
+# Процессы кластера слушают 127.0.0.1:WEBHOOK_WORKER_PORT_BASE + номер процесса; снаружи на WEBAPP_PORT
+# принимает супервизор и передаёт апдейты одного чата всегда одному процессу
+WEBHOOK_WORKER_PORT_BASE = int(os.getenv('WEBHOOK_WORKER_PORT_BASE', str(WEBAPP_PORT + 1)))
+# Как часто процесс пытается стать лидером фоновых задач или проверяет, что ещё им является (секунды)
+LEADER_CHECK_INTERVAL = float(os.getenv('LEADER_CHECK_INTERVAL', '15'))
+# Процессов бота, делящих общие лимиты (Telegram, генерация); в polling всегда один
+BOT_PROCESSES = WEBHOOK_PROCESSES if WEBHOOK_URL and WEBHOOK_PROCESSES > 1 else 1
+if BOT_PROCESSES > 1:
+    # Настройки пользователя мог изменить другой процесс — контекст читается из БД на каждый апдейт
+    USER_CACHE_MAX_SIZE = 0
+# Очередь апдейтов webhook (utils/webhook_queue.py): сколько апдейтов может ждать обработки;
+# при переполнении Telegram получает 503 и повторит доставку позже
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+# Сколько апдейтов (из разных чатов) обрабатывается одновременно
+WEBHOOK_QUEUE_WORKERS = int(os.getenv('WEBHOOK_QUEUE_WORKERS', '32'))
+# Сколько секунд при остановке даётся на обработку уже принятых апдейтов
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv('WEBHOOK_SHUTDOWN_TIMEOUT', '25'))
 
 # Directories
 FONTS_DIR = 'fonts'
@@ -40,6 +72,101 @@ TEMPLATES_DIR = 'templates'
 CREATOR_FONT_DIR = 'sevafont'
 CREATOR_FONT_PATH = None  # Будет определен при первом использовании
 
+# Максимальный размер загружаемого файла шрифта (байт)
+MAX_FONT_FILE_SIZE = int(os.getenv('MAX_FONT_FILE_SIZE', str(10 * 1024 * 1024)))
+# Лимиты структуры шрифта, проверяемые до полного анализа
+MAX_FONT_GLYPHS = int(os.getenv('MAX_FONT_GLYPHS', '20000'))
+MAX_FONT_TABLES = int(os.getenv('MAX_FONT_TABLES', '64'))
+
+# Очередь генерации PDF (таблица jobs)
+# Сколько секунд задача принадлежит взявшему её воркеру; после — возвращается в очередь
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '300'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+# Задержка перед повтором: JOB_RETRY_DELAY * номер попытки (секунды)
+JOB_RETRY_DELAY = int(os.getenv('JOB_RETRY_DELAY', '10'))
+# Как часто воркеры проверяют очередь, если NOTIFY не пришёл (секунды)
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '2'))
+# Воркеры генерации внутри процесса бота; 0 — только отдельные render_worker.py
+INLINE_RENDER_WORKERS = int(os.getenv('INLINE_RENDER_WORKERS', '4'))
+# Отдельные процессы render_worker.py: сколько их запущено и слотов в каждом (--concurrency)
+RENDER_WORKER_PROCESSES = int(os.getenv('RENDER_WORKER_PROCESSES', '0'))
+RENDER_WORKER_CONCURRENCY = int(os.getenv('RENDER_WORKER_CONCURRENCY', '4'))
+# Сколько дней хранить тексты задач (job_texts) после последнего использования
+JOB_TEXT_RETENTION_DAYS = int(os.getenv('JOB_TEXT_RETENTION_DAYS', '30'))
+# Секции jobs (по месяцам) создаются заранее на столько месяцев вперёд
+JOB_PARTITION_MONTHS_AHEAD = int(os.getenv('JOB_PARTITION_MONTHS_AHEAD', '2'))
+# Как часто лидер переносит изменения статистики (stats_deltas) в сводки (секунды)
+STATS_FOLD_INTERVAL = float(os.getenv('STATS_FOLD_INTERVAL', '60'))
+# Предельное время генерации одной задачи (секунды); дольше — задача завершается со статусом timeout
+JOB_RENDER_TIMEOUT = float(os.getenv('JOB_RENDER_TIMEOUT', '120'))
+# Как часто генерация проверяет в БД, не отменил ли пользователь задачу (секунды)
+JOB_CANCEL_CHECK_INTERVAL = float(os.getenv('JOB_CANCEL_CHECK_INTERVAL', '1'))
+
+# Отправка результатов пользователям (очередь доставки на строках jobs)
+# Сколько PDF бот загружает в Telegram одновременно
+DELIVERY_CONCURRENCY = int(os.getenv('DELIVERY_CONCURRENCY', '4'))
+# Не больше стольких загрузок PDF в секунду на всех процессов бота (каждому — равная доля)
+DELIVERY_UPLOADS_PER_SECOND = float(os.getenv('DELIVERY_UPLOADS_PER_SECOND', '5'))
+# Попыток отправки, после которых пользователю предлагается кнопка «Повторить»
+DELIVERY_MAX_ATTEMPTS = int(os.getenv('DELIVERY_MAX_ATTEMPTS', '8'))
+# Задержка перед повтором: DELIVERY_RETRY_BASE * 2^(попытка-1), но не больше DELIVERY_RETRY_MAX (секунды)
+DELIVERY_RETRY_BASE = float(os.getenv('DELIVERY_RETRY_BASE', '2'))
+DELIVERY_RETRY_MAX = float(os.getenv('DELIVERY_RETRY_MAX', '300'))
+# Сколько секунд отправка принадлежит взявшему её процессу бота
+DELIVERY_LEASE_SECONDS = int(os.getenv('DELIVERY_LEASE_SECONDS', '120'))
+
+# Планирование очереди (utils/job_scheduling.py)
+# Тексты до JOB_SHORT_TEXT_CHARS символов — класс interactive, от JOB_BULK_TEXT_CHARS — bulk
+JOB_SHORT_TEXT_CHARS = int(os.getenv('JOB_SHORT_TEXT_CHARS', '2000'))
+JOB_BULK_TEXT_CHARS = int(os.getenv('JOB_BULK_TEXT_CHARS', '20000'))
+# Оценка времени генерации: JOB_COST_BASE_MS + JOB_COST_PER_CHAR_MS * число символов
+JOB_COST_BASE_MS = float(os.getenv('JOB_COST_BASE_MS', '300'))
+JOB_COST_PER_CHAR_MS = float(os.getenv('JOB_COST_PER_CHAR_MS', '0.2'))
+# Вес нового замера в скользящей (EWMA) оценке стоимости символа
+RENDER_COST_EWMA_ALPHA = float(os.getenv('RENDER_COST_EWMA_ALPHA', '0.1'))
+# Быстрая полоса: отдельные воркеры только для коротких текстов. Порог длины подстраивается
+# так, чтобы генерация укладывалась в FAST_LANE_TARGET_MS по текущей оценке стоимости символа
+FAST_LANE_WORKERS = int(os.getenv('FAST_LANE_WORKERS', '1'))
+FAST_LANE_TARGET_MS = float(os.getenv('FAST_LANE_TARGET_MS', '800'))
+# 1 — слоты быстрой полосы бота работают в дочернем процессе render_worker.py --lane fast
+# (свой GIL: длинные генерации и event loop бота её не замедляют); 0 — потоки в процессе бота,
+# тогда быстрая полоса — только приоритет в очереди, процессор она делит с остальными слотами
+FAST_LANE_PROCESS = int(os.getenv('FAST_LANE_PROCESS', '1'))
+
+# Допуск задач в очередь (utils/admission.py)
+# Сколько задач генерируется одновременно во всех воркерах — для оценки ожидания. Берётся из
+# реестра живых воркеров (таблица render_workers); эта настройка — пока реестр пуст. По умолчанию —
+# слоты процессов бота и RENDER_WORKER_PROCESSES отдельных render_worker.py
+ADMISSION_RENDER_CAPACITY = int(os.getenv('ADMISSION_RENDER_CAPACITY', str(
+    (INLINE_RENDER_WORKERS + FAST_LANE_WORKERS if INLINE_RENDER_WORKERS > 0 else 0) * BOT_PROCESSES
+    + RENDER_WORKER_PROCESSES * (RENDER_WORKER_CONCURRENCY + FAST_LANE_WORKERS)
+)))
+# Воркер считается живым, если отмечался в render_workers не позже стольких секунд назад
+RENDER_WORKER_HEARTBEAT_TTL = float(os.getenv('RENDER_WORKER_HEARTBEAT_TTL', str(max(60.0, JOB_POLL_INTERVAL * 15))))
+# Ожидание дольше ADMISSION_DEFER_WAIT секунд — задача принимается с предупреждением о сроке,
+# дольше ADMISSION_REJECT_WAIT — не принимается
+ADMISSION_DEFER_WAIT = float(os.getenv('ADMISSION_DEFER_WAIT', '30'))
+ADMISSION_REJECT_WAIT = float(os.getenv('ADMISSION_REJECT_WAIT', '600'))
+# Жёсткий предел числа ожидающих задач
+ADMISSION_MAX_PENDING = int(os.getenv('ADMISSION_MAX_PENDING', '500'))
+
+# Лимит запросов на PDF от одного пользователя (utils/rate_limit.py)
+# memory — в памяти процесса; postgres — общий для всех процессов бота
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory').strip().lower()
+if BOT_PROCESSES > 1:
+    # С лимитом в памяти каждый процесс пропускал бы пользователю свой полный лимит
+    RATE_LIMIT_BACKEND = 'postgres'
+# Как часто удалять из памяти пользователей без запросов за последний час (секунды)
+RATE_LIMIT_SWEEP_INTERVAL = float(os.getenv('RATE_LIMIT_SWEEP_INTERVAL', '600'))
+
+# Исходящие запросы к Telegram (utils/telegram_limiter.py)
+# Общий бюджет запросов в секунду и допустимый всплеск — на весь бот; процессы делят его поровну
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '25'))
+TELEGRAM_GLOBAL_BURST = int(os.getenv('TELEGRAM_GLOBAL_BURST', '30'))
+# Бюджет на один чат: запросов в секунду и всплеск
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', '3'))
+
 # Page Formats
 PAGE_FORMATS = {
     'A4': 'A4',
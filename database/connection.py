@@ -1,73 +1,362 @@
 """
 Модуль для работы с подключением к базе данных PostgreSQL.
 Поддерживает пул соединений для лучшей производительности.
+Пул потокобезопасный: запросы выполняются из потоков db_executor и pdf_executor.
+
+Предпочтительный способ работы — контекстные менеджеры db_connection() и
+db_cursor(): соединение возвращается в пул ровно один раз, даже при исключении.
 """
 
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
 import psycopg2
-from psycopg2 import pool
-import os
-from dotenv import load_dotenv
+import psycopg2.extensions
+
+from config import (
+    DB_HOST,
+    DB_NAME,
+    DB_PASSWORD,
+    DB_POOL_ACQUIRE_TIMEOUT,
+    DB_POOL_MAX,
+    DB_POOL_MAX_LIFETIME,
+    DB_POOL_MIN,
+    DB_POOL_PING_AFTER,
+    DB_PORT,
+    DB_USER,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(ConnectionError):
+    """Не дождались свободного соединения за отведённое время"""
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений.
+
+    - при исчерпании getconn ждёт освобождения соединения не дольше acquire_timeout;
+    - соединение, простоявшее без дела дольше ping_after секунд, проверяется SELECT 1;
+    - соединения старше max_lifetime секунд и повреждённые закрываются и заменяются;
+    - повторный возврат того же соединения игнорируется.
+    """
+
+    def __init__(
+        self,
+        minconn: int,
+        maxconn: int,
+        acquire_timeout: float = 10.0,
+        max_lifetime: float = 1800.0,
+        ping_after: float = 30.0,
+        **connect_kwargs,
+    ):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        self._connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        # (conn, created_at, returned_at)
+        self._idle = deque()
+        # id(conn) -> (created_at, checked_out_at)
+        self._in_use = {}
+        # Открытые соединения, включая создающиеся прямо сейчас
+        self._size = 0
+        self._closed = False
+
+        self._stats = {
+            "acquired": 0,
+            "waits": 0,
+            "wait_time_ms": 0.0,
+            "max_wait_ms": 0.0,
+            "timeouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "broken": 0,
+        }
+
+        try:
+            for _ in range(minconn):
+                conn = self._connect()
+                self._idle.append((conn, time.monotonic(), time.monotonic()))
+                self._size += 1
+        except Exception:
+            self.closeall()
+            raise
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._connect_kwargs)
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    def _discard(self, conn, reason: str) -> None:
+        """Закрывает соединение и освобождает место в пуле (вызывать без блокировки)"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats[reason] += 1
+            self._cond.notify()
+
+    def _is_alive(self, conn, created_at: float, returned_at: float) -> bool:
+        now = time.monotonic()
+        if conn.closed:
+            self._discard(conn, "broken")
+            return False
+        if now - created_at > self.max_lifetime:
+            self._discard(conn, "recycled")
+            return False
+        if now - returned_at > self.ping_after:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                self._discard(conn, "broken")
+                return False
+        return True
+
+    def getconn(self, timeout: float = None):
+        """Выдаёт живое соединение; ждёт не дольше timeout секунд"""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        while True:
+            create = False
+            with self._cond:
+                if self._closed:
+                    raise ConnectionError("Пул соединений закрыт")
+                while not self._idle and self._size >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"Не удалось получить соединение из пула за {timeout:.1f} с "
+                            f"(занято {len(self._in_use)} из {self.maxconn})"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, created_at, returned_at = self._idle.pop()
+                else:
+                    self._size += 1
+                    create = True
+
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                created_at = time.monotonic()
+            elif not self._is_alive(conn, created_at, returned_at):
+                continue
+
+            now = time.monotonic()
+            with self._cond:
+                self._in_use[id(conn)] = (created_at, now)
+                self._stats["acquired"] += 1
+                if waited:
+                    wait_ms = (now - started) * 1000
+                    self._stats["waits"] += 1
+                    self._stats["wait_time_ms"] += wait_ms
+                    self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], wait_ms)
+            return conn
+
+    def putconn(self, conn, close: bool = False) -> None:
+        """Возвращает соединение в пул"""
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            # Чужое или уже возвращённое соединение
+            logger.warning("Попытка вернуть в пул соединение, которое не выдавалось (повторный возврат?)")
+            return
+
+        created_at, _ = entry
+        if close or self._closed or conn.closed:
+            self._discard(conn, "broken" if conn.closed else "recycled")
+            return
+
+        # Незавершённая транзакция и autocommit не должны попасть к следующему пользователю
+        try:
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+        except Exception:
+            self._discard(conn, "broken")
+            return
+
+        if time.monotonic() - created_at > self.max_lifetime:
+            self._discard(conn, "recycled")
+            return
+
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(
+                size=self._size,
+                in_use=len(self._in_use),
+                idle=len(self._idle),
+                maxconn=self.maxconn,
+            )
+        stats["avg_wait_ms"] = round(stats["wait_time_ms"] / stats["waits"], 2) if stats["waits"] else 0.0
+        return stats
+
+
+def get_connect_params() -> dict:
+    """Параметры подключения к PostgreSQL (config.py)"""
+    return dict(
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT,
+        connect_timeout=5,
+    )
+
+
+def create_listen_connection(*channels: str):
+    """
+    Отдельное (не из пула) соединение в autocommit, подписанное на LISTEN channels.
+
+    Уведомления читаются через conn.poll() / conn.notifies; закрывать — conn.close().
+    """
+    conn = psycopg2.connect(**get_connect_params())
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        for channel in channels:
+            cursor.execute(f"LISTEN {channel}")
+    return conn
 
-load_dotenv()
 
 # Глобальный пул соединений
 _connection_pool = None
+_pool_lock = threading.Lock()
 
 
 def init_connection_pool():
     """Инициализирует пул соединений"""
     global _connection_pool
-    if _connection_pool is None:
-        try:
-            _connection_pool = psycopg2.pool.SimpleConnectionPool(
-                minconn=1,      # Минимум соединений
-                maxconn=20,     # Максимум соединений
-                dbname=os.getenv('DB_NAME', 'consp_bot'),
-                user=os.getenv('DB_USER', 'postgres'),
-                password=os.getenv('DB_PASSWORD', ''),
-                host=os.getenv('DB_HOST', 'localhost'),
-                port=os.getenv('DB_PORT', '5432'),
-                connect_timeout=5
-            )
-        except psycopg2.OperationalError as e:
-            raise ConnectionError(f"Не удалось создать пул соединений: {e}")
-        except Exception as e:
-            raise ConnectionError(f"Ошибка создания пула: {e}")
+    with _pool_lock:
+        if _connection_pool is None:
+            try:
+                _connection_pool = ConnectionPool(
+                    minconn=DB_POOL_MIN,
+                    maxconn=DB_POOL_MAX,
+                    acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    ping_after=DB_POOL_PING_AFTER,
+                    **get_connect_params()
+                )
+            except psycopg2.OperationalError as e:
+                raise ConnectionError(f"Не удалось создать пул соединений: {e}")
+            except Exception as e:
+                raise ConnectionError(f"Ошибка создания пула: {e}")
     return _connection_pool
 
 
 def get_db_connection():
-    """Возвращает подключение из пула"""
-    global _connection_pool
+    """Возвращает подключение из пула (верните его через return_db_connection)"""
     if _connection_pool is None:
         init_connection_pool()
-    
+
     try:
         return _connection_pool.getconn()
-    except psycopg2.pool.PoolError:
-        raise ConnectionError("Не удалось получить соединение из пула (все соединения заняты)")
+    except ConnectionError:
+        raise
     except Exception as e:
         raise ConnectionError(f"Ошибка получения соединения: {e}")
 
 
-def return_db_connection(conn):
-    """Возвращает соединение в пул (используйте вместо conn.close())"""
-    global _connection_pool
+def return_db_connection(conn, close: bool = False):
+    """Возвращает соединение в пул (используйте вместо conn.close()); close=True — закрыть его"""
     if _connection_pool and conn:
         try:
-            _connection_pool.putconn(conn)
-        except Exception as e:
+            _connection_pool.putconn(conn, close=close)
+        except Exception:
             # Если соединение повреждено, закрываем его
             try:
                 conn.close()
-            except:
+            except Exception:
                 pass
 
 
+@contextmanager
+def db_connection():
+    """Соединение из пула на время блока with"""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        return_db_connection(conn)
+
+
+@contextmanager
+def db_cursor(commit: bool = False):
+    """
+    Курсор на время блока with.
+
+    commit=True — фиксирует транзакцию при успешном выходе из блока;
+    при исключении транзакция откатывается.
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            if commit:
+                conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            cursor.close()
+
+
+def get_pool_stats() -> dict:
+    """Состояние пула: занято/свободно, ожидания, пересоздания"""
+    if _connection_pool is None:
+        return {}
+    return _connection_pool.stats()
+
+
 # Инициализируем пул при импорте
 try:
     init_connection_pool()
 except Exception as e:
     # Если не удалось инициализировать, будет ошибка при первом использовании
     pass
-
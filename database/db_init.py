@@ -1,6 +1,6 @@
 """
 Скрипт для инициализации базы данных PostgreSQL.
-Создает необходимые таблицы для работы бота.
+Создает базу данных и применяет миграции Alembic (схема описана только в alembic/versions).
 """
 
 import psycopg2
@@ -49,88 +49,20 @@ def create_database():
         raise
 
 
-def create_tables():
-    """Создает необходимые таблицы в базе данных."""
-    db_name = os.getenv('DB_NAME', 'consp_bot')
-    db_user = os.getenv('DB_USER', 'postgres')
-    db_password = os.getenv('DB_PASSWORD', '')
-    db_host = os.getenv('DB_HOST', 'localhost')
-    
-    try:
-        conn = psycopg2.connect(
-            dbname=db_name,
-            user=db_user,
-            password=db_password,
-            host=db_host
-        )
-        cursor = conn.cursor()
-        
-        # Создание таблицы users
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                font_path TEXT,
-                page_format VARCHAR(20) DEFAULT 'A4',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        
-        # Создание таблицы jobs
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS jobs (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
-                text_content TEXT NOT NULL,
-                pdf_path TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                completed_at TIMESTAMP,
-                execution_time_ms INTEGER,
-                status VARCHAR(20) DEFAULT 'pending'
-            );
-        """)
-
-        # Таблица fonts для хранения загруженных шрифтов
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS fonts (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
-                path TEXT NOT NULL,
-                font_type VARCHAR(32) NOT NULL,
-                supports_cyrillic_lower BOOLEAN DEFAULT FALSE,
-                supports_cyrillic_upper BOOLEAN DEFAULT FALSE,
-                supports_latin_lower BOOLEAN DEFAULT FALSE,
-                supports_latin_upper BOOLEAN DEFAULT FALSE,
-                supports_digits BOOLEAN DEFAULT FALSE,
-                supports_symbols BOOLEAN DEFAULT FALSE,
-                coverage_score INTEGER DEFAULT 0,
-                is_base BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE (user_id, path)
-            );
-        """)
+def apply_migrations():
+    """Создает и обновляет таблицы, применяя миграции Alembic до последней версии."""
+    from alembic import command
+    from alembic.config import Config
 
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_fonts_user_type
-            ON fonts (user_id, font_type);
-        """)
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    alembic_cfg = Config(os.path.join(project_root, 'alembic.ini'))
+    alembic_cfg.set_main_option('script_location', os.path.join(project_root, 'alembic'))
 
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_fonts_user_is_base
-            ON fonts (user_id, is_base);
-        """)
-        
-        conn.commit()
-        print("Таблицы успешно созданы.")
-        
-        cursor.close()
-        conn.close()
+    try:
+        command.upgrade(alembic_cfg, 'head')
+        print("Миграции успешно применены.")
     except Exception as e:
-        print(f"Ошибка при создании таблиц: {e}")
+        print(f"Ошибка при применении миграций: {e}")
         raise
 
 
@@ -138,7 +70,7 @@ def init_database():
     """Главная функция для инициализации базы данных."""
     print("Инициализация базы данных...")
     create_database()
-    create_tables()
+    apply_migrations()
     print("База данных успешно инициализирована!")
 
 
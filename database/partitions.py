@@ -0,0 +1,82 @@
+"""
+Секции таблицы jobs.
+
+jobs секционирована по created_at помесячно (миграция 0010). Секции на
+ближайшие месяцы создаются заранее: при старте бота и при ежечасной очистке.
+Строки вне существующих секций попадают в jobs_default. Процессы бота
+стартуют одновременно, поэтому создание секций идёт под advisory lock:
+остальные процессы дожидаются его и находят секции уже созданными.
+
+Старшие биты id задачи — месяц создания (миграция 0019), поэтому запрос по
+одной задаче сразу ограничивается её секцией: условие JOB_BY_ID с
+параметрами job_id_params(job_id).
+"""
+
+import logging
+from datetime import date, datetime
+from typing import List, Tuple
+
+from config import JOB_PARTITION_MONTHS_AHEAD
+from database.connection import db_cursor
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory lock на создание секций (лидеры фоновых задач используют 8149608598/8149608599)
+PARTITIONS_LOCK_KEY = 8149608600
+
+# Месяц создания задачи хранится в битах id начиная с этого (SQL-функция job_month_id)
+JOB_ID_MONTH_SHIFT = 40
+# Задача по id в пределах её секции; параметры — job_id_params(job_id)
+JOB_BY_ID = "id = %s AND created_at >= %s AND created_at < %s"
+
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def job_partition_name(month: date) -> str:
+    return f"jobs_y{month.year}m{month.month:02d}"
+
+
+def job_id_params(job_id: int) -> Tuple[int, object, object]:
+    """id задачи и границы месяца её создания для условия JOB_BY_ID"""
+    month_code = job_id >> JOB_ID_MONTH_SHIFT
+    if not month_code:
+        # Задача создана до миграции 0019 — секция неизвестна
+        return job_id, '-infinity', 'infinity'
+    month = date(month_code // 12, month_code % 12 + 1, 1)
+    next_month = _add_months(month, 1)
+    return job_id, datetime(month.year, month.month, 1), datetime(next_month.year, next_month.month, 1)
+
+
+def ensure_job_partitions(months_ahead: int = JOB_PARTITION_MONTHS_AHEAD) -> List[str]:
+    """Создаёт недостающие секции jobs с текущего месяца по +months_ahead. Возвращает созданные."""
+    today = date.today()
+    first = date(today.year, today.month, 1)
+    created = []
+    with db_cursor(commit=True) as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITIONS_LOCK_KEY,))
+        for offset in range(months_ahead + 1):
+            month = _add_months(first, offset)
+            name = job_partition_name(month)
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+            if cursor.fetchone()[0]:
+                continue
+            # Ошибка одной секции не отменяет остальные
+            cursor.execute("SAVEPOINT job_partition")
+            try:
+                cursor.execute(
+                    f"CREATE TABLE {name} PARTITION OF jobs "
+                    f"FOR VALUES FROM (%s) TO (%s)",
+                    (month, _add_months(month, 1))
+                )
+                cursor.execute("RELEASE SAVEPOINT job_partition")
+                created.append(name)
+            except Exception as e:
+                # Например, в jobs_default уже есть строки за этот месяц
+                cursor.execute("ROLLBACK TO SAVEPOINT job_partition")
+                logger.error(f"Не удалось создать секцию {name}: {e}")
+    if created:
+        logger.info(f"✓ Созданы секции jobs: {', '.join(created)}")
+    return created
@@ -0,0 +1,39 @@
+"""
+Проверка версии схемы БД.
+
+Схема меняется только миграциями Alembic (alembic/versions). При старте бот
+один раз сверяет ревизию в alembic_version с EXPECTED_REVISION, после чего
+запросы в utils/db_utils.py работают с фиксированным набором колонок —
+без обращений к information_schema и без DDL.
+"""
+
+from database.connection import db_cursor
+
+# Ревизия Alembic, под которую написан код. Обновляется вместе с каждой новой миграцией.
+EXPECTED_REVISION = '0019_job_month_ids'
+
+
+class SchemaVersionError(RuntimeError):
+    """Схема БД не соответствует версии кода"""
+
+
+def get_schema_revision():
+    """Возвращает текущую ревизию Alembic или None, если миграции не применялись."""
+    with db_cursor() as cursor:
+        cursor.execute("SELECT to_regclass('alembic_version') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            return None
+        cursor.execute("SELECT version_num FROM alembic_version")
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+def verify_schema_version() -> str:
+    """Проверяет, что миграции применены до EXPECTED_REVISION."""
+    revision = get_schema_revision()
+    if revision != EXPECTED_REVISION:
+        raise SchemaVersionError(
+            f"Версия схемы БД {revision or 'не задана'}, ожидается {EXPECTED_REVISION}. "
+            f"Примените миграции: ./scripts/migrate.sh"
+        )
+    return revision
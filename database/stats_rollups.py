@@ -0,0 +1,15 @@
+"""
+Перенос строк stats_deltas в сводки stats_daily / stats_totals.
+
+Триггеры на users и jobs только добавляют строки в stats_deltas (миграция
+0017), сводки обновляет один процесс — лидер фоновых задач бота.
+"""
+
+from database.connection import db_cursor
+
+
+def fold_stats_deltas() -> int:
+    """Переносит накопленные изменения статистики в сводки. Возвращает число строк."""
+    with db_cursor(commit=True) as cursor:
+        cursor.execute("SELECT stats_fold_deltas()")
+        return cursor.fetchone()[0]
@@ -3,12 +3,13 @@
 """
 
 from aiogram import Router
-from aiogram.types import CallbackQuery, FSInputFile
+from aiogram.types import CallbackQuery
 from config import PAGE_FORMATS
-from utils.db_utils import update_user_page_format, get_user_info, get_or_create_user
+from utils.db_async import update_user_page_format, get_user_info, get_or_create_user, get_job, cancel_job, set_job_telegram_file_id
+from utils.render_control import is_local_worker, request_local_cancel
 from aiogram.exceptions import TelegramBadRequest
-from database.connection import get_db_connection, return_db_connection
 from utils.telegram_retry import call_with_retries, call_with_fast_retries
+from utils.telegram_files import send_document
 from handlers.menu import get_main_menu_keyboard
 import os
 import logging
@@ -25,7 +26,7 @@ async def process_format_callback(callback: CallbackQuery):
     
     # Убеждаемся что пользователь существует
     telegram_user = callback.from_user
-    get_or_create_user(
+    await get_or_create_user(
         user_id,
         username=getattr(telegram_user, "username", None),
         first_name=getattr(telegram_user, "first_name", None),
@@ -40,11 +41,11 @@ async def process_format_callback(callback: CallbackQuery):
         return
     
     # Проверяем текущий формат и при необходимости обновляем
-    user_before = get_user_info(user_id) or {}
+    user_before = await get_user_info(user_id) or {}
     current_before = user_before.get('page_format')
     update_ok = True
     if current_before != format_type:
-        update_ok = update_user_page_format(user_id, format_type)
+        update_ok = await update_user_page_format(user_id, format_type)
 
     if update_ok:
         # Пытаемся перейти в главное меню через общий обработчик
@@ -55,7 +56,7 @@ async def process_format_callback(callback: CallbackQuery):
         except TelegramBadRequest:
             # Резервный путь: отправим новое сообщение с главным меню
             from handlers.menu import get_main_menu_keyboard
-            user = get_user_info(user_id) or {}
+            user = await get_user_info(user_id) or {}
             current_format = PAGE_FORMATS.get(user.get('page_format'), user.get('page_format') or 'A4')
             grid_enabled = bool(user.get('grid_enabled', False))
             welcome_text = (
@@ -74,6 +75,33 @@ async def process_format_callback(callback: CallbackQuery):
         await callback.answer("❌ Ошибка при обновлении формата.", show_alert=True)
 
 
+@router.callback_query(lambda c: c.data.startswith("cancel_job_"))
+async def cancel_pdf_job(callback: CallbackQuery):
+    """Обработчик кнопки «Отменить» под сообщением о генерации"""
+    try:
+        job_id = int(callback.data.replace("cancel_job_", ""))
+    except ValueError:
+        await callback.answer("❌ Неверный запрос.", show_alert=True)
+        return
+
+    status, worker_id = await cancel_job(job_id, callback.from_user.id)
+    if status is None:
+        await callback.answer("Задача уже завершена.", show_alert=False)
+        return
+    # Генерация в этом процессе прервётся сразу, в другом — после проверки в БД
+    if status == "processing" and is_local_worker(worker_id):
+        request_local_cancel(job_id)
+
+    await callback.answer("✖️ Генерация отменена", show_alert=False)
+    try:
+        await callback.message.edit_text(
+            "✖️ Генерация PDF отменена.\n\nОтправьте другой текст через «📝 Создать PDF».",
+            reply_markup=get_main_menu_keyboard(),
+        )
+    except TelegramBadRequest:
+        pass
+
+
 @router.callback_query(lambda c: c.data.startswith("retry_pdf_"))
 async def retry_pdf_delivery(callback: CallbackQuery):
     """Обработчик повторной отправки PDF"""
@@ -89,59 +117,52 @@ async def retry_pdf_delivery(callback: CallbackQuery):
             return
         
         # Получаем информацию о job из БД
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute(
-                """
-                SELECT user_id, pdf_path, execution_time_ms, status
-                FROM jobs
-                WHERE id = %s
-                """,
-                (job_id,)
-            )
-            row = cursor.fetchone()
-            
-            if not row:
-                await callback.answer("❌ PDF не найден.", show_alert=True)
-                return
-            
-            job_user_id, pdf_path, execution_time_ms, status = row
-            
-            # Проверяем, что job принадлежит пользователю
-            if job_user_id != user_id:
-                await callback.answer("❌ Доступ запрещен.", show_alert=True)
-                return
-            
-            # Проверяем, что PDF существует
-            if not pdf_path or not os.path.exists(pdf_path):
-                await callback.answer("❌ PDF файл не найден.", show_alert=True)
-                return
-            
-            # Пытаемся отправить PDF
-            await callback.answer("⏳ Отправляю PDF...", show_alert=False)
-            
-            pdf_file = FSInputFile(pdf_path)
-            await call_with_fast_retries(
-                callback.message.answer_document,
-                document=pdf_file,
-                caption=f"✓ PDF сгенерирован\nВремя: {execution_time_ms}мс" if execution_time_ms else "✓ PDF сгенерирован",
-            )
-            
-            # Получаем настройки пользователя для меню
-            user = get_user_info(user_id) or {}
-            grid_enabled = user.get('grid_enabled', False)
-            
-            await call_with_retries(
-                callback.message.answer,
-                "💡 Отправьте новый текст:\nя создам еще один конспект",
-                reply_markup=get_main_menu_keyboard(),
-            )
-            
-        finally:
-            cursor.close()
-            return_db_connection(conn)
-            
+        job = await get_job(job_id)
+        if not job:
+            await callback.answer("❌ PDF не найден.", show_alert=True)
+            return
+
+        job_user_id = job["user_id"]
+        pdf_path = job["pdf_path"]
+        file_id = job["telegram_file_id"]
+        execution_time_ms = job["execution_time_ms"]
+
+        # Проверяем, что job принадлежит пользователю
+        if job_user_id != user_id:
+            await callback.answer("❌ Доступ запрещен.", show_alert=True)
+            return
+
+        # Проверяем, что PDF существует (уже загруженный отправляется по file_id)
+        if not file_id and (not pdf_path or not os.path.exists(pdf_path)):
+            await callback.answer("❌ PDF файл не найден.", show_alert=True)
+            return
+
+        # Пытаемся отправить PDF
+        await callback.answer("⏳ Отправляю PDF...", show_alert=False)
+
+        _, uploaded = await send_document(
+            callback.message.answer_document,
+            pdf_path,
+            file_id,
+            retry=call_with_fast_retries,
+            caption=f"✓ PDF сгенерирован\nВремя: {execution_time_ms}мс" if execution_time_ms else "✓ PDF сгенерирован",
+        )
+        if uploaded:
+            try:
+                await set_job_telegram_file_id(job_id, uploaded)
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить file_id задачи {job_id}: {e}")
+
+        # Получаем настройки пользователя для меню
+        user = await get_user_info(user_id) or {}
+        grid_enabled = user.get('grid_enabled', False)
+
+        await call_with_retries(
+            callback.message.answer,
+            "💡 Отправьте новый текст:\nя создам еще один конспект",
+            reply_markup=get_main_menu_keyboard(),
+        )
+    
     except Exception as exc:
         logger.error("Ошибка при повторной отправке PDF (job_id=%s): %s", job_id_str, exc, exc_info=True)
         await callback.answer("❌ Не удалось отправить PDF. Попробуйте позже.", show_alert=True)
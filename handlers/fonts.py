@@ -4,15 +4,17 @@
 
 from aiogram import Router, F
 from aiogram.types import Message
-from utils.db_utils import (
-    save_font_file,
+from utils.db_async import (
     get_user_info,
+    get_or_create_user,
+    enqueue_job,
     analyze_and_register_font,
-    get_font_requirement_progress,
+    get_fonts_for_generation,
     has_minimum_font_set,
-    get_user_fonts_by_type,
 )
 from utils.telegram_retry import call_with_retries
+from utils.font_storage import download_font_file
+from utils.job_delivery import admission_message, cancel_keyboard
 import os
 import logging
 
@@ -48,9 +50,8 @@ async def handle_font_file(message: Message, file_ext: str):
     
     try:
         # Убеждаемся что пользователь существует
-        from utils.db_utils import get_or_create_user
         telegram_user = message.from_user
-        get_or_create_user(
+        await get_or_create_user(
             user_id,
             username=getattr(telegram_user, "username", None),
             first_name=getattr(telegram_user, "first_name", None),
@@ -68,14 +69,15 @@ async def handle_font_file(message: Message, file_ext: str):
         
         await call_with_retries(message.answer, "⏳ Загружаю шрифт...")
         
-        # Скачиваем файл
-        bot = message.bot
-        file_info = await bot.get_file(file.file_id)
-        file_data = await bot.download_file(file_info.file_path)
-        
-        # Сохраняем файл
-        font_path = save_font_file(file_data, file_name)
-        result = analyze_and_register_font(user_id, font_path)
+        # Скачиваем файл потоково сразу в хранилище шрифтов
+        stored_font = await download_font_file(
+            message.bot,
+            file.file_id,
+            file_name,
+            declared_size=file.file_size,
+        )
+        font_path = stored_font.path
+        result = await analyze_and_register_font(user_id, font_path)
         progress = result["progress"]
         font_type_added = result.get("font_type")
         from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
@@ -83,7 +85,7 @@ async def handle_font_file(message: Message, file_ext: str):
         keyboard_buttons = [
             [InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu_main")],
         ]
-        if has_minimum_font_set(user_id):
+        if await has_minimum_font_set(user_id):
             keyboard_buttons.insert(
                 0,
                 [InlineKeyboardButton(text="📄 Сгенерировать PDF", callback_data="menu_create_pdf")],
@@ -133,9 +135,8 @@ async def handle_markdown_file(message: Message):
     
     try:
         # Убеждаемся что пользователь существует
-        from utils.db_utils import get_or_create_user, has_minimum_font_set, get_fonts_for_generation, get_user_info
         telegram_user = message.from_user
-        get_or_create_user(
+        await get_or_create_user(
             user_id,
             username=getattr(telegram_user, "username", None),
             first_name=getattr(telegram_user, "first_name", None),
@@ -172,7 +173,7 @@ async def handle_markdown_file(message: Message):
             return
         
         # Проверяем готовность к генерации
-        if not has_minimum_font_set(user_id):
+        if not await has_minimum_font_set(user_id):
             from handlers.menu import get_main_menu_keyboard
             await call_with_retries(
                 message.answer,
@@ -183,7 +184,7 @@ async def handle_markdown_file(message: Message):
             return
         
         # Получаем информацию о пользователе
-        user = get_user_info(user_id)
+        user = await get_user_info(user_id)
         if not user or not user.get('page_format'):
             from handlers.menu import get_main_menu_keyboard
             await call_with_retries(
@@ -201,18 +202,7 @@ async def handle_markdown_file(message: Message):
             )
             return
         
-        # Генерируем PDF
-        from database.connection import get_db_connection, return_db_connection
-        from pdf_generator import generate_pdf_for_job
-        from utils.executors import pdf_executor
-        from utils.metrics import metrics
-        from aiogram.types import FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
-        from handlers.menu import get_main_menu_keyboard
-        from utils.telegram_retry import call_with_fast_retries
-        import time
-        import asyncio
-        
-        font_sets = get_fonts_for_generation(user_id)
+        font_sets = await get_fonts_for_generation(user_id)
         base_meta = font_sets.get("base")
         base_path = base_meta.get("path") if base_meta else None
         if not base_path or not os.path.exists(base_path):
@@ -224,108 +214,25 @@ async def handle_markdown_file(message: Message):
             )
             return
         
-        # Сохраняем задачу в БД
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        job_id = None
-        
-        try:
-            cursor.execute(
-                """
-                INSERT INTO jobs (user_id, text_content, status)
-                VALUES (%s, %s, %s)
-                RETURNING id
-                """,
-                (user_id, cleaned_text, 'pending')
-            )
-            
-            job_id = cursor.fetchone()[0]
-            conn.commit()
-            
-            await call_with_retries(message.answer, "⏳ Генерирую PDF из Markdown... (может занять до 1-2 минут)")
-            
-            # Получаем настройки
-            grid_enabled = user.get('grid_enabled', False)
-            first_page_side = user.get('first_page_side', 'right')
-            
-            # Генерируем PDF асинхронно в отдельном потоке
-            start_time = time.time()
-            loop = asyncio.get_event_loop()
-            pdf_path = await loop.run_in_executor(
-                pdf_executor,
-                generate_pdf_for_job,
-                job_id, 
-                cleaned_text, 
-                font_sets,
-                user['page_format'],
-                grid_enabled,
-                first_page_side,
-            )
-            execution_time_ms = int((time.time() - start_time) * 1000)
-            
-            # Записываем метрики
-            metrics.record_pdf_time(execution_time_ms)
-            metrics.record_request(user_id)
-            logger.info(f"PDF generated from MD for user {user_id}, job {job_id}, time: {execution_time_ms}ms")
-            
-            # Обновляем путь к PDF в БД
-            from utils.db_utils import update_job_pdf_path
-            update_job_pdf_path(job_id, pdf_path, execution_time_ms)
-            
-            # Отправляем PDF пользователю
-            if os.path.exists(pdf_path):
-                try:
-                    pdf_file = FSInputFile(pdf_path)
-                    await call_with_fast_retries(
-                        message.answer_document,
-                        document=pdf_file,
-                        caption=f"✓ PDF сгенерирован из Markdown\nВремя: {execution_time_ms}мс",
-                    )
-                    
-                    await call_with_retries(
-                        message.answer,
-                        "💡 Отправьте новый Markdown файл или текст:\nя создам еще один конспект",
-                        reply_markup=get_main_menu_keyboard(),
-                    )
-                except Exception as exc:
-                    logger.error("Не удалось отправить PDF (job_id=%s): %s", job_id, exc, exc_info=True)
-                    retry_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text="🔄 Повторить отправку PDF", callback_data=f"retry_pdf_{job_id}")]
-                    ])
-                    await call_with_retries(
-                        message.answer,
-                        "⚠️ Не удалось отправить PDF из-за проблем с сетью.\n\nНажмите кнопку ниже, чтобы повторить отправку.",
-                        reply_markup=retry_keyboard,
-                    )
-            else:
-                from handlers.menu import get_main_menu_keyboard
-                await call_with_retries(
-                    message.answer,
-                    "❌ Ошибка: PDF файл не найден",
-                    reply_markup=get_main_menu_keyboard(),
-                )
-                from utils.db_utils import update_job_status_failed
-                update_job_status_failed(job_id)
-        
-        except Exception as e:
-            error_type = type(e).__name__
-            metrics.record_error(error_type)
-            logger.error(f"Error generating PDF from MD for user {user_id}, job {job_id}: {str(e)}", exc_info=True)
-            
-            if job_id:
-                from utils.db_utils import update_job_status_failed
-                update_job_status_failed(job_id)
-            from handlers.menu import get_main_menu_keyboard
-            await call_with_retries(
-                message.answer,
-                f"❌ Ошибка при генерации PDF: {str(e)}\n\nПопробуйте снова или вернитесь в меню.",
-                reply_markup=get_main_menu_keyboard(),
-            )
-        finally:
-            if cursor:
-                cursor.close()
-            if conn:
-                return_db_connection(conn)
+        # Ставим задачу в очередь — PDF сгенерирует воркер, результат отправит utils/job_delivery.py
+        admission = await enqueue_job(
+            user_id,
+            message.chat.id,
+            cleaned_text,
+            {
+                "source": "markdown",
+                "page_format": user['page_format'],
+                "grid_enabled": user.get('grid_enabled', False),
+                "first_page_side": user.get('first_page_side', 'right'),
+            },
+        )
+        if admission.accepted:
+            logger.info(f"PDF job {admission.job_id} from MD queued for user {user_id} ({admission.decision})")
+        await call_with_retries(
+            message.answer,
+            admission_message(admission, "markdown"),
+            reply_markup=cancel_keyboard(admission.job_id) if admission.accepted else None,
+        )
     
     except UnicodeDecodeError:
         await call_with_retries(
@@ -4,20 +4,22 @@
 
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
-from utils.db_utils import get_user_info, update_user_grid_setting, get_or_create_user
+from utils.db_async import update_user_grid_setting, get_or_create_user, fresh_user_context
+from utils.user_context import UserContext
+from typing import Optional
 from handlers.menu import get_main_menu_keyboard, menu_main
 
 router = Router()
 
 
 @router.callback_query(F.data == "toggle_grid")
-async def toggle_grid(callback: CallbackQuery):
+async def toggle_grid(callback: CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Переключение фоновой сетки"""
     user_id = callback.from_user.id
     
     # Убеждаемся что пользователь существует
     telegram_user = callback.from_user
-    get_or_create_user(
+    await get_or_create_user(
         user_id,
         username=getattr(telegram_user, "username", None),
         first_name=getattr(telegram_user, "first_name", None),
@@ -25,14 +27,14 @@ async def toggle_grid(callback: CallbackQuery):
     )
     
     # Получаем текущее состояние
-    user = get_user_info(user_id)
+    user = (await fresh_user_context(user_id, user_ctx)).user
     current_state = user.get('grid_enabled', False) if user else False
     
     # Переключаем
     new_state = not current_state
     
     # Обновляем в БД
-    if update_user_grid_setting(user_id, new_state):
+    if await update_user_grid_setting(user_id, new_state):
         status = "включен" if new_state else "выключен"
         await callback.answer(f"✅ Фон клетка {status}")
         
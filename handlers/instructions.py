@@ -3,19 +3,20 @@
 """
 
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
-from utils.db_utils import get_user_info, get_or_create_user, mark_instruction_seen
+from utils.db_async import get_user_info, get_or_create_user, mark_instruction_seen
 from utils.telegram_retry import call_with_retries
+from utils.telegram_files import send_static_document
 import os
 from config import TEMPLATES_DIR
 
 router = Router()
 
 
-def is_new_user(user_id: int) -> bool:
+async def is_new_user(user_id: int) -> bool:
     """Проверяет, является ли пользователь новым (не видел инструкцию)"""
-    user_info = get_user_info(user_id)
+    user_info = await get_user_info(user_id)
     if not user_info:
         return True
     
@@ -104,8 +105,7 @@ async def send_instruction_with_templates(message_or_callback):
     for pdf_file in pdf_files:
         pdf_path = os.path.join(TEMPLATES_DIR, pdf_file)
         try:
-            pdf_document = FSInputFile(pdf_path)
-            await call_with_retries(answer_document_method, document=pdf_document, caption=pdf_file)
+            await send_static_document(answer_document_method, pdf_path, caption=pdf_file)
             sent_count += 1
         except Exception as e:
             # Продолжаем отправку остальных
@@ -6,14 +6,13 @@ import asyncio
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
-from utils.db_utils import (
+from utils.db_async import (
     get_or_create_user,
-    get_user_info,
     reset_user_fonts,
-    get_font_requirement_progress,
-    has_minimum_font_set,
-    get_user_fonts_by_type,
+    fresh_user_context,
 )
+from utils.user_context import UserContext
+from typing import Optional
 from config import PAGE_FORMATS
 from utils.telegram_retry import call_with_retries
 
@@ -120,7 +119,7 @@ _processed_messages = set()  # Множество обработанных messa
 
 # Используем один декоратор для обеих команд, чтобы избежать дублирования
 @router.message(Command("start", "menu"))
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, user_ctx: Optional[UserContext] = None):
     """Обработчик команды /start - главное меню"""
     global _processed_messages
     
@@ -148,17 +147,18 @@ async def cmd_start(message: Message):
         logger.info(f"Processing /start for user {user_id}, message_id={message_id}")
         
         telegram_user = message.from_user
-        user = get_or_create_user(
+        user = await get_or_create_user(
             user_id,
             username=getattr(telegram_user, "username", None),
             first_name=getattr(telegram_user, "first_name", None),
             last_name=getattr(telegram_user, "last_name", None),
         )
-        user_info = get_user_info(user_id)
+        user_ctx = await fresh_user_context(user_id, user_ctx)
+        user_info = user_ctx.user
         
-        fonts_by_type = get_user_fonts_by_type(user_id)
-        progress = get_font_requirement_progress(user_id)
-        ready_to_generate = has_minimum_font_set(user_id)
+        fonts_by_type = user_ctx.fonts_by_type
+        progress = user_ctx.progress
+        ready_to_generate = user_ctx.ready_to_generate
 
         welcome_text = "👋 Главное меню\n\n"
         
@@ -205,21 +205,22 @@ async def cmd_start(message: Message):
 
 
 @router.callback_query(F.data == "menu_main")
-async def menu_main(callback: CallbackQuery):
+async def menu_main(callback: CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Главное меню"""
     user_id = callback.from_user.id
     telegram_user = callback.from_user
-    user = get_or_create_user(
+    user = await get_or_create_user(
         user_id,
         username=getattr(telegram_user, "username", None),
         first_name=getattr(telegram_user, "first_name", None),
         last_name=getattr(telegram_user, "last_name", None),
     )
-    user_info = get_user_info(user_id)
+    user_ctx = await fresh_user_context(user_id, user_ctx)
+    user_info = user_ctx.user
     
-    fonts_by_type = get_user_fonts_by_type(user_id)
-    progress = get_font_requirement_progress(user_id)
-    ready_to_generate = has_minimum_font_set(user_id)
+    fonts_by_type = user_ctx.fonts_by_type
+    progress = user_ctx.progress
+    ready_to_generate = user_ctx.ready_to_generate
 
     welcome_text = "👋 Главное меню\n\n"
     
@@ -246,11 +247,12 @@ async def menu_main(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "menu_upload_font")
-async def menu_upload_font(callback: CallbackQuery):
+async def menu_upload_font(callback: CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Меню загрузки шрифта"""
     user_id = callback.from_user.id
-    progress = get_font_requirement_progress(user_id)
-    ready = has_minimum_font_set(user_id)
+    user_ctx = await fresh_user_context(user_id, user_ctx)
+    progress = user_ctx.progress
+    ready = user_ctx.ready_to_generate
     
     text = "📥 Загрузка шрифтов\n\n"
     
@@ -285,9 +287,9 @@ async def menu_upload_font(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "menu_set_format")
-async def menu_set_format(callback: CallbackQuery):
+async def menu_set_format(callback: CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Меню выбора формата"""
-    user = get_user_info(callback.from_user.id)
+    user = (await fresh_user_context(callback.from_user.id, user_ctx)).user
     
     text = "📄 Выбор формата страницы\n\n"
     
@@ -302,12 +304,13 @@ async def menu_set_format(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "menu_create_pdf")
-async def menu_create_pdf(callback: CallbackQuery):
+async def menu_create_pdf(callback: CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Меню создания PDF - проверка готовности"""
     user_id = callback.from_user.id
-    user = get_user_info(user_id)
+    user_ctx = await fresh_user_context(user_id, user_ctx)
+    user = user_ctx.user
     
-    ready_fonts = has_minimum_font_set(user_id)
+    ready_fonts = user_ctx.ready_to_generate
     format_selected = bool(user and user.get('page_format'))
     
     if not ready_fonts or not format_selected:
@@ -348,15 +351,15 @@ async def menu_create_pdf(callback: CallbackQuery):
     
     # Устанавливаем флаг, что пользователь в режиме создания PDF
     # Это будет использоваться в handle_text_message
-    from utils.db_utils import set_user_pdf_mode
-    set_user_pdf_mode(user_id, True)
+    from utils.db_async import set_user_pdf_mode
+    await set_user_pdf_mode(user_id, True)
 
 
 @router.callback_query(F.data == "menu_choose_page_side")
-async def menu_choose_page_side(callback: CallbackQuery):
+async def menu_choose_page_side(callback: CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Меню выбора стороны первой страницы"""
     user_id = callback.from_user.id
-    user_info = get_user_info(user_id)
+    user_info = (await fresh_user_context(user_id, user_ctx)).user
     current_side = user_info.get('first_page_side', 'right') if user_info else 'right'
     
     side_label = "Правая страница ➡️" if current_side == 'right' else "⬅️ Левая страница"
@@ -380,11 +383,11 @@ async def menu_choose_page_side(callback: CallbackQuery):
 @router.callback_query(F.data.in_(["first_page_left", "first_page_right"]))
 async def set_first_page_side(callback: CallbackQuery):
     """Обработчик выбора стороны первой страницы"""
-    from utils.db_utils import update_user_first_page_side, get_or_create_user
+    from utils.db_async import update_user_first_page_side, get_or_create_user
     
     user_id = callback.from_user.id
     telegram_user = callback.from_user
-    get_or_create_user(
+    await get_or_create_user(
         user_id,
         username=getattr(telegram_user, "username", None),
         first_name=getattr(telegram_user, "first_name", None),
@@ -393,7 +396,7 @@ async def set_first_page_side(callback: CallbackQuery):
     
     side = 'left' if callback.data == "first_page_left" else 'right'
     
-    if update_user_first_page_side(user_id, side):
+    if await update_user_first_page_side(user_id, side):
         side_label = "Правая страница ➡️" if side == 'right' else "⬅️ Левая страница"
         await call_with_retries(callback.answer, f"✓ Выбрано: {side_label}")
         
@@ -416,7 +419,7 @@ async def reset_fonts_handler(callback: CallbackQuery):
     """Обработчик сброса всех шрифтов"""
     user_id = callback.from_user.id
     
-    if reset_user_fonts(user_id):
+    if await reset_user_fonts(user_id):
         await call_with_retries(callback.answer, "✅ Шрифты сброшены")
         await menu_upload_font(callback)
     else:
@@ -426,7 +429,7 @@ async def reset_fonts_handler(callback: CallbackQuery):
 @router.callback_query(F.data == "try_creator_font")
 async def try_creator_font_handler(callback: CallbackQuery):
     """Обработчик добавления шрифта создателя для тестирования"""
-    from utils.db_utils import add_creator_font_to_user, get_font_requirement_progress, has_minimum_font_set
+    from utils.db_async import add_creator_font_to_user, get_font_requirement_progress, has_minimum_font_set
     from handlers.menu import get_main_menu_keyboard
     
     user_id = callback.from_user.id
@@ -434,7 +437,7 @@ async def try_creator_font_handler(callback: CallbackQuery):
     try:
         await call_with_retries(callback.answer, "⏳ Проверяю шрифт создателя...")
         
-        result = add_creator_font_to_user(user_id)
+        result = await add_creator_font_to_user(user_id)
         progress = result["progress"]
         font_type = result.get("font_type")
         added_count = result.get("added_count", 0)
@@ -447,7 +450,7 @@ async def try_creator_font_handler(callback: CallbackQuery):
             status_icon = "✓" if info["current"] >= info["required"] else "⬜"
             progress_text += f"{status_icon} {label}: {info['current']}/{info['required']}\n"
         
-        ready = has_minimum_font_set(user_id)
+        ready = await has_minimum_font_set(user_id)
         keyboard = get_main_menu_keyboard(ready)
         
         # Если font_type is None, значит все шрифты уже были добавлены ранее
@@ -501,7 +504,7 @@ async def try_creator_font_handler(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "menu_upload_markdown")
-async def menu_upload_markdown(callback: CallbackQuery):
+async def menu_upload_markdown(callback: CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Меню загрузки Markdown файла (только в dev ветке)"""
     from config import is_dev_branch
     
@@ -514,7 +517,7 @@ async def menu_upload_markdown(callback: CallbackQuery):
         return
     
     user_id = callback.from_user.id
-    ready = has_minimum_font_set(user_id)
+    ready = (await fresh_user_context(user_id, user_ctx)).ready_to_generate
     
     text = "📄 Загрузка Markdown файла\n\n"
     text += "Отправьте .md файл, и бот автоматически:\n"
@@ -4,7 +4,9 @@
 
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from utils.db_utils import get_user_info, get_or_create_user, get_font_requirement_progress, get_user_fonts_by_type
+from utils.db_async import get_or_create_user, fresh_user_context
+from utils.user_context import UserContext
+from typing import Optional
 from config import PAGE_FORMATS
 from utils.telegram_retry import call_with_retries
 from handlers.menu import get_main_menu_keyboard, get_format_keyboard
@@ -21,20 +23,21 @@ UPLOAD_SEQUENCE = ["cyrillic_full", "digits", "latin"]
 
 
 @router.callback_query(F.data == "menu_settings")
-async def menu_settings(callback: CallbackQuery):
+async def menu_settings(callback: CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Меню настроек"""
     user_id = callback.from_user.id
     telegram_user = callback.from_user
-    user = get_or_create_user(
+    user = await get_or_create_user(
         user_id,
         username=getattr(telegram_user, "username", None),
         first_name=getattr(telegram_user, "first_name", None),
         last_name=getattr(telegram_user, "last_name", None),
     )
-    user_info = get_user_info(user_id)
+    user_ctx = await fresh_user_context(user_id, user_ctx)
+    user_info = user_ctx.user
     
-    fonts_by_type = get_user_fonts_by_type(user_id)
-    progress = get_font_requirement_progress(user_id)
+    fonts_by_type = user_ctx.fonts_by_type
+    progress = user_ctx.progress
     
     text = "⚙️ Настройки\n\n"
     
@@ -74,10 +77,10 @@ async def menu_settings(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "settings_first_page_side")
-async def settings_first_page_side(callback: CallbackQuery):
+async def settings_first_page_side(callback: CallbackQuery, user_ctx: Optional[UserContext] = None):
     """Меню выбора стороны первой страницы из настроек"""
     user_id = callback.from_user.id
-    user_info = get_user_info(user_id)
+    user_info = (await fresh_user_context(user_id, user_ctx)).user
     current_side = user_info.get('first_page_side', 'right') if user_info else 'right'
     
     side_label = "Правая страница ➡️" if current_side == 'right' else "⬅️ Левая страница"
@@ -101,12 +104,12 @@ async def settings_first_page_side(callback: CallbackQuery):
 @router.callback_query(F.data.in_(["settings_first_page_left", "settings_first_page_right"]))
 async def set_settings_first_page_side(callback: CallbackQuery):
     """Обработчик выбора стороны первой страницы из настроек"""
-    from utils.db_utils import update_user_first_page_side
+    from utils.db_async import update_user_first_page_side
     
     user_id = callback.from_user.id
     side = 'left' if callback.data == "settings_first_page_left" else 'right'
     
-    if update_user_first_page_side(user_id, side):
+    if await update_user_first_page_side(user_id, side):
         side_label = "Правая страница ➡️" if side == 'right' else "⬅️ Левая страница"
         await call_with_retries(callback.answer, f"✓ Выбрано: {side_label}")
         # Возвращаемся в настройки
@@ -3,26 +3,25 @@
 """
 
 from aiogram import Router, F
-from aiogram.types import Message, FSInputFile
-from utils.db_utils import (
-    get_user_info,
-    update_job_pdf_path,
-    update_job_status_failed,
-    get_fonts_for_generation,
-    has_minimum_font_set,
-    get_font_requirement_progress,
+from aiogram.types import Message
+from utils.db_async import (
+    get_or_create_user,
+    enqueue_job,
+    set_user_pdf_mode,
+    fresh_user_context,
 )
-from database.connection import get_db_connection, return_db_connection
-from pdf_generator import generate_pdf_for_job
-from utils.executors import pdf_executor
-from utils.rate_limit import check_rate_limit
+from utils.user_context import UserContext
+from utils.rate_limit import check_rate_limit_async
 from utils.metrics import metrics
-from utils.telegram_retry import call_with_retries, call_with_fast_retries
-import time
-import os
+from utils.coverage import get_user_coverage_index
+from utils.job_delivery import admission_message, cancel_keyboard
+from utils.telegram_retry import call_with_retries
 import asyncio
+import os
 import logging
 import unicodedata
+import html
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
@@ -70,110 +69,68 @@ def _format_progress(progress: dict) -> str:
     return "\n".join(lines)
 
 
-def _aggregate_font_support(font_sets: dict) -> dict:
-    records = []
-    base = font_sets.get("base")
-    if base:
-        records.append(base)
-    for key in ("cyrillic", "latin", "digits", "other"):
-        records.extend(font_sets.get(key, []))
+# Символы разметки (**жирный**, *курсив*, ~~подчёркнутый~~) генератор не рисует
+FORMATTING_MARKERS = frozenset("*_~")
 
-    support = {
-        "cyrillic_lower": any(rec.get("supports_cyrillic_lower") for rec in records),
-        "cyrillic_upper": any(rec.get("supports_cyrillic_upper") for rec in records),
-        "latin_lower": any(rec.get("supports_latin_lower") for rec in records),
-        "latin_upper": any(rec.get("supports_latin_upper") for rec in records),
-        "digits": any(rec.get("supports_digits") for rec in records),
-        "symbols": any((rec.get("supports_symbols") or rec.get("supports_digits")) for rec in records),
-    }
-    return support
+# Сколько недостающих символов показываем пользователю
+MAX_REPORTED_CHARS = 20
 
 
-def _detect_missing_categories(text: str, support: dict) -> set[str]:
-    missing: set[str] = set()
-    for char in text:
-        if not char or char.isspace():
-            continue
-        if char.isdigit():
-            if not support.get("digits"):
-                missing.add("digits")
-            continue
-        category = unicodedata.category(char)
-        if _is_cyrillic(char):
-            if char.isupper():
-                if not support.get("cyrillic_upper"):
-                    missing.add("cyrillic_upper")
-            else:
-                if not support.get("cyrillic_lower"):
-                    missing.add("cyrillic_lower")
-        elif _is_latin(char):
-            if char.isupper():
-                if not support.get("latin_upper"):
-                    missing.add("latin_upper")
-            else:
-                if not support.get("latin_lower"):
-                    missing.add("latin_lower")
-        elif category and category[0] in {"P", "S"}:
-            if not support.get("symbols"):
-                missing.add("symbols")
-        # Прочие символы (например, эмодзи) игнорируем — они будут заменены базовым шрифтом
-    return missing
+def _char_category(char: str) -> Optional[str]:
+    """Категория символа в терминах требований к шрифтам (см. CATEGORY_TO_REQUIREMENT)."""
+    if char.isdigit():
+        return "digits"
+    if _is_cyrillic(char):
+        return "cyrillic_upper" if char.isupper() else "cyrillic_lower"
+    if _is_latin(char):
+        return "latin_upper" if char.isupper() else "latin_lower"
+    category = unicodedata.category(char)
+    if category and category[0] in {"P", "S"}:
+        return "symbols"
+    return None
 
 
-def _build_missing_message(missing: set[str], progress: dict) -> str:
-    if not missing:
-        return ""
-    required_types = {CATEGORY_TO_REQUIREMENT.get(cat) for cat in missing if CATEGORY_TO_REQUIREMENT.get(cat)}
-    required_types.discard(None)
-
-    lines = ["⚠️ Не хватает шрифтов для некоторых символов:"]
-    for font_type in sorted(required_types):
-        label = FONT_TYPE_LABELS.get(font_type, font_type)
-        info = progress.get(font_type, {"current": 0, "required": 0})
-        lines.append(f"• {label}: {info['current']}/{info['required']} загружено")
+def _find_missing_chars(user_id: int, text: str, font_sets: dict) -> list[str]:
+    """Символы текста, которых нет ни в одном шрифте пользователя."""
+    index = get_user_coverage_index(user_id, font_sets)
+    return [char for char in index.missing_chars(text) if char not in FORMATTING_MARKERS]
 
-    lines.append("\nЗагрузите недостающие шрифты через кнопку «📥 Загрузить шрифты».")
-    return "\n".join(lines)
 
+def _build_missing_message(missing_chars: list[str], progress: dict) -> str:
+    if not missing_chars:
+        return ""
+    shown = " ".join(html.escape(char) for char in missing_chars[:MAX_REPORTED_CHARS])
+    if len(missing_chars) > MAX_REPORTED_CHARS:
+        shown += f" … (ещё {len(missing_chars) - MAX_REPORTED_CHARS})"
 
-async def _deliver_pdf(message: Message, pdf_path: str, execution_time_ms: int, grid_enabled: bool, job_id: int) -> None:
-    from handlers.menu import get_main_menu_keyboard
-    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+    lines = ["⚠️ В ваших шрифтах нет символов:", shown]
 
-    try:
-        pdf_file = FSInputFile(pdf_path)
-        await call_with_fast_retries(
-            message.answer_document,
-            document=pdf_file,
-            caption=f"✓ PDF сгенерирован\nВремя: {execution_time_ms}мс",
-        )
+    required_types = {
+        CATEGORY_TO_REQUIREMENT.get(_char_category(char))
+        for char in missing_chars
+    }
+    required_types.discard(None)
+    if required_types:
+        lines.append("\nНе хватает шрифтов:")
+        for font_type in sorted(required_types):
+            label = FONT_TYPE_LABELS.get(font_type, font_type)
+            info = progress.get(font_type, {"current": 0, "required": 0})
+            lines.append(f"• {label}: {info['current']}/{info['required']} загружено")
 
-        await call_with_retries(
-            message.answer,
-            "💡 Отправьте новый текст:\nя создам еще один конспект",
-            reply_markup=get_main_menu_keyboard(),
-        )
-    except Exception as exc:
-        logger.error("Не удалось отправить PDF (job_id=%s): %s", job_id, exc, exc_info=True)
-        retry_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔄 Повторить отправку PDF", callback_data=f"retry_pdf_{job_id}")]
-        ])
-        await call_with_retries(
-            message.answer,
-            "⚠️ Не удалось отправить PDF из-за проблем с сетью.\n\nНажмите кнопку ниже, чтобы повторить отправку.",
-            reply_markup=retry_keyboard,
-        )
+    lines.append("\nЗагрузите шрифты с этими символами через кнопку «📥 Загрузить шрифты» или уберите их из текста.")
+    return "\n".join(lines)
 
 
 @router.message(F.text & ~F.text.startswith('/'))
-async def handle_text_message(message: Message):
+async def handle_text_message(message: Message, user_ctx: Optional[UserContext] = None):
     """Обработчик текстовых сообщений для сохранения в jobs и генерации PDF"""
     user_id = message.from_user.id
     text_content = message.text.strip()
+    # Профиль, настройки и шрифты загружены одним запросом в UserContextMiddleware
+    user_ctx = await fresh_user_context(user_id, user_ctx)
     
     # Проверяем, находится ли пользователь в режиме создания PDF
-    from utils.db_utils import is_user_in_pdf_mode, set_user_pdf_mode
-    if not is_user_in_pdf_mode(user_id):
+    if not user_ctx.pdf_mode:
         # Пользователь не в режиме создания PDF - показываем подсказку
         from handlers.menu import get_main_menu_keyboard
         await call_with_retries(
@@ -184,7 +141,7 @@ async def handle_text_message(message: Message):
         return
     
     # Проверка rate limit
-    allowed, error_msg = check_rate_limit(user_id)
+    allowed, error_msg = await check_rate_limit_async(user_id)
     if not allowed:
         await call_with_retries(message.answer, error_msg)
         logger.warning(f"Rate limit exceeded for user {user_id}")
@@ -204,23 +161,25 @@ async def handle_text_message(message: Message):
         return
     
     # Получаем информацию о пользователе
-    user = get_user_info(user_id)
+    user = user_ctx.user
     if not user:
-        from utils.db_utils import get_or_create_user
         telegram_user = message.from_user
-        user = get_or_create_user(
+        user = await get_or_create_user(
             user_id,
             username=getattr(telegram_user, "username", None),
             first_name=getattr(telegram_user, "first_name", None),
             last_name=getattr(telegram_user, "last_name", None),
         )
+        # Для нового пользователя могли добавиться шрифты создателя
+        user_ctx = await fresh_user_context(user_id, user_ctx)
+        user = user_ctx.user or user
     # last_seen_at обновляется автоматически через middleware
     
-    ready_font_set = has_minimum_font_set(user_id)
+    ready_font_set = user_ctx.ready_to_generate
     if not ready_font_set:
         from handlers.menu import get_main_menu_keyboard
         # Выключаем режим создания PDF
-        set_user_pdf_mode(user_id, False)
+        await set_user_pdf_mode(user_id, False)
         await call_with_retries(
             message.answer,
             "⚠️ Загрузите хотя бы один кириллический шрифт для генерации PDF.\n\n"
@@ -248,7 +207,7 @@ async def handle_text_message(message: Message):
         )
         return
 
-    font_sets = get_fonts_for_generation(user_id)
+    font_sets = user_ctx.font_sets
     base_meta = font_sets.get("base")
     base_path = base_meta.get("path") if base_meta else None
     if not base_path or not os.path.exists(base_path):
@@ -260,11 +219,11 @@ async def handle_text_message(message: Message):
         )
         return
 
-    support = _aggregate_font_support(font_sets)
-    missing_categories = _detect_missing_categories(text_content, support)
-    if missing_categories:
-        progress = get_font_requirement_progress(user_id)
-        warning_text = _build_missing_message(missing_categories, progress)
+    # Сборка индекса может читать cmap шрифтов с диска, а проверка длинного текста — долгая
+    missing_chars = await asyncio.to_thread(_find_missing_chars, user_id, text_content, font_sets)
+    if missing_chars:
+        progress = user_ctx.progress
+        warning_text = _build_missing_message(missing_chars, progress)
         from handlers.menu import get_main_menu_keyboard
         await call_with_retries(
             message.answer,
@@ -273,88 +232,40 @@ async def handle_text_message(message: Message):
         )
         return
     
-    # Сохраняем задачу в БД
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    job_id = None
-    
+    # Ставим задачу в очередь — PDF сгенерирует воркер, результат отправит utils/job_delivery.py
     try:
-        cursor.execute(
-            """
-            INSERT INTO jobs (user_id, text_content, status)
-            VALUES (%s, %s, %s)
-            RETURNING id
-            """,
-            (user_id, text_content, 'pending')
-        )
-        
-        job_id = cursor.fetchone()[0]
-        conn.commit()
-        
-        await call_with_retries(message.answer, "⏳ Генерирую PDF... (может занять до 1-2 минут)")
-        
-        # Получаем настройки
-        grid_enabled = user.get('grid_enabled', False)
-        first_page_side = user.get('first_page_side', 'right')
-        
-        # Генерируем PDF асинхронно в отдельном потоке
-        start_time = time.time()
-        loop = asyncio.get_event_loop()
-        pdf_path = await loop.run_in_executor(
-            pdf_executor,
-            generate_pdf_for_job,
-            job_id, 
-            text_content, 
-            font_sets,
-            user['page_format'],
-            grid_enabled,
-            first_page_side,
+        admission = await enqueue_job(
+            user_id,
+            message.chat.id,
+            text_content,
+            {
+                "source": "text",
+                "page_format": user['page_format'],
+                "grid_enabled": user.get('grid_enabled', False),
+                "first_page_side": user.get('first_page_side', 'right'),
+            },
         )
-        execution_time_ms = int((time.time() - start_time) * 1000)
-        
-        # Записываем метрики
-        metrics.record_pdf_time(execution_time_ms)
-        metrics.record_request(user_id)
-        logger.info(f"PDF generated for user {user_id}, job {job_id}, time: {execution_time_ms}ms")
-        
-        # Обновляем путь к PDF в БД
-        update_job_pdf_path(job_id, pdf_path, execution_time_ms)
-        
-        # Отправляем PDF пользователю
-        if os.path.exists(pdf_path):
-            # Выключаем режим создания PDF после успешной генерации
-            set_user_pdf_mode(user_id, False)
-            asyncio.create_task(_deliver_pdf(message, pdf_path, execution_time_ms, grid_enabled, job_id))
-        else:
-            # Выключаем режим создания PDF при ошибке
-            set_user_pdf_mode(user_id, False)
-            from handlers.menu import get_main_menu_keyboard
-            await call_with_retries(
-                message.answer,
-                "❌ Ошибка: PDF файл не найден",
-                reply_markup=get_main_menu_keyboard(),
-            )
-            update_job_status_failed(job_id)
-        
     except Exception as e:
-        # Выключаем режим создания PDF при ошибке
-        set_user_pdf_mode(user_id, False)
-        # Записываем ошибку в метрики
-        error_type = type(e).__name__
-        metrics.record_error(error_type)
-        logger.error(f"Error generating PDF for user {user_id}, job {job_id}: {str(e)}", exc_info=True)
-        
-        if job_id:
-            update_job_status_failed(job_id)
+        metrics.record_error(type(e).__name__)
+        logger.error(f"Error enqueueing PDF job for user {user_id}: {str(e)}", exc_info=True)
         from handlers.menu import get_main_menu_keyboard
         await call_with_retries(
             message.answer,
-            f"❌ Ошибка при генерации PDF: {str(e)}\n\nПопробуйте снова или вернитесь в меню.",
+            "❌ Не удалось поставить задачу в очередь.\n\nПопробуйте снова или вернитесь в меню.",
             reply_markup=get_main_menu_keyboard(),
         )
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
+        return
+
+    if not admission.accepted:
+        # Очередь перегружена: режим создания PDF остаётся включённым, текст можно прислать позже
+        await call_with_retries(message.answer, admission_message(admission))
+        return
 
+    # Выключаем режим создания PDF: текст принят
+    await set_user_pdf_mode(user_id, False)
+    logger.info(f"PDF job {admission.job_id} queued for user {user_id} ({admission.decision})")
+    await call_with_retries(
+        message.answer,
+        admission_message(admission),
+        reply_markup=cancel_keyboard(admission.job_id),
+    )
@@ -10,11 +10,15 @@ from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_LEFT
 from config import FONTS_DIR, GENERATED_DIR
+from utils.selector_cache import get_or_build_selector
 import os
 import re
 import random
 import unicodedata
-from typing import Optional, Dict, List
+from functools import lru_cache
+from typing import Callable, Optional, Dict, List
+
+
 def _is_cyrillic(char: str) -> bool:
     try:
         return "CYRILLIC" in unicodedata.name(char)
@@ -29,19 +33,78 @@ def _is_latin(char: str) -> bool:
         return False
 
 
+@lru_cache(maxsize=8192)
+def _char_class(char: str) -> str:
+    """Класс символа для выбора пула шрифтов."""
+    if char.isspace():
+        return "space"
+    if char.isdigit():
+        return "digit"
+    if _is_cyrillic(char):
+        return "cyrillic_upper" if char.isupper() else "cyrillic_lower"
+    if _is_latin(char):
+        return "latin_upper" if char.isupper() else "latin_lower"
+    if unicodedata.category(char).startswith(("P", "S")):
+        return "punctuation"
+    return "other"
+
+
+# Класс символа -> флаг поддержки в записи шрифта
+_CLASS_REQUIREMENTS = {
+    "digit": "supports_digits",
+    "cyrillic_upper": "supports_cyrillic_upper",
+    "cyrillic_lower": "supports_cyrillic_lower",
+    "latin_upper": "supports_latin_upper",
+    "latin_lower": "supports_latin_lower",
+}
+
+
 class FontSelector:
+    """
+    Скомпилированный селектор шрифтов.
+
+    Кандидаты для каждого класса символов вычисляются один раз при сборке,
+    поддержка конкретных символов кэшируется, поэтому один экземпляр
+    переиспользуется между задачами пользователя (см. utils.selector_cache).
+    """
+
     def __init__(self, font_sets, font_name_map):
-        self.font_name_map = font_name_map
+        self.font_name_map = dict(font_name_map)
         self.base_meta = font_sets.get("base")
         self.base_font_name = None
-        if self.base_meta and self.base_meta.get("path") in font_name_map:
-            self.base_font_name = font_name_map[self.base_meta["path"]]
-        self.default_font_name = self.base_font_name or (next(iter(font_name_map.values())) if font_name_map else None)
-
-        self.cyrillic_fonts = self._prepare_fonts(font_sets.get("cyrillic", []))
-        self.latin_fonts = self._prepare_fonts(font_sets.get("latin", []), include_base=False)
-        self.digit_fonts = self._prepare_fonts(font_sets.get("digits", []), include_base=False)
-        self.other_fonts = self._prepare_fonts(font_sets.get("other", []), include_base=False)
+        if self.base_meta and self.base_meta.get("path") in self.font_name_map:
+            self.base_font_name = self.font_name_map[self.base_meta["path"]]
+        self.default_font_name = self.base_font_name or (next(iter(self.font_name_map.values())) if self.font_name_map else None)
+
+        cyrillic_fonts = self._prepare_fonts(font_sets.get("cyrillic", []))
+        latin_fonts = self._prepare_fonts(font_sets.get("latin", []), include_base=False)
+        digit_fonts = self._prepare_fonts(font_sets.get("digits", []), include_base=False)
+        other_fonts = self._prepare_fonts(font_sets.get("other", []), include_base=False)
+
+        pool_sources = {
+            "digit": digit_fonts,
+            "cyrillic_upper": cyrillic_fonts,
+            "cyrillic_lower": cyrillic_fonts,
+            "latin_upper": latin_fonts,
+            "latin_lower": latin_fonts,
+        }
+        self._pools = {
+            char_class: self._compile_pool(pool_sources[char_class], requirement)
+            for char_class, requirement in _CLASS_REQUIREMENTS.items()
+        }
+
+        # Порядок проверки для пунктуации: шрифты с цифрами, базовый, остальные
+        punctuation_order = [self.font_name_map[rec["path"]] for rec in digit_fonts]
+        if self.base_font_name:
+            punctuation_order.append(self.base_font_name)
+        punctuation_order.extend(
+            self.font_name_map[rec["path"]] for rec in cyrillic_fonts + latin_fonts + other_fonts
+        )
+        self._punctuation_order = tuple(dict.fromkeys(punctuation_order))
+
+        # Кэши поддержки символов: char -> кандидаты / выбранный шрифт
+        self._char_candidates: Dict[tuple, tuple] = {}
+        self._punctuation_choice: Dict[str, Optional[str]] = {}
 
     def _prepare_fonts(self, records, include_base: bool = True):
         unique = []
@@ -62,131 +125,87 @@ class FontSelector:
             unique.append(record)
         return unique
 
+    def _compile_pool(self, records, requirement: str) -> tuple:
+        candidates = [rec for rec in records if rec.get(requirement)]
+        if self.base_meta and self.base_meta.get(requirement) and self.base_meta not in candidates:
+            candidates.append(self.base_meta)
+        return tuple(
+            self.font_name_map[rec["path"]]
+            for rec in candidates
+            if rec.get("path") in self.font_name_map
+        )
+
     def _font_supports_char(self, font_name: Optional[str], char: str) -> bool:
         """Проверяет, поддерживает ли шрифт символ"""
         if not font_name or not char:
             return False
         try:
             # Пробуем получить ширину символа - если символ не поддерживается, будет исключение
-            width = pdfmetrics.stringWidth(char, font_name, 12)
-            # Если ширина 0 для видимого символа (не пробел), возможно символ не поддерживается
-            # Но для пробелов и некоторых специальных символов это нормально
-            if width == 0 and not char.isspace():
-                # Дополнительная проверка: пробуем нарисовать текст и проверить результат
-                # Но это слишком сложно, поэтому просто считаем что если stringWidth не выбросил исключение,
-                # то символ поддерживается
-                pass
+            pdfmetrics.stringWidth(char, font_name, 12)
             return True
-        except KeyError:
+        except (KeyError, ValueError, TypeError, AttributeError):
             # KeyError - шрифт не зарегистрирован или символ не поддерживается
             return False
-        except (ValueError, TypeError, AttributeError):
-            # Другие ошибки - возможно символ не поддерживается
-            return False
-        except Exception as e:
-            # На всякий случай ловим все остальные исключения
-            # Но для отладки можно залогировать
+        except Exception:
             return False
 
-    def _choose_from_pool(self, char, used_fonts_per_char, pool, requirement, allow_base_fallback=True):
-        candidates = [rec for rec in pool if rec and requirement(rec)]
-        if allow_base_fallback and self.base_meta and requirement(self.base_meta):
-            if self.base_meta not in candidates:
-                candidates.append(self.base_meta)
+    def _candidates_for(self, char_class: str, char: str) -> tuple:
+        key = (char_class, char)
+        candidates = self._char_candidates.get(key)
+        if candidates is None:
+            pool = self._pools[char_class]
+            supported = tuple(name for name in pool if self._font_supports_char(name, char))
+            candidates = supported or pool
+            self._char_candidates[key] = candidates
+        return candidates
 
-        candidates = [rec for rec in candidates if rec and rec.get("path") in self.font_name_map]
-        if char:
-            supported_candidates = [
-                rec for rec in candidates if self._font_supports_char(self.font_name_map[rec["path"]], char)
-            ]
-            if supported_candidates:
-                candidates = supported_candidates
+    def _choose_from_pool(self, char, used_fonts_per_char, char_class):
+        candidates = self._candidates_for(char_class, char)
 
         if not candidates:
-            if allow_base_fallback and self.base_font_name:
+            if self.base_font_name:
                 if not char or self._font_supports_char(self.base_font_name, char):
                     return self.base_font_name
             if self.default_font_name and self._font_supports_char(self.default_font_name, char):
                 return self.default_font_name
             return self.base_font_name or self.default_font_name
 
-        used = set(used_fonts_per_char.get(char, []))
-        available = [rec for rec in candidates if self.font_name_map[rec["path"]] not in used]
-        if not available:
+        if len(candidates) == 1:
+            return candidates[0]
+
+        used = used_fonts_per_char.get(char)
+        if used:
+            available = [name for name in candidates if name not in used] or candidates
+        else:
             available = candidates
-        chosen = random.choice(available)
-        return self.font_name_map[chosen["path"]]
+        return random.choice(available)
 
-    def select(self, char: Optional[str], used_fonts_per_char: dict) -> str:
-        if not char or char.isspace():
-            return self.base_font_name or self.default_font_name
+    def _choose_punctuation(self, char: str) -> Optional[str]:
+        if char in self._punctuation_choice:
+            return self._punctuation_choice[char]
 
-        if char.isdigit():
-            return self._choose_from_pool(
-                char,
-                used_fonts_per_char,
-                self.digit_fonts,
-                lambda rec: rec.get("supports_digits"),
-            )
-
-        if _is_cyrillic(char):
-            if char.isupper():
-                requirement = lambda rec: rec.get("supports_cyrillic_upper")
-            else:
-                requirement = lambda rec: rec.get("supports_cyrillic_lower")
-            return self._choose_from_pool(
-                char,
-                used_fonts_per_char,
-                self.cyrillic_fonts,
-                requirement,
-            )
-
-        if _is_latin(char):
-            if char.isupper():
-                requirement = lambda rec: rec.get("supports_latin_upper")
-            else:
-                requirement = lambda rec: rec.get("supports_latin_lower")
-            return self._choose_from_pool(
-                char,
-                used_fonts_per_char,
-                self.latin_fonts,
-                requirement,
-            )
-
-        # Пунктуация и прочие символы
-        if unicodedata.category(char).startswith(("P", "S")):
-            # Проверяем шрифты в порядке приоритета:
-            # 1. Шрифты с цифрами (часто содержат пунктуацию)
-            # 2. Базовый шрифт
-            # 3. Остальные шрифты
-            # 4. Default шрифт
-            
-            # Сначала проверяем шрифты с цифрами (они часто содержат пунктуацию)
-            for rec in self.digit_fonts:
-                font_name = self.font_name_map.get(rec.get("path"))
-                if font_name and self._font_supports_char(font_name, char):
-                    return font_name
-            
-            # Затем базовый шрифт
-            if self.base_meta and self.base_meta.get("path") in self.font_name_map:
-                base_font_name = self.font_name_map[self.base_meta["path"]]
-                if base_font_name and self._font_supports_char(base_font_name, char):
-                    return base_font_name
-            
-            # Затем остальные шрифты
-            other_fonts = self.cyrillic_fonts + self.latin_fonts + self.other_fonts
-            for rec in other_fonts:
-                font_name = self.font_name_map.get(rec.get("path"))
-                if font_name and self._font_supports_char(font_name, char):
-                    return font_name
-            
-            # Если ничего не подошло, пробуем default
+        chosen = next(
+            (name for name in self._punctuation_order if self._font_supports_char(name, char)),
+            None,
+        )
+        if chosen is None:
             if self.default_font_name and self._font_supports_char(self.default_font_name, char):
-                return self.default_font_name
-            
-            # В крайнем случае возвращаем базовый (даже если он не поддерживает)
+                chosen = self.default_font_name
+            else:
+                # В крайнем случае возвращаем базовый (даже если он не поддерживает)
+                chosen = self.base_font_name or self.default_font_name
+        self._punctuation_choice[char] = chosen
+        return chosen
+
+    def select(self, char: Optional[str], used_fonts_per_char: dict) -> str:
+        if not char:
             return self.base_font_name or self.default_font_name
 
+        char_class = _char_class(char)
+        if char_class in self._pools:
+            return self._choose_from_pool(char, used_fonts_per_char, char_class)
+        if char_class == "punctuation":
+            return self._choose_punctuation(char)
         return self.base_font_name or self.default_font_name
 
 
@@ -487,7 +506,11 @@ def _is_list_item(text: str) -> bool:
     return stripped.startswith('•') or stripped.startswith('*') or stripped.startswith('-') or stripped.startswith('—')
 
 
-def generate_pdf(text_content: str, font_sets: Dict[str, list], page_format: str, output_path: str, grid_enabled: bool = False, first_page_side: str = 'right'):
+def _no_checkpoint() -> None:
+    pass
+
+
+def generate_pdf(text_content: str, font_sets: Dict[str, list], page_format: str, output_path: str, grid_enabled: bool = False, first_page_side: str = 'right', user_id: Optional[int] = None, checkpoint: Optional[Callable[[], None]] = None):
     """
     Генерирует PDF с текстом используя наборы шрифтов разных типов.
 
@@ -498,7 +521,13 @@ def generate_pdf(text_content: str, font_sets: Dict[str, list], page_format: str
         output_path: Путь для сохранения PDF файла.
         grid_enabled: Включить фоновую сетку.
         first_page_side: 'left' или 'right' - сторона первой страницы для зеркальных отступов.
+        user_id: ID пользователя (ключ кэша скомпилированного селектора шрифтов).
+        checkpoint: Вызывается на каждом абзаце, строке и слове; исключение из него
+            прерывает генерацию (отмена задачи, истёк срок), файл не создаётся.
     """
+    if checkpoint is None:
+        checkpoint = _no_checkpoint
+
     # Проверка текста
     if not text_content or not text_content.strip():
         raise ValueError("Текст не может быть пустым")
@@ -511,16 +540,19 @@ def generate_pdf(text_content: str, font_sets: Dict[str, list], page_format: str
     if not base_meta or not base_meta.get("path"):
         raise ValueError("Не найден базовый шрифт для генерации PDF")
 
-    font_names = {}
-    for record in font_sets.get("all", []):
-        path = record.get("path")
-        if path and path not in font_names:
-            font_names[path] = register_font(path)
-    base_path = base_meta.get("path")
-    if base_path and base_path not in font_names:
-        font_names[base_path] = register_font(base_path)
-
-    selector = FontSelector(font_sets, font_names)
+    def build_selector():
+        font_names = {}
+        for record in font_sets.get("all", []):
+            path = record.get("path")
+            if path and path not in font_names:
+                font_names[path] = register_font(path)
+        base_path = base_meta.get("path")
+        if base_path and base_path not in font_names:
+            font_names[base_path] = register_font(base_path)
+        return FontSelector(font_sets, font_names)
+
+    # Селектор компилируется один раз на версию набора шрифтов пользователя
+    selector = get_or_build_selector(user_id, font_sets, build_selector)
     base_font_name = selector.base_font_name or selector.default_font_name
     if not base_font_name:
         raise ValueError("Не удалось подготовить шрифты для генерации PDF")
@@ -625,6 +657,7 @@ def generate_pdf(text_content: str, font_sets: Dict[str, list], page_format: str
     prev_was_list_item = False  # Отслеживаем, был ли предыдущий абзац элементом списка
     
     for i, paragraph in enumerate(paragraphs):
+        checkpoint()
         if not paragraph.strip():
             # Проверяем, не выходим ли мы за границы страницы перед добавлением отступа
             if y >= bottom_margin:
@@ -651,6 +684,7 @@ def generate_pdf(text_content: str, font_sets: Dict[str, list], page_format: str
         paragraph_lines = paragraph_text.split('\n')
         
         for para_line in paragraph_lines:
+            checkpoint()
             if not para_line.strip():
                 y -= line_height
                 continue
@@ -705,6 +739,7 @@ def generate_pdf(text_content: str, font_sets: Dict[str, list], page_format: str
             effective_max_width = max_width
             
             for word in words:
+                checkpoint()
                 word_width = c.stringWidth(word + ' ', base_font_name, font_size)
                 single_word_width = c.stringWidth(word, base_font_name, font_size)
                 
@@ -847,7 +882,7 @@ def generate_pdf(text_content: str, font_sets: Dict[str, list], page_format: str
     c.save()
 
 
-def generate_pdf_for_job(job_id: int, text_content: str, font_sets: Dict[str, list], page_format: str, grid_enabled: bool = False, first_page_side: str = 'right') -> str:
+def generate_pdf_for_job(job_id: int, text_content: str, font_sets: Dict[str, list], page_format: str, grid_enabled: bool = False, first_page_side: str = 'right', user_id: Optional[int] = None, checkpoint: Optional[Callable[[], None]] = None) -> str:
     """
     Генерирует PDF для задачи из jobs таблицы
     
@@ -858,6 +893,8 @@ def generate_pdf_for_job(job_id: int, text_content: str, font_sets: Dict[str, li
         page_format: Формат страницы
         grid_enabled: Включена ли сетка
         first_page_side: 'left' или 'right' - сторона первой страницы
+        user_id: ID пользователя (для кэша селектора шрифтов)
+        checkpoint: Проверка отмены и срока (см. utils/render_control.py)
     
     Returns:
         Путь к созданному PDF файлу
@@ -879,6 +916,9 @@ def generate_pdf_for_job(job_id: int, text_content: str, font_sets: Dict[str, li
     os.makedirs(GENERATED_DIR, exist_ok=True)
     output_path = os.path.join(GENERATED_DIR, f"job_{job_id}.pdf")
     
-    generate_pdf(text_content, font_sets, page_format, output_path, grid_enabled, first_page_side)
+    generate_pdf(
+        text_content, font_sets, page_format, output_path, grid_enabled, first_page_side,
+        user_id=user_id, checkpoint=checkpoint,
+    )
     
     return output_path
@@ -0,0 +1,200 @@
+"""
+Отдельный процесс генерации PDF из очереди jobs.
+
+Запускается рядом с ботом (на той же машине или на другой с общим доступом
+к папкам fonts/ и generated/ и к PostgreSQL):
+
+    python render_worker.py --concurrency 4 --fast-slots 1
+
+С --lane fast процесс держит только слоты быстрой полосы и заранее
+регистрирует шрифты создателя — так бот (FAST_LANE_PROCESS=1) запускает
+свою быструю полосу, чтобы короткие задачи не делили GIL с длинными.
+
+Бот отправляет результат сам, получив NOTIFY о завершении задачи. Чтобы вся
+генерация шла только в отдельных процессах, запустите бота с
+INLINE_RENDER_WORKERS=0.
+"""
+
+import argparse
+import logging
+import os
+import select
+import signal
+import socket
+import threading
+import time
+
+from config import FAST_LANE_WORKERS, JOB_POLL_INTERVAL, RENDER_WORKER_CONCURRENCY
+from database.connection import create_listen_connection
+from database.schema import SchemaVersionError, verify_schema_version
+from utils.job_queue import (
+    RENDER_JOBS_CHANNEL,
+    heartbeat_render_worker,
+    lease_job,
+    reap_expired_jobs,
+    render_job,
+    seed_render_cost_model,
+    unregister_render_worker,
+)
+from utils.job_scheduling import cost_model
+
+os.makedirs('logs', exist_ok=True)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('logs/render_worker.log', encoding='utf-8'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+_stop = threading.Event()
+# Будит слоты, когда пришёл NOTIFY о новой задаче
+_wakeup = threading.Condition()
+
+
+def _listen_loop() -> None:
+    """Ждёт NOTIFY RENDER_JOBS_CHANNEL и будит слоты"""
+    conn = None
+    while not _stop.is_set():
+        try:
+            if conn is None:
+                conn = create_listen_connection(RENDER_JOBS_CHANNEL)
+            readable, _, _ = select.select([conn], [], [], JOB_POLL_INTERVAL)
+            if readable:
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    with _wakeup:
+                        _wakeup.notify_all()
+        except Exception as e:
+            logger.warning(f"LISTEN: {e}, переподключение")
+            try:
+                if conn is not None:
+                    conn.close()
+            except Exception:
+                pass
+            conn = None
+            _stop.wait(5)
+    if conn is not None:
+        conn.close()
+
+
+def _slot_loop(worker_id: str, fast: bool = False) -> None:
+    """Слот генерации; fast — быстрая полоса, только короткие тексты"""
+    while not _stop.is_set():
+        max_text_length = cost_model.fast_lane_max_chars() if fast else None
+        try:
+            job = lease_job(worker_id, max_text_length=max_text_length)
+        except Exception as e:
+            logger.error(f"{worker_id}: не удалось взять задачу: {e}")
+            _stop.wait(JOB_POLL_INTERVAL)
+            continue
+        if job is None:
+            with _wakeup:
+                _wakeup.wait(JOB_POLL_INTERVAL)
+            continue
+        try:
+            render_job(job, worker_id)
+        except Exception as e:
+            logger.error(f"{worker_id}: ошибка обработки задачи {job['id']}: {e}", exc_info=True)
+
+
+def _reaper_loop(prefix: str, slots: int) -> None:
+    while True:
+        try:
+            heartbeat_render_worker(prefix, slots)
+        except Exception as e:
+            logger.warning(f"Не удалось отметиться в реестре воркеров: {e}")
+        if _stop.wait(JOB_POLL_INTERVAL * 5):
+            break
+        try:
+            if reap_expired_jobs():
+                with _wakeup:
+                    _wakeup.notify_all()
+        except Exception as e:
+            logger.error(f"Ошибка возврата задач с истёкшей арендой: {e}")
+
+
+def _preload_fonts() -> None:
+    """Регистрирует шрифты создателя в ReportLab до первой задачи"""
+    from utils.creator_fonts import get_creator_catalogue
+    from utils.font_cache import get_cached_font_name
+
+    catalogue = get_creator_catalogue()
+    fonts = {caps.path for caps in catalogue.cyrillic + catalogue.latin + catalogue.digits}
+    for path in fonts:
+        try:
+            get_cached_font_name(path)
+        except Exception as e:
+            logger.warning(f"Шрифт {path} не загружен заранее: {e}")
+    logger.info(f"✓ Загружено шрифтов создателя: {len(fonts)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Воркер генерации PDF из очереди jobs")
+    parser.add_argument("--concurrency", type=int, default=RENDER_WORKER_CONCURRENCY)
+    parser.add_argument("--fast-slots", type=int, default=FAST_LANE_WORKERS, help="слоты быстрой полосы")
+    parser.add_argument("--lane", choices=("all", "fast"), default="all", help="fast — только быстрая полоса")
+    parser.add_argument("--parent-pid", type=int, help="завершиться, когда завершится этот процесс")
+    args = parser.parse_args()
+    if args.lane == "fast":
+        args.concurrency = 0
+
+    try:
+        revision = verify_schema_version()
+    except SchemaVersionError as e:
+        logger.error(f"✗ {e}")
+        raise SystemExit(1)
+    logger.info(f"✓ Схема БД: {revision}")
+    seed_render_cost_model()
+    if args.lane == "fast":
+        _preload_fonts()
+
+    def stop(signum, frame):
+        logger.info("Остановка: дожидаемся текущих задач")
+        _stop.set()
+        with _wakeup:
+            _wakeup.notify_all()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [
+        threading.Thread(target=_listen_loop, name="listen", daemon=True),
+        threading.Thread(
+            target=_reaper_loop, args=(prefix, args.concurrency + args.fast_slots), name="reaper", daemon=True
+        ),
+    ]
+    threads += [
+        threading.Thread(target=_slot_loop, args=(f"{prefix}:{n}",), name=f"render-{n}")
+        for n in range(args.concurrency)
+    ]
+    threads += [
+        threading.Thread(target=_slot_loop, args=(f"{prefix}:fast{n}", True), name=f"render-fast-{n}")
+        for n in range(args.fast_slots)
+    ]
+    for thread in threads:
+        thread.start()
+    logger.info(f"Воркер {prefix} запущен, слотов: {args.concurrency} + быстрая полоса {args.fast_slots}")
+
+    while not _stop.is_set():
+        time.sleep(1)
+        if args.parent_pid and os.getppid() != args.parent_pid:
+            logger.warning(f"Процесс {args.parent_pid} завершился, останавливаемся")
+            stop(None, None)
+    for thread in threads:
+        if not thread.daemon:
+            thread.join()
+    try:
+        unregister_render_worker(prefix)
+    except Exception as e:
+        logger.warning(f"Не удалось убрать воркер из реестра: {e}")
+    logger.info("Воркер остановлен")
+
+
+if __name__ == "__main__":
+    main()
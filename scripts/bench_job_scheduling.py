@@ -0,0 +1,131 @@
+"""
+Симуляция очереди генерации: FIFO против справедливого планирования.
+
+Дискретно-событийная модель без БД. Несколько «тяжёлых» пользователей
+присылают по пачке длинных текстов, остальные — поток коротких и средних
+заметок. Задачи обрабатываются --workers воркерами в порядке FIFO
+(как прежний pdf_executor) или по fair_key (utils/job_scheduling.py).
+Печатает перцентили времени от постановки до готовности PDF по классам.
+
+    python scripts/bench_job_scheduling.py --workers 4 --duration 600
+"""
+
+import argparse
+import heapq
+import os
+import random
+import statistics
+import sys
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.job_scheduling import PRIORITY_CLASSES, classify_job, compute_fair_key, estimate_render_ms
+
+
+def generate_workload(args, rng: random.Random):
+    """Список (время_поступления, user_id, длина_текста)"""
+    jobs = []
+    # Тяжёлые пользователи: пачки длинных текстов в начале интервала
+    for heavy in range(args.heavy_users):
+        start = rng.uniform(0, args.duration * 0.2)
+        for n in range(args.heavy_batch):
+            jobs.append((start + n * 0.5, 1_000_000 + heavy, rng.randint(60_000, 100_000)))
+    # Обычные пользователи: пуассоновский поток, в основном короткие заметки
+    t = 0.0
+    user_id = 0
+    while True:
+        t += rng.expovariate(args.rate)
+        if t >= args.duration:
+            break
+        user_id += 1
+        roll = rng.random()
+        if roll < 0.8:
+            length = rng.randint(100, 1500)
+        elif roll < 0.97:
+            length = rng.randint(2_000, 15_000)
+        else:
+            length = rng.randint(20_000, 60_000)
+        jobs.append((t, user_id % args.users, length))
+    jobs.sort()
+    return jobs
+
+
+def simulate(jobs, workers: int, policy: str, rng: random.Random):
+    """Возвращает {класс: [время_ответа_с, ...]}"""
+    # Фактическое время генерации отличается от оценки
+    service = [estimate_render_ms(length) / 1000.0 * rng.lognormvariate(0, 0.3) for _, _, length in jobs]
+
+    ready = []          # куча (ключ, индекс задачи)
+    user_keys = {}      # (user_id, класс) -> [fair_key незавершённых задач]
+    free_workers = workers
+    events = []         # куча (время, тип, индекс)
+    for idx, (arrival, _, _) in enumerate(jobs):
+        heapq.heappush(events, (arrival, 1, idx))
+
+    latencies = defaultdict(list)
+    keys = {}
+    while events:
+        now, kind, idx = heapq.heappop(events)
+        _, user_id, length = jobs[idx]
+        priority_class = classify_job(length)
+        if kind == 1:
+            # Поступление
+            if policy == "fifo":
+                key = now
+            else:
+                pending = user_keys.setdefault((user_id, priority_class), [])
+                key = compute_fair_key(now, max(pending) if pending else None, length, priority_class)
+                pending.append(key)
+            keys[idx] = key
+            heapq.heappush(ready, (key, idx))
+        else:
+            # Завершение
+            free_workers += 1
+            latencies[priority_class].append(now - jobs[idx][0])
+            if policy != "fifo":
+                user_keys[(user_id, priority_class)].remove(keys[idx])
+        while free_workers and ready:
+            _, next_idx = heapq.heappop(ready)
+            free_workers -= 1
+            heapq.heappush(events, (now + service[next_idx], 0, next_idx))
+    return latencies
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=600, help="интервал поступления задач, с")
+    parser.add_argument("--rate", type=float, default=1.0, help="задач обычных пользователей в секунду")
+    parser.add_argument("--users", type=int, default=300, help="число обычных пользователей")
+    parser.add_argument("--heavy-users", type=int, default=3)
+    parser.add_argument("--heavy-batch", type=int, default=10, help="длинных текстов у тяжёлого пользователя")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    jobs = generate_workload(args, random.Random(args.seed))
+    print(f"Задач: {len(jobs)}, воркеров: {args.workers}")
+    print(f"\n{'класс':<12} {'политика':<6} {'задач':>6} {'p50, с':>8} {'p95, с':>8} {'p99, с':>8} {'макс, с':>8}")
+    results = {
+        policy: simulate(jobs, args.workers, policy, random.Random(args.seed))
+        for policy in ("fifo", "fair")
+    }
+    for priority_class in PRIORITY_CLASSES:
+        for policy, latencies in results.items():
+            values = latencies.get(priority_class)
+            if not values:
+                continue
+            print(
+                f"{priority_class:<12} {policy:<6} {len(values):>6} "
+                f"{statistics.median(values):>8.1f} {percentile(values, 0.95):>8.1f} "
+                f"{percentile(values, 0.99):>8.1f} {max(values):>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Бенчмарк rate limit: прежние списки отметок времени против SlidingWindowLimiter.
+
+Синтетическая нагрузка без БД: --users разных пользователей (по умолчанию
+100 000) присылают --requests запросов за --hours часов модельного времени;
+долю --hot-share запросов дают 1% самых активных пользователей. Обе реализации
+получают одинаковую последовательность, решения сверяются. Печатает время на
+проверку, память (tracemalloc) и число пользователей в памяти в конце.
+
+    python scripts/bench_rate_limit.py --users 100000 --requests 1000000
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.rate_limit import MAX_REQUESTS_PER_HOUR, MAX_REQUESTS_PER_MINUTE, SlidingWindowLimiter
+
+
+class LegacyLimiter:
+    """Прежняя реализация utils/rate_limit.py, с модельным временем вместо datetime.now()"""
+
+    def __init__(self):
+        self._user_requests = defaultdict(list)
+        self._epoch = datetime(2026, 1, 1)
+
+    def check(self, user_id: int, now_seconds: float):
+        now = self._epoch + timedelta(seconds=now_seconds)
+        user_requests = self._user_requests[user_id]
+        user_requests[:] = [req for req in user_requests if now - req < timedelta(hours=1)]
+        recent_minute = [req for req in user_requests if now - req < timedelta(minutes=1)]
+        if len(recent_minute) >= MAX_REQUESTS_PER_MINUTE:
+            return "minute"
+        if len(user_requests) >= MAX_REQUESTS_PER_HOUR:
+            return "hour"
+        user_requests.append(now)
+        return None
+
+    def __len__(self) -> int:
+        return len(self._user_requests)
+
+
+def generate_workload(args, rng: random.Random):
+    """Список (время, user_id) по возрастанию времени"""
+    hot_users = max(1, args.users // 100)
+    duration = args.hours * 3600.0
+    times = sorted(rng.uniform(0, duration) for _ in range(args.requests))
+    workload = []
+    for n, t in enumerate(times):
+        # Каждый пользователь хотя бы раз, затем смесь активных и случайных
+        if n < args.users:
+            user_id = n
+        elif rng.random() < args.hot_share:
+            user_id = rng.randrange(hot_users)
+        else:
+            user_id = rng.randrange(args.users)
+        workload.append((t, user_id))
+    return workload
+
+
+def run(limiter, workload, trace: bool):
+    gc.collect()
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    decisions = [limiter.check(user_id, t) for t, user_id in workload]
+    elapsed = time.perf_counter() - started
+    peak = 0
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return decisions, elapsed, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=1_000_000)
+    parser.add_argument("--hours", type=float, default=3.0, help="интервал модельного времени, ч")
+    parser.add_argument("--hot-share", type=float, default=0.5, help="доля запросов от 1%% активных пользователей")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--trace-memory", action="store_true", help="замерить память (замедляет прогон)")
+    args = parser.parse_args()
+
+    workload = generate_workload(args, random.Random(args.seed))
+    print(f"Пользователей: {args.users}, запросов: {len(workload)}, интервал {args.hours} ч")
+
+    results = {}
+    for name, limiter in (
+        ("списки (прежняя)", LegacyLimiter()),
+        ("окно + очистка", SlidingWindowLimiter(sweep_interval=600)),
+    ):
+        decisions, elapsed, peak = run(limiter, workload, args.trace_memory)
+        results[name] = decisions
+        rejected = sum(1 for d in decisions if d)
+        memory = f", пик памяти {peak / 1024 / 1024:.1f} МБ" if args.trace_memory else ""
+        print(
+            f"{name:18} {elapsed:6.2f} с, {elapsed / len(workload) * 1e6:6.2f} мкс/проверка, "
+            f"отказов {rejected}, пользователей в памяти {len(limiter)}{memory}"
+        )
+
+    legacy, current = results.values()
+    mismatches = sum(1 for a, b in zip(legacy, current) if a != b)
+    print(f"Расхождений в решениях: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Бенчмарк запросов статистики (stats_bot/stats_service.fetch_stats) до и после
+индексов и секционирования jobs из миграции 0010.
+
+В отдельной схеме bench_stats создаются таблицы users и jobs в старом виде
+(без индексов, jobs не секционирована) и заполняются генератором на стороне
+PostgreSQL. Затем каждый запрос выполняется --repeat раз, после чего
+применяются индексы и секционирование как в 0010 и замеры повторяются.
+Отдельно замеряются запросы одной задачи по id — без условия на created_at
+и с границами месяца, как в database/partitions.JOB_BY_ID. Рабочие таблицы
+бота не затрагиваются.
+
+    python scripts/bench_stats_queries.py --users 200000 --jobs 3000000
+
+Результаты — в README, «Нагрузочные тесты с PostgreSQL».
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+
+from database.connection import get_connect_params
+
+SCHEMA = "bench_stats"
+
+# Запросы как в stats_bot/stats_service.fetch_stats
+QUERIES = {
+    "total_users": "SELECT COUNT(*) FROM users",
+    "pdf_today": """
+        SELECT COUNT(*) FROM jobs
+        WHERE status = 'completed' AND created_at >= current_date
+    """,
+    "pdf_total": "SELECT COUNT(*) FROM jobs WHERE status = 'completed'",
+    "user_counts": """
+        SELECT
+            COUNT(*) FILTER (WHERE created_at >= current_date),
+            COUNT(*) FILTER (WHERE last_seen_at >= current_date)
+        FROM users
+    """,
+    "recent_visitors": """
+        SELECT user_id, username, last_seen_at
+        FROM users
+        ORDER BY last_seen_at DESC NULLS LAST
+        LIMIT 30
+    """,
+}
+
+RECENT_USERS_BEFORE = """
+    SELECT u.user_id, COUNT(j.*) AS pdf_count, MAX(j.completed_at) AS last_completed_at
+    FROM users u
+    JOIN jobs j ON j.user_id = u.user_id AND j.status = 'completed'
+    GROUP BY u.user_id
+    ORDER BY last_completed_at DESC NULLS LAST
+    LIMIT 5
+"""
+
+# Как RECENT_USERS_QUERY в stats_bot/stats_service.py (окно 500 задач)
+RECENT_USERS_AFTER = """
+    WITH recent AS (
+        SELECT user_id, MAX(completed_at) AS last_completed_at
+        FROM (
+            SELECT user_id, completed_at
+            FROM jobs
+            WHERE status = 'completed'
+            ORDER BY completed_at DESC NULLS LAST
+            LIMIT 500
+        ) latest
+        GROUP BY user_id
+        ORDER BY last_completed_at DESC NULLS LAST
+        LIMIT 5
+    )
+    SELECT u.user_id,
+           (SELECT COUNT(*) FROM jobs j WHERE j.user_id = u.user_id AND j.status = 'completed'),
+           r.last_completed_at
+    FROM recent r
+    JOIN users u ON u.user_id = r.user_id
+    ORDER BY r.last_completed_at DESC NULLS LAST
+"""
+
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def seed(cursor, users: int, jobs: int, days: int) -> None:
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+    cursor.execute(f"SET search_path TO {SCHEMA}")
+    cursor.execute(
+        """
+        CREATE TABLE users (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_seen_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE jobs (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            pdf_path TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP,
+            execution_time_ms INTEGER,
+            status VARCHAR(20) DEFAULT 'pending'
+        )
+        """
+    )
+    started = time.perf_counter()
+    cursor.execute(
+        """
+        INSERT INTO users (user_id, username, created_at, last_seen_at)
+        SELECT g,
+               'user' || g,
+               now() - random() * make_interval(days => %s),
+               now() - random() * random() * make_interval(days => %s)
+        FROM generate_series(1, %s) AS g
+        """,
+        (days, days, users)
+    )
+    # Немногие активные пользователи создают большую часть задач
+    cursor.execute(
+        """
+        INSERT INTO jobs (user_id, pdf_path, created_at, completed_at, execution_time_ms, status)
+        SELECT 1 + floor(power(random(), 3) * %s)::bigint,
+               'generated/job_' || g || '.pdf',
+               ts,
+               ts + interval '3 seconds',
+               (500 + random() * 5000)::int,
+               CASE WHEN random() < 0.95 THEN 'completed' ELSE 'failed' END
+        FROM (
+            SELECT g, now() - random() * make_interval(days => %s) AS ts
+            FROM generate_series(1, %s) AS g
+        ) s
+        """,
+        (users, days, jobs)
+    )
+    cursor.execute("ANALYZE")
+    print(f"Заполнено: {users} пользователей, {jobs} задач за {time.perf_counter() - started:.1f} с")
+
+
+def apply_migration(cursor) -> None:
+    """Индексы и секционирование, как в alembic/versions/0010_jobs_partitioning.py"""
+    started = time.perf_counter()
+    cursor.execute("CREATE INDEX users_last_seen_idx ON users (last_seen_at DESC NULLS LAST)")
+    cursor.execute("CREATE INDEX users_created_at_idx ON users (created_at)")
+
+    cursor.execute("ALTER TABLE jobs RENAME TO jobs_unpartitioned")
+    cursor.execute(
+        """
+        CREATE TABLE jobs (
+            id INTEGER NOT NULL,
+            user_id BIGINT NOT NULL,
+            pdf_path TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP,
+            execution_time_ms INTEGER,
+            status VARCHAR(20) DEFAULT 'pending',
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    cursor.execute("SELECT MIN(created_at)::date FROM jobs_unpartitioned")
+    oldest = cursor.fetchone()[0] or date.today()
+    month = date(oldest.year, oldest.month, 1)
+    last = _add_months(date(date.today().year, date.today().month, 1), 2)
+    while month <= last:
+        next_month = _add_months(month, 1)
+        cursor.execute(
+            f"CREATE TABLE jobs_y{month.year}m{month.month:02d} PARTITION OF jobs "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+        )
+        month = next_month
+    cursor.execute("CREATE TABLE jobs_default PARTITION OF jobs DEFAULT")
+    cursor.execute("INSERT INTO jobs SELECT * FROM jobs_unpartitioned")
+    cursor.execute("DROP TABLE jobs_unpartitioned")
+
+    cursor.execute("CREATE INDEX jobs_completed_created_idx ON jobs (created_at) WHERE status = 'completed'")
+    cursor.execute(
+        "CREATE INDEX jobs_completed_at_idx ON jobs (completed_at DESC NULLS LAST) WHERE status = 'completed'"
+    )
+    cursor.execute(
+        "CREATE INDEX jobs_user_completed_idx ON jobs (user_id, completed_at) WHERE status = 'completed'"
+    )
+    cursor.execute("VACUUM ANALYZE jobs")
+    cursor.execute("ANALYZE users")
+    print(f"Индексы и секционирование применены за {time.perf_counter() - started:.1f} с")
+
+
+# Запрос одной задачи по id (get_job, аренда, отправка): без границ месяца и с ними (database/partitions.JOB_BY_ID)
+JOB_LOOKUPS = {
+    "job_by_id": "SELECT status FROM jobs WHERE id = %s",
+    "job_by_id_month": "SELECT status FROM jobs WHERE id = %s AND created_at >= %s AND created_at < %s",
+}
+
+
+def sample_jobs(cursor, count: int) -> list:
+    """Случайные задачи для замера запросов по id: (id, начало месяца, начало следующего)"""
+    cursor.execute("SELECT id, created_at::date FROM jobs ORDER BY random() LIMIT %s", (count,))
+    sample = []
+    for job_id, created in cursor.fetchall():
+        month = date(created.year, created.month, 1)
+        sample.append((job_id, month, _add_months(month, 1)))
+    return sample
+
+
+def time_lookups(cursor, sample: list) -> dict:
+    """Среднее время одного запроса задачи по id, мс"""
+    results = {}
+    for name, sql in JOB_LOOKUPS.items():
+        started = time.perf_counter()
+        for job_id, month, next_month in sample:
+            cursor.execute(sql, (job_id,) if name == "job_by_id" else (job_id, month, next_month))
+            cursor.fetchall()
+        results[name] = (time.perf_counter() - started) * 1000 / len(sample)
+    return results
+
+
+def time_queries(cursor, queries: dict, repeat: int) -> dict:
+    results = {}
+    for name, sql in queries.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            cursor.execute(sql)
+            cursor.fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = statistics.median(timings)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--jobs", type=int, default=3_000_000)
+    parser.add_argument("--days", type=int, default=365, help="за сколько дней распределить данные")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов каждого запроса (берётся медиана)")
+    parser.add_argument("--lookups", type=int, default=500, help="задач для замера запросов по id")
+    parser.add_argument("--keep", action="store_true", help="не удалять схему bench_stats после замеров")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**get_connect_params())
+    # autocommit: VACUUM и крупные вставки без одной огромной транзакции
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        seed(cursor, args.users, args.jobs, args.days)
+        cursor.execute("VACUUM ANALYZE")
+
+        sample = sample_jobs(cursor, args.lookups)
+        before = time_queries(cursor, {**QUERIES, "recent_users": RECENT_USERS_BEFORE}, args.repeat)
+        before.update(time_lookups(cursor, sample))
+        apply_migration(cursor)
+        after = time_queries(cursor, {**QUERIES, "recent_users": RECENT_USERS_AFTER}, args.repeat)
+        after.update(time_lookups(cursor, sample))
+
+        print(f"\n{'запрос':<18} {'до, мс':>10} {'после, мс':>10} {'ускорение':>10}")
+        for name in before:
+            speedup = before[name] / after[name] if after[name] else float("inf")
+            print(f"{name:<18} {before[name]:>10.1f} {after[name]:>10.1f} {speedup:>9.1f}x")
+    finally:
+        if not args.keep:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
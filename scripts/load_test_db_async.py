@@ -0,0 +1,148 @@
+"""
+Нагрузочный тест слоя доступа к БД из хендлеров.
+
+Имитирует N одновременных хендлеров, каждый делает типичную для
+handle_text_message цепочку чтений (get_user_info, has_minimum_font_set,
+get_fonts_for_generation). Сравнивает два режима:
+
+  sync  — прямые вызовы utils.db_utils из корутины (как было раньше);
+  async — await-обёртки utils.db_async (запросы в db_executor).
+
+Медленная БД имитируется задержкой перед каждым запросом (--delay-ms).
+Параллельно работает «пульс» event loop: каждые 10 мс он измеряет, на сколько
+опоздал — это задержка, которую видят все остальные апдейты.
+
+Только чтение, данные в БД не меняются. Запуск из корня проекта:
+
+    python scripts/load_test_db_async.py --handlers 200 --concurrency 50 --delay-ms 20
+
+Результаты пока не замерялись (см. README, «Нагрузочные тесты с PostgreSQL»).
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2.extensions
+
+import database.connection as connection
+from config import DB_POOL_MAX
+from utils import db_async, db_utils
+
+# Пользователи из этого диапазона в БД не существуют — запросы только читают
+USER_ID_BASE = 9_000_000_000
+
+
+def _install_slow_pool(delay_ms: float, maxconn: int) -> None:
+    delay = delay_ms / 1000.0
+
+    class SlowCursor(psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            time.sleep(delay)  # сетевой round-trip до «медленной» БД
+            return super().execute(query, vars)
+
+    if connection._connection_pool is not None:
+        connection._connection_pool.closeall()
+    connection._connection_pool = connection.ConnectionPool(
+        minconn=1,
+        maxconn=maxconn,
+        cursor_factory=SlowCursor,
+        **connection.get_connect_params(),
+    )
+
+
+async def _handler_sync(user_id: int) -> None:
+    db_utils.get_user_info(user_id)
+    db_utils.has_minimum_font_set(user_id)
+    db_utils.get_fonts_for_generation(user_id)
+
+
+async def _handler_async(user_id: int) -> None:
+    await db_async.get_user_info(user_id)
+    await db_async.has_minimum_font_set(user_id)
+    await db_async.get_fonts_for_generation(user_id)
+
+
+async def _heartbeat(stop: asyncio.Event, lags: list) -> None:
+    interval = 0.01
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - started - interval) * 1000)
+
+
+def _percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_mode(mode: str, handlers: int, concurrency: int) -> dict:
+    handler = _handler_async if mode == "async" else _handler_sync
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list = []
+    lags: list = []
+    stop = asyncio.Event()
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await handler(USER_ID_BASE + i)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    heartbeat = asyncio.create_task(_heartbeat(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(handlers)))
+    total = time.perf_counter() - started
+    stop.set()
+    await heartbeat
+
+    return {
+        "mode": mode,
+        "p50": _percentile(latencies, 50),
+        "p99": _percentile(latencies, 99),
+        "max": max(latencies) if latencies else 0.0,
+        "loop_lag_p99": _percentile(lags, 99),
+        "loop_lag_max": max(lags) if lags else 0.0,
+        "throughput": handlers / total if total else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handlers", type=int, default=200, help="сколько хендлеров выполнить")
+    parser.add_argument("--concurrency", type=int, default=50, help="сколько хендлеров одновременно")
+    parser.add_argument("--delay-ms", type=float, default=20.0, help="искусственная задержка каждого запроса")
+    parser.add_argument("--modes", default="sync,async", help="режимы через запятую")
+    args = parser.parse_args()
+
+    maxconn = DB_POOL_MAX
+    _install_slow_pool(args.delay_ms, maxconn)
+    try:
+        conn = connection.get_db_connection()
+        connection.return_db_connection(conn)
+    except Exception as e:
+        print(f"✗ БД недоступна: {e}")
+        sys.exit(1)
+
+    print(
+        f"Хендлеров: {args.handlers}, одновременно: {args.concurrency}, "
+        f"задержка запроса: {args.delay_ms} мс, пул: {maxconn}"
+    )
+    print(f"{'режим':<6} {'p50 мс':>9} {'p99 мс':>9} {'max мс':>9} {'lag p99':>9} {'lag max':>9} {'хендл/с':>9}")
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        result = asyncio.run(run_mode(mode, args.handlers, args.concurrency))
+        print(
+            f"{result['mode']:<6} {result['p50']:>9.1f} {result['p99']:>9.1f} {result['max']:>9.1f} "
+            f"{result['loop_lag_p99']:>9.1f} {result['loop_lag_max']:>9.1f} {result['throughput']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
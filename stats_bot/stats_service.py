@@ -30,6 +30,9 @@ class Stats:
     recent_visitors: List[RecentUser]
 
 
+RECENT_USERS_LIMIT = 5
+
+
 def _safe_username(row: RealDictRow) -> str:
     username = row.get("username")
     if username:
@@ -39,59 +42,48 @@ def _safe_username(row: RealDictRow) -> str:
 
 def fetch_stats(settings: Settings) -> Stats:
     with get_cursor(settings) as cursor:
-        cursor.execute(
-            """
-            SELECT COUNT(*) AS cnt
-            FROM users
-            """
-        )
-        total_users = cursor.fetchone()["cnt"]
-
-        cursor.execute(
-            """
-            SELECT COUNT(*) AS cnt
-            FROM jobs
-            WHERE status = 'completed'
-              AND created_at >= current_date
-            """
-        )
-        pdf_today = cursor.fetchone()["cnt"]
-
-        cursor.execute(
-            """
-            SELECT COUNT(*) AS cnt
-            FROM jobs
-            WHERE status = 'completed'
-            """
-        )
-        pdf_total = cursor.fetchone()["cnt"]
-
+        # Сводки stats_totals / stats_daily (миграция 0011) плюс ещё не
+        # перенесённые в них строки stats_deltas (миграция 0017)
         cursor.execute(
             """
             SELECT
-                COUNT(*) FILTER (WHERE created_at >= current_date) AS new_users,
-                COUNT(*) FILTER (WHERE last_seen_at >= current_date) AS active_users
-            FROM users
+                t.users + p.users AS total_users,
+                t.pdfs_completed + p.pdfs_completed AS pdf_total,
+                COALESCE(d.new_users, 0) + p.new_users_today AS new_users,
+                COALESCE(d.active_users, 0) + p.active_users_today AS active_users,
+                COALESCE(d.pdfs_completed, 0) + p.pdfs_today AS pdf_today
+            FROM stats_totals t
+            LEFT JOIN stats_daily d ON d.day = current_date
+            CROSS JOIN (
+                SELECT
+                    COALESCE(SUM(users), 0) AS users,
+                    COALESCE(SUM(pdfs_completed), 0) AS pdfs_completed,
+                    COALESCE(SUM(new_users) FILTER (WHERE day = current_date), 0) AS new_users_today,
+                    COALESCE(SUM(active_users) FILTER (WHERE day = current_date), 0) AS active_users_today,
+                    COALESCE(SUM(pdfs_completed) FILTER (WHERE day = current_date), 0) AS pdfs_today
+                FROM stats_deltas
+            ) p
             """
         )
-        user_counts = cursor.fetchone()
-        new_users_today = user_counts["new_users"]
-        active_today = user_counts["active_users"]
+        rollup = cursor.fetchone() or {}
+        total_users = rollup.get("total_users", 0)
+        pdf_total = rollup.get("pdf_total", 0)
+        pdf_today = rollup.get("pdf_today", 0)
+        new_users_today = rollup.get("new_users", 0)
+        active_today = rollup.get("active_users", 0)
 
         cursor.execute(
-            """
+            f"""
             SELECT
                 u.user_id,
                 COALESCE(u.username, '') AS username,
                 COALESCE(u.first_name, '') AS first_name,
                 COALESCE(u.last_name, '') AS last_name,
-                COUNT(j.*) AS pdf_count,
-                MAX(j.completed_at) AS last_completed_at
+                u.pdfs_completed AS pdf_count
             FROM users u
-            JOIN jobs j ON j.user_id = u.user_id AND j.status = 'completed'
-            GROUP BY u.user_id, u.username, u.first_name, u.last_name
-            ORDER BY last_completed_at DESC NULLS LAST
-            LIMIT 5
+            WHERE u.last_pdf_at IS NOT NULL
+            ORDER BY u.last_pdf_at DESC
+            LIMIT {RECENT_USERS_LIMIT}
             """
         )
         recent_jobs_rows = cursor.fetchall()
@@ -0,0 +1,69 @@
+"""
+Допуск задач в очередь генерации.
+
+Перед постановкой задачи в очередь оценивается, сколько ей ждать: работа
+ожидающих задач с меньшим fair_key (их воркеры возьмут раньше, см.
+utils/job_scheduling.py) и остаток уже генерируемых, делённые на число
+слотов живых воркеров (реестр render_workers; пока он пуст —
+ADMISSION_RENDER_CAPACITY), плюс генерация самой задачи. Вся работа
+оценивается одной моделью — cost_model процесса. По оценке решение:
+
+    accept — ожидание до ADMISSION_DEFER_WAIT;
+    defer  — до ADMISSION_REJECT_WAIT: задача принимается, пользователь видит срок;
+    reject — дольше, или в очереди уже ADMISSION_MAX_PENDING задач.
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+from config import (
+    ADMISSION_DEFER_WAIT,
+    ADMISSION_MAX_PENDING,
+    ADMISSION_RENDER_CAPACITY,
+    ADMISSION_REJECT_WAIT,
+    JOB_COST_BASE_MS,
+)
+from utils.job_scheduling import cost_model
+
+ACCEPT = "accept"
+DEFER = "defer"
+REJECT = "reject"
+
+
+@dataclass
+class Admission:
+    decision: str
+    eta_seconds: float
+    position: int
+    job_id: Optional[int] = None
+
+    @property
+    def accepted(self) -> bool:
+        return self.decision != REJECT
+
+
+def decide_admission(
+    pending_total: int,
+    ahead_count: int,
+    ahead_chars: int,
+    text_length: int,
+    in_flight_ms: float = 0.0,
+    live_slots: int = 0,
+) -> Admission:
+    """
+    Решение по загрузке очереди; job_id заполняет вызывающий.
+
+    in_flight_ms — оставшаяся работа задач в статусе processing;
+    live_slots — слоты живых воркеров, 0 — неизвестно (берётся ADMISSION_RENDER_CAPACITY).
+    """
+    capacity = live_slots or ADMISSION_RENDER_CAPACITY
+    ahead_ms = ahead_count * JOB_COST_BASE_MS + ahead_chars * cost_model.per_char_ms + in_flight_ms
+    eta_seconds = (ahead_ms / max(1, capacity) + cost_model.estimate_ms(text_length)) / 1000.0
+
+    if pending_total >= ADMISSION_MAX_PENDING or eta_seconds > ADMISSION_REJECT_WAIT:
+        decision = REJECT
+    elif eta_seconds > ADMISSION_DEFER_WAIT:
+        decision = DEFER
+    else:
+        decision = ACCEPT
+    return Admission(decision=decision, eta_seconds=eta_seconds, position=ahead_count)
@@ -0,0 +1,321 @@
+"""
+Несколько процессов бота в режиме webhook.
+
+С WEBHOOK_PROCESSES > 1 запущенный bot.py становится супервизором: один раз
+устанавливает webhook и запускает WEBHOOK_PROCESSES дочерних процессов bot.py,
+которые слушают 127.0.0.1:WEBHOOK_WORKER_PORT_BASE + номер процесса. Webhook
+на WEBAPP_PORT принимает сам супервизор и пересылает каждый апдейт процессу
+chat_id % WEBHOOK_PROCESSES: апдейты одного чата всегда попадают в одну
+очередь (utils/webhook_queue.py) и обрабатываются по порядку, как в одном
+процессе. Упавший процесс перезапускается; пока он поднимается, апдейты его
+чатов получают 503, и Telegram доставит их повторно.
+
+Общее состояние процессов в PostgreSQL: очередь генерации и отправки (jobs),
+лимит запросов (в кластере RATE_LIMIT_BACKEND всегда postgres). Общие бюджеты
+(запросы к Telegram, загрузки PDF, ёмкость генерации) делятся между
+BOT_PROCESSES процессами (config.py). Кроме того:
+
+    LeaderElection — фоновые задачи на весь кластер (очистка, сводка
+                     очереди) выполняет только процесс, держащий advisory lock;
+    контекст пользователя не кэшируется (USER_CACHE_MAX_SIZE=0): режим PDF и
+                     настройки мог только что изменить другой процесс;
+    USER_CONTEXT_CHANNEL — изменение шрифтов пользователя в одном процессе
+                     сбрасывает кэши шрифтов в остальных (NOTIFY).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, Optional, Set, Tuple
+
+import aiohttp
+from aiohttp import web
+
+from config import (
+    LEADER_CHECK_INTERVAL,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_PROCESSES,
+    WEBHOOK_SHUTDOWN_TIMEOUT,
+    WEBHOOK_WORKER_PORT_BASE,
+)
+from database.connection import create_listen_connection
+from utils.executors import db_executor
+from utils.webhook_queue import update_chat_key
+
+logger = logging.getLogger(__name__)
+
+# Номер дочернего процесса webhook (задаёт супервизор)
+CLUSTER_WORKER_ENV = "BOT_CLUSTER_WORKER"
+
+USER_CONTEXT_CHANNEL = "user_context"
+
+# Ключ advisory lock лидера фоновых задач (polling-режим использует 8149608598)
+LEADER_LOCK_KEY = 8149608599
+
+_PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Дочерние процессы принимают апдейты только от супервизора
+WORKER_HOST = "127.0.0.1"
+# Дочерний процесс отвечает сразу после постановки апдейта в очередь
+FORWARD_TIMEOUT = 10
+
+
+def cluster_worker_index() -> Optional[int]:
+    """Номер процесса, если он запущен супервизором, иначе None"""
+    value = os.getenv(CLUSTER_WORKER_ENV)
+    return int(value) if value is not None else None
+
+
+class UserChangePublisher:
+    """
+    Сообщает остальным процессам, что данные пользователя изменились.
+
+    publish() вызывается из кода записи в БД, пока тот ещё держит соединение из
+    пула, поэтому сам NOTIFY уходит позже из фоновой задачи на отдельном
+    соединении: пул не нужен, и ожидания пула самим собой не бывает.
+    """
+
+    def __init__(self):
+        self._pending: Set[int] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._conn = None
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        asyncio.create_task(self._run())
+
+    def publish(self, user_id: int) -> None:
+        """Потокобезопасно: вызывается из потоков db_executor"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._add, user_id)
+
+    def _add(self, user_id: int) -> None:
+        self._pending.add(user_id)
+        self._wakeup.set()
+
+    def _send(self, user_ids: Set[int]) -> None:
+        try:
+            if self._conn is None:
+                self._conn = create_listen_connection()
+            with self._conn.cursor() as cursor:
+                for user_id in user_ids:
+                    cursor.execute("SELECT pg_notify(%s, %s)", (USER_CONTEXT_CHANNEL, f"{_PROCESS_ID}:{user_id}"))
+        except Exception:
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except Exception:
+                    pass
+                self._conn = None
+            raise
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            batch, self._pending = self._pending, set()
+            try:
+                await loop.run_in_executor(db_executor, self._send, batch)
+            except Exception as e:
+                # Кэш шрифтов других процессов сбросится не позже чем по TTL
+                logger.warning(f"Не удалось оповестить процессы об изменении пользователей: {e}")
+
+
+user_change_publisher = UserChangePublisher()
+
+
+def on_user_change(payload: str) -> None:
+    """Обработчик NOTIFY USER_CONTEXT_CHANNEL: сбрасывает кэши пользователя в этом процессе"""
+    origin, _, user_id = payload.rpartition(":")
+    if origin == _PROCESS_ID:
+        return
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return
+    from utils.db_utils import drop_local_user_caches
+
+    drop_local_user_caches(user_id)
+
+
+class LeaderElection:
+    """Лидер — процесс, держащий session-level advisory lock на отдельном соединении"""
+
+    def __init__(self, key: int = LEADER_LOCK_KEY, interval: float = LEADER_CHECK_INTERVAL):
+        self.key = key
+        self.interval = interval
+        self.is_leader = False
+        self._conn = None
+
+    def _check(self) -> None:
+        try:
+            if self._conn is None:
+                self._conn = create_listen_connection()
+            with self._conn.cursor() as cursor:
+                if self.is_leader:
+                    # Соединение живо — значит, и блокировка наша
+                    cursor.execute("SELECT 1")
+                else:
+                    cursor.execute("SELECT pg_try_advisory_lock(%s)", (self.key,))
+                    if cursor.fetchone()[0]:
+                        self.is_leader = True
+                        logger.info("✓ Процесс выбран лидером фоновых задач")
+        except Exception as e:
+            if self.is_leader:
+                logger.warning(f"Лидерство потеряно: {e}")
+            self.is_leader = False
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except Exception:
+                    pass
+                self._conn = None
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await loop.run_in_executor(db_executor, self._check)
+            await asyncio.sleep(self.interval)
+
+
+leader = LeaderElection()
+
+
+async def _set_webhook() -> None:
+    from aiogram import Bot
+
+    from config import BOT_TOKEN, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL
+
+    bot = Bot(token=BOT_TOKEN)
+    try:
+        final_webhook_url = WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH
+        await bot.set_webhook(final_webhook_url, secret_token=(WEBHOOK_SECRET or None), drop_pending_updates=True)
+        logger.info(f"✓ Webhook установлен: {final_webhook_url}")
+    finally:
+        await bot.session.close()
+
+
+def worker_address(index: int) -> Tuple[str, int]:
+    """Локальный адрес, на котором дочерний процесс принимает апдейты от супервизора"""
+    return WORKER_HOST, WEBHOOK_WORKER_PORT_BASE + index
+
+
+def route_update(body: bytes, processes: int) -> int:
+    """Номер процесса для апдейта: все апдейты одного чата — в один процесс"""
+    try:
+        key = update_chat_key(json.loads(body))
+    except (ValueError, TypeError, AttributeError):
+        key = None
+    if key is None:
+        # Порядок не важен — любой процесс
+        return random.randrange(processes)
+    return key % processes
+
+
+class _UpdateRouter:
+    """HTTP-вход супервизора: пересылает апдейт процессу его чата и возвращает Telegram его ответ"""
+
+    def __init__(self, processes: int):
+        self.processes = processes
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def on_startup(self, app: web.Application) -> None:
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=FORWARD_TIMEOUT))
+
+    async def on_cleanup(self, app: web.Application) -> None:
+        await self._session.close()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        host, port = worker_address(route_update(body, self.processes))
+        headers = {
+            name: value for name, value in request.headers.items()
+            if name.lower() in ("content-type", "x-telegram-bot-api-secret-token")
+        }
+        try:
+            async with self._session.post(f"http://{host}:{port}{WEBHOOK_PATH}", data=body, headers=headers) as response:
+                return web.Response(
+                    status=response.status,
+                    body=await response.read(),
+                    content_type=response.content_type,
+                )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Процесс перезапускается или перегружен — Telegram доставит апдейт повторно
+            logger.warning(f"Не удалось передать апдейт процессу {host}:{port}: {e}")
+            return web.Response(status=503, text="Worker unavailable")
+
+
+async def _supervise(processes: int) -> int:
+    try:
+        await _set_webhook()
+    except Exception as e:
+        logger.error(f"✗ Не удалось установить webhook: {e}")
+        return 1
+
+    script = os.path.abspath(sys.argv[0])
+    children: Dict[int, subprocess.Popen] = {}
+
+    def spawn(index: int) -> None:
+        env = {**os.environ, CLUSTER_WORKER_ENV: str(index)}
+        children[index] = subprocess.Popen([sys.executable, script], env=env)
+        logger.info(f"Запущен процесс webhook #{index} (pid {children[index].pid})")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    for index in range(processes):
+        spawn(index)
+
+    router = _UpdateRouter(processes)
+    app = web.Application()
+    app.on_startup.append(router.on_startup)
+    app.on_cleanup.append(router.on_cleanup)
+    app.router.add_post(WEBHOOK_PATH, router.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT).start()
+    logger.info(f"Супервизор принимает webhook на {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}, процессов: {processes}")
+
+    while not stop_event.is_set():
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=1)
+        except asyncio.TimeoutError:
+            pass
+        for index, child in list(children.items()):
+            code = child.poll()
+            if code is not None and not stop_event.is_set():
+                logger.error(f"Процесс webhook #{index} завершился с кодом {code}, перезапуск")
+                spawn(index)
+
+    logger.info("Остановка процессов webhook...")
+    # Сначала перестаём принимать апдейты и дожидаемся уже пересылаемых
+    await runner.cleanup()
+    for child in children.values():
+        if child.poll() is None:
+            child.terminate()
+    deadline = time.monotonic() + WEBHOOK_SHUTDOWN_TIMEOUT + 5
+    for child in children.values():
+        while child.poll() is None and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        if child.poll() is None:
+            child.kill()
+    return 0
+
+
+def run_webhook_cluster(processes: int = WEBHOOK_PROCESSES) -> int:
+    """Супервизор: принимает webhook, распределяет апдейты по чатам, перезапускает дочерние bot.py"""
+    return asyncio.run(_supervise(processes))
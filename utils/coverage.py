@@ -0,0 +1,198 @@
+"""
+Индекс покрытия символов шрифтами пользователя.
+
+Для каждого шрифта в БД хранится компактный список диапазонов кодовых точек
+(см. encode_codepoint_ranges). Из диапазонов всех шрифтов пользователя
+собирается объединённый индекс: битовая карта для BMP и отсортированные
+диапазоны для остальных плоскостей. Проверка текста — O(len(text)).
+"""
+
+from __future__ import annotations
+
+import bisect
+import logging
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BMP_SIZE = 0x10000
+
+# Сколько индексов пользователей (по 8 КБ на битовую карту BMP) держим в памяти
+MAX_CACHED_INDEXES = 256
+# Сколько прочитанных из файлов наборов диапазонов держим в памяти
+MAX_CACHED_FILE_RANGES = 512
+
+# Категории Unicode, которые не требуют глифа (пробелы, управляющие символы)
+_IGNORED_CATEGORY_PREFIXES = ("Z", "C")
+
+
+def encode_codepoint_ranges(codepoints: Iterable[int]) -> str:
+    """Кодирует множество кодовых точек в строку диапазонов: '20-7e,401,410-44f'."""
+    ranges: List[str] = []
+    start = prev = None
+    for cp in sorted(set(codepoints)):
+        if start is None:
+            start = prev = cp
+            continue
+        if cp == prev + 1:
+            prev = cp
+            continue
+        ranges.append(f"{start:x}" if start == prev else f"{start:x}-{prev:x}")
+        start = prev = cp
+    if start is not None:
+        ranges.append(f"{start:x}" if start == prev else f"{start:x}-{prev:x}")
+    return ",".join(ranges)
+
+
+def decode_codepoint_ranges(encoded: Optional[str]) -> List[Tuple[int, int]]:
+    """Обратная операция к encode_codepoint_ranges (включительные диапазоны)."""
+    ranges: List[Tuple[int, int]] = []
+    if not encoded:
+        return ranges
+    for chunk in encoded.split(","):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        if "-" in chunk:
+            start, end = chunk.split("-", 1)
+            ranges.append((int(start, 16), int(end, 16)))
+        else:
+            cp = int(chunk, 16)
+            ranges.append((cp, cp))
+    return ranges
+
+
+class CoverageIndex:
+    """Объединённое покрытие символов набора шрифтов."""
+
+    __slots__ = ("_bmp", "_astral_starts", "_astral_ends")
+
+    def __init__(self, ranges: Iterable[Tuple[int, int]]):
+        bmp = bytearray(BMP_SIZE // 8)
+        astral: List[Tuple[int, int]] = []
+        for start, end in ranges:
+            if start < BMP_SIZE:
+                for cp in range(start, min(end, BMP_SIZE - 1) + 1):
+                    bmp[cp >> 3] |= 1 << (cp & 7)
+            if end >= BMP_SIZE:
+                astral.append((max(start, BMP_SIZE), end))
+
+        # Сливаем пересекающиеся диапазоны за пределами BMP
+        astral.sort()
+        merged: List[Tuple[int, int]] = []
+        for start, end in astral:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+
+        self._bmp = bytes(bmp)
+        self._astral_starts = [start for start, _ in merged]
+        self._astral_ends = [end for _, end in merged]
+
+    def __contains__(self, char: str) -> bool:
+        cp = ord(char)
+        if cp < BMP_SIZE:
+            return bool(self._bmp[cp >> 3] & (1 << (cp & 7)))
+        idx = bisect.bisect_right(self._astral_starts, cp) - 1
+        return idx >= 0 and cp <= self._astral_ends[idx]
+
+    def missing_chars(self, text: str) -> List[str]:
+        """Уникальные символы текста без глифа ни в одном шрифте (в порядке появления)."""
+        missing: Dict[str, None] = {}
+        bmp = self._bmp
+        for char in text:
+            cp = ord(char)
+            if cp < BMP_SIZE:
+                if bmp[cp >> 3] & (1 << (cp & 7)):
+                    continue
+            elif char in self:
+                continue
+            if char in missing:
+                continue
+            if unicodedata.category(char).startswith(_IGNORED_CATEGORY_PREFIXES):
+                continue
+            missing[char] = None
+        return list(missing)
+
+
+# Кодовые точки шрифтов без сохранённого покрытия (старые записи): (path, mtime) -> диапазоны (порядок — LRU)
+_file_ranges_cache: "OrderedDict[Tuple[str, float], List[Tuple[int, int]]]" = OrderedDict()
+# Индексы пользователей: user_id -> (версия набора шрифтов, индекс) (порядок — LRU)
+_user_indexes: "OrderedDict[int, Tuple[tuple, CoverageIndex]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _lru_put(cache: OrderedDict, key, value, max_size: int) -> None:
+    """Вызывается под _lock"""
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
+
+def _record_ranges(record: dict) -> List[Tuple[int, int]]:
+    encoded = record.get("codepoints")
+    if encoded:
+        return decode_codepoint_ranges(encoded)
+
+    path = record.get("path")
+    if not path or not os.path.exists(path):
+        return []
+    key = (path, os.path.getmtime(path))
+    with _lock:
+        ranges = _file_ranges_cache.get(key)
+        if ranges is not None:
+            _file_ranges_cache.move_to_end(key)
+    if ranges is None:
+        from utils.font_analyzer import collect_font_codepoints
+        try:
+            ranges = decode_codepoint_ranges(encode_codepoint_ranges(collect_font_codepoints(path)))
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать cmap шрифта {path}: {e}")
+            ranges = []
+        with _lock:
+            _lru_put(_file_ranges_cache, key, ranges, MAX_CACHED_FILE_RANGES)
+    return ranges
+
+
+def _font_set_records(font_sets: dict) -> List[dict]:
+    records = list(font_sets.get("all") or [])
+    base = font_sets.get("base")
+    if base and base not in records:
+        records.insert(0, base)
+    return records
+
+
+def build_coverage_index(font_sets: dict) -> CoverageIndex:
+    ranges: List[Tuple[int, int]] = []
+    for record in _font_set_records(font_sets):
+        ranges.extend(_record_ranges(record))
+    return CoverageIndex(ranges)
+
+
+def get_user_coverage_index(user_id: int, font_sets: dict) -> CoverageIndex:
+    """Индекс покрытия пользователя (пересобирается только при изменении набора шрифтов)."""
+    version = tuple(
+        (record.get("path"), record.get("codepoints"))
+        for record in _font_set_records(font_sets)
+    )
+    with _lock:
+        cached = _user_indexes.get(user_id)
+        if cached is not None and cached[0] == version:
+            _user_indexes.move_to_end(user_id)
+            return cached[1]
+
+    index = build_coverage_index(font_sets)
+    with _lock:
+        _lru_put(_user_indexes, user_id, (version, index), MAX_CACHED_INDEXES)
+    return index
+
+
+def invalidate_user_coverage(user_id: int) -> None:
+    with _lock:
+        _user_indexes.pop(user_id, None)
@@ -0,0 +1,126 @@
+"""
+Каталог шрифтов создателя (папка sevafont/).
+
+Шрифты анализируются один раз — при старте бота или после изменения
+директории (по mtime) — и дальше выдаются из памяти.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from config import CREATOR_FONT_DIR
+from utils.font_analyzer import analyze_font, FontCapabilities
+
+logger = logging.getLogger(__name__)
+
+# Сколько шрифтов каждого типа выдаём пользователю
+CREATOR_FONT_LIMITS = {
+    "cyrillic_full": 3,
+    "latin": 2,
+    "digits": 2,
+}
+
+
+@dataclass(frozen=True)
+class CreatorCatalogue:
+    dir_mtime_ns: Optional[int]
+    cyrillic: Tuple[FontCapabilities, ...]
+    latin: Tuple[FontCapabilities, ...]
+    digits: Tuple[FontCapabilities, ...]
+
+    @property
+    def selected(self) -> Tuple[FontCapabilities, ...]:
+        """Шрифты, которые назначаются пользователю (лучшие по coverage_score)."""
+        return (
+            self.cyrillic[:CREATOR_FONT_LIMITS["cyrillic_full"]]
+            + self.latin[:CREATOR_FONT_LIMITS["latin"]]
+            + self.digits[:CREATOR_FONT_LIMITS["digits"]]
+        )
+
+    @property
+    def paths(self) -> List[str]:
+        return [caps.path for caps in self.cyrillic + self.latin + self.digits]
+
+
+_catalogue: Optional[CreatorCatalogue] = None
+_lock = threading.Lock()
+
+
+def _dir_mtime_ns() -> Optional[int]:
+    try:
+        return os.stat(CREATOR_FONT_DIR).st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_creator_font_paths() -> List[str]:
+    """
+    Возвращает список путей ко всем шрифтам создателя.
+    Ищет ТОЛЬКО в папке sevafont/ - без fallback на другие папки.
+    """
+    font_paths = []
+
+    if not os.path.exists(CREATOR_FONT_DIR):
+        return font_paths
+
+    for file in sorted(os.listdir(CREATOR_FONT_DIR)):
+        if file.lower().endswith('.ttf') and not file.startswith('.'):
+            font_path = os.path.join(CREATOR_FONT_DIR, file)
+            if os.path.isfile(font_path):
+                font_paths.append(font_path)
+
+    return font_paths
+
+
+def _build_catalogue(dir_mtime_ns: Optional[int]) -> CreatorCatalogue:
+    cyrillic_fonts: List[FontCapabilities] = []
+    latin_fonts: List[FontCapabilities] = []
+    digits_fonts: List[FontCapabilities] = []
+
+    for font_path in get_creator_font_paths():
+        try:
+            capabilities = analyze_font(font_path)
+        except Exception as e:
+            # Пропускаем шрифты, которые не удалось проанализировать
+            logger.warning(f"Не удалось проанализировать шрифт {font_path}: {e}")
+            continue
+        if capabilities.is_cyrillic_full:
+            cyrillic_fonts.append(capabilities)
+        elif capabilities.font_type == "latin":
+            latin_fonts.append(capabilities)
+        elif capabilities.font_type == "digits" or (capabilities.supports_digits or capabilities.supports_symbols):
+            digits_fonts.append(capabilities)
+
+    # Лучшие по coverage_score первыми
+    for fonts in (cyrillic_fonts, latin_fonts, digits_fonts):
+        fonts.sort(key=lambda caps: caps.coverage_score, reverse=True)
+
+    return CreatorCatalogue(
+        dir_mtime_ns=dir_mtime_ns,
+        cyrillic=tuple(cyrillic_fonts),
+        latin=tuple(latin_fonts),
+        digits=tuple(digits_fonts),
+    )
+
+
+def get_creator_catalogue() -> CreatorCatalogue:
+    """Возвращает каталог, пересобирая его только при изменении директории."""
+    global _catalogue
+    dir_mtime_ns = _dir_mtime_ns()
+    catalogue = _catalogue
+    if catalogue is not None and catalogue.dir_mtime_ns == dir_mtime_ns:
+        return catalogue
+
+    with _lock:
+        if _catalogue is None or _catalogue.dir_mtime_ns != dir_mtime_ns:
+            _catalogue = _build_catalogue(dir_mtime_ns)
+            logger.info(
+                f"Каталог шрифтов создателя: {len(_catalogue.cyrillic)} кириллических, "
+                f"{len(_catalogue.latin)} латинских, {len(_catalogue.digits)} для цифр"
+            )
+        return _catalogue
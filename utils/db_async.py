@@ -0,0 +1,74 @@
+"""
+Асинхронный доступ к БД для хендлеров.
+
+Функции из utils/db_utils.py и utils/job_queue.py (psycopg2, блокирующие)
+выполняются в отдельном пуле потоков db_executor, поэтому event loop не ждёт
+ответа PostgreSQL. Имена и сигнатуры совпадают с исходными — отличается только await.
+"""
+
+import asyncio
+import functools
+from typing import Any, Awaitable, Callable, Optional
+
+from utils import db_utils, job_queue
+from utils.executors import db_executor
+from utils.user_context import UserContext
+
+
+def _to_async(func: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
+
+    return wrapper
+
+
+# Пользователи и настройки
+get_or_create_user = _to_async(db_utils.get_or_create_user)
+get_user_info = _to_async(db_utils.get_user_info)
+update_user_page_format = _to_async(db_utils.update_user_page_format)
+update_user_grid_setting = _to_async(db_utils.update_user_grid_setting)
+update_user_first_page_side = _to_async(db_utils.update_user_first_page_side)
+update_last_seen_at = _to_async(db_utils.update_last_seen_at)
+update_last_seen_batch = _to_async(db_utils.update_last_seen_batch)
+mark_instruction_seen = _to_async(db_utils.mark_instruction_seen)
+set_user_pdf_mode = _to_async(db_utils.set_user_pdf_mode)
+is_user_in_pdf_mode = _to_async(db_utils.is_user_in_pdf_mode)
+load_user_context = _to_async(db_utils.load_user_context)
+
+# Шрифты
+analyze_and_register_font = _to_async(db_utils.analyze_and_register_font)
+get_font_requirement_progress = _to_async(db_utils.get_font_requirement_progress)
+get_user_fonts_by_type = _to_async(db_utils.get_user_fonts_by_type)
+get_fonts_for_generation = _to_async(db_utils.get_fonts_for_generation)
+has_minimum_font_set = _to_async(db_utils.has_minimum_font_set)
+reset_user_fonts = _to_async(db_utils.reset_user_fonts)
+add_creator_font_to_user = _to_async(db_utils.add_creator_font_to_user)
+
+# Задачи генерации
+get_job = _to_async(db_utils.get_job)
+update_job_pdf_path = _to_async(db_utils.update_job_pdf_path)
+update_job_status_failed = _to_async(db_utils.update_job_status_failed)
+set_job_telegram_file_id = _to_async(db_utils.set_job_telegram_file_id)
+get_telegram_file_id = _to_async(db_utils.get_telegram_file_id)
+save_telegram_file_id = _to_async(db_utils.save_telegram_file_id)
+
+# Очередь генерации (utils/job_queue.py)
+enqueue_job = _to_async(job_queue.enqueue_job)
+lease_job = _to_async(job_queue.lease_job)
+reap_expired_jobs = _to_async(job_queue.reap_expired_jobs)
+heartbeat_render_worker = _to_async(job_queue.heartbeat_render_worker)
+claim_job_delivery = _to_async(job_queue.claim_job_delivery)
+finish_job_delivery = _to_async(job_queue.finish_job_delivery)
+retry_job_delivery = _to_async(job_queue.retry_job_delivery)
+fetch_due_deliveries = _to_async(job_queue.fetch_due_deliveries)
+get_queue_depth = _to_async(job_queue.get_queue_depth)
+cancel_job = _to_async(job_queue.cancel_job)
+
+
+async def fresh_user_context(user_id: int, user_ctx: Optional[UserContext] = None) -> UserContext:
+    """Контекст из middleware, если он не устарел после записи, иначе — заново из БД."""
+    if user_ctx is not None and user_ctx.user_id == user_id and not user_ctx.is_stale:
+        return user_ctx
+    return await load_user_context(user_id)
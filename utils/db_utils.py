@@ -6,12 +6,25 @@ from __future__ import annotations
 
 from typing import Dict, List, Optional
 
-from database.connection import get_db_connection, return_db_connection
-from config import FONTS_DIR, ADMIN_USER_ID, CREATOR_FONT_DIR
+from psycopg2.extras import execute_values
+
+from database.connection import get_db_connection, return_db_connection, db_cursor
+from database.partitions import JOB_BY_ID, job_id_params
+from config import FONTS_DIR, ADMIN_USER_ID
 from utils.font_analyzer import analyze_font, FontCapabilities
+from utils.creator_fonts import get_creator_catalogue
+from utils.selector_cache import invalidate_user_selectors
+from utils.coverage import invalidate_user_coverage
+from utils.user_context import (
+    UserContext,
+    get_cached_context,
+    get_context_version,
+    invalidate_user_context,
+    store_context,
+    write_through_settings,
+)
 import json
 import os
-import shutil
 
 
 FONT_REQUIREMENTS = {
@@ -28,41 +41,18 @@ def is_admin(user_id: int) -> bool:
     return user_id == ADMIN_USER_ID
 
 
-def _ensure_fonts_table(cursor) -> None:
-    cursor.execute(
-        """
-        SELECT COUNT(*)
-        FROM information_schema.tables
-        WHERE table_name = 'fonts'
-        """
-    )
-    if cursor.fetchone()[0] == 0:
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS fonts (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT NOT NULL,
-                path TEXT NOT NULL,
-                font_type VARCHAR(32) NOT NULL,
-                supports_cyrillic_lower BOOLEAN DEFAULT FALSE,
-                supports_cyrillic_upper BOOLEAN DEFAULT FALSE,
-                supports_latin_lower BOOLEAN DEFAULT FALSE,
-                supports_latin_upper BOOLEAN DEFAULT FALSE,
-                supports_digits BOOLEAN DEFAULT FALSE,
-                supports_symbols BOOLEAN DEFAULT FALSE,
-                coverage_score INTEGER DEFAULT 0,
-                is_base BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE (user_id, path)
-            );
-            """
-        )
-        cursor.execute(
-            """
-            CREATE INDEX IF NOT EXISTS idx_fonts_user_type
-            ON fonts (user_id, font_type);
-            """
-        )
+def drop_local_user_caches(user_id: int) -> None:
+    """Сбрасывает кэши пользователя в этом процессе (изменение пришло из другого процесса)."""
+    invalidate_user_selectors(user_id)
+    invalidate_user_coverage(user_id)
+    invalidate_user_context(user_id, publish=False)
+
+
+def _on_user_fonts_changed(user_id: int) -> None:
+    """Сбрасывает кэши, зависящие от набора шрифтов пользователя."""
+    invalidate_user_selectors(user_id)
+    invalidate_user_coverage(user_id)
+    invalidate_user_context(user_id)
 
 
 def _decide_font_type(capabilities: FontCapabilities) -> str:
@@ -89,9 +79,10 @@ def _insert_or_update_font(
             supports_digits,
             supports_symbols,
             coverage_score,
+            codepoints,
             is_base
         )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         ON CONFLICT (user_id, path) DO UPDATE SET
             font_type = EXCLUDED.font_type,
             supports_cyrillic_lower = EXCLUDED.supports_cyrillic_lower,
@@ -101,6 +92,7 @@ def _insert_or_update_font(
             supports_digits = EXCLUDED.supports_digits,
             supports_symbols = EXCLUDED.supports_symbols,
             coverage_score = EXCLUDED.coverage_score,
+            codepoints = EXCLUDED.codepoints,
             is_base = EXCLUDED.is_base,
             created_at = CASE
                 WHEN fonts.created_at IS NULL THEN CURRENT_TIMESTAMP
@@ -118,6 +110,7 @@ def _insert_or_update_font(
             capabilities.supports_digits,
             capabilities.supports_symbols,
             capabilities.coverage_score,
+            capabilities.codepoints or None,
             is_base,
         ),
     )
@@ -151,7 +144,6 @@ def analyze_and_register_font(user_id: int, font_path: str) -> Dict[str, object]
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        _ensure_fonts_table(cursor)
         font_type = _decide_font_type(capabilities)
         # Определяем, должен ли шрифт стать базовым
         is_base_candidate = capabilities.is_cyrillic_full
@@ -168,6 +160,7 @@ def analyze_and_register_font(user_id: int, font_path: str) -> Dict[str, object]
         cursor.close()
         return_db_connection(conn)
 
+    _on_user_fonts_changed(user_id)
     sync_user_font_variants(user_id)
     return {
         "progress": get_font_requirement_progress(user_id),
@@ -176,59 +169,31 @@ def analyze_and_register_font(user_id: int, font_path: str) -> Dict[str, object]
     }
 
 
-def get_font_requirement_progress(user_id: int) -> Dict[str, Dict[str, int]]:
-    """
-    Возвращает прогресс по требованиям к шрифтам.
-    {
-        "cyrillic_full": {"current": X, "required": 3},
-        ...
-    }
-    Считает уникальные шрифты по их возможностям, а не по font_type.
-    """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        _ensure_fonts_table(cursor)
-        # Получаем все шрифты пользователя
-        cursor.execute(
-            """
-            SELECT DISTINCT path,
-                   supports_cyrillic_lower,
-                   supports_cyrillic_upper,
-                   supports_latin_lower,
-                   supports_latin_upper,
-                   supports_digits,
-                   supports_symbols
-            FROM fonts
-            WHERE user_id = %s
-            """,
-            (user_id,),
-        )
-        rows = cursor.fetchall() or []
-    finally:
-        cursor.close()
-        return_db_connection(conn)
-
-    # Считаем шрифты по их возможностям
+def _progress_from_rows(rows) -> Dict[str, Dict[str, int]]:
+    """Считает прогресс по требованиям из строк (path, cyr_lower, cyr_upper, lat_lower, lat_upper, digits, symbols)."""
     cyrillic_full_count = 0
     digits_count = 0
     latin_count = 0
-    
+    seen_paths = set()
+
     for row in rows:
         path, cyr_lower, cyr_upper, lat_lower, lat_upper, digits, symbols = row
-        
+        if path in seen_paths:
+            continue
+        seen_paths.add(path)
+
         # Кириллический полный (строчные И заглавные)
         if cyr_lower and cyr_upper:
             cyrillic_full_count += 1
-        
+
         # Цифры и спецсимволы
         if digits or symbols:
             digits_count += 1
-        
+
         # Латиница (строчные ИЛИ заглавные)
         if lat_lower or lat_upper:
             latin_count += 1
-    
+
     progress: Dict[str, Dict[str, int]] = {}
     progress["cyrillic_full"] = {
         "current": cyrillic_full_count,
@@ -242,30 +207,49 @@ def get_font_requirement_progress(user_id: int) -> Dict[str, Dict[str, int]]:
         "current": latin_count,
         "required": FONT_REQUIREMENTS.get("latin", 2),
     }
-    
+
     return progress
 
 
-def get_user_fonts_by_type(user_id: int) -> Dict[str, List[str]]:
-    """Возвращает шрифты пользователя, сгруппированные по типам."""
+def _progress_from_records(records: List[Dict[str, object]]) -> Dict[str, Dict[str, int]]:
+    return _progress_from_rows(
+        (
+            record["path"],
+            record["supports_cyrillic_lower"],
+            record["supports_cyrillic_upper"],
+            record["supports_latin_lower"],
+            record["supports_latin_upper"],
+            record["supports_digits"],
+            record["supports_symbols"],
+        )
+        for record in records
+    )
+
+
+def get_font_requirement_progress(user_id: int) -> Dict[str, Dict[str, int]]:
+    """
+    Возвращает прогресс по требованиям к шрифтам.
+    {
+        "cyrillic_full": {"current": X, "required": 3},
+        ...
+    }
+    Считает уникальные шрифты по их возможностям, а не по font_type.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        _ensure_fonts_table(cursor)
+        # Получаем все шрифты пользователя
         cursor.execute(
             """
-            SELECT path,
-                   font_type,
+            SELECT DISTINCT path,
                    supports_cyrillic_lower,
                    supports_cyrillic_upper,
                    supports_latin_lower,
                    supports_latin_upper,
                    supports_digits,
-                   supports_symbols,
-                   is_base
+                   supports_symbols
             FROM fonts
             WHERE user_id = %s
-            ORDER BY is_base DESC, coverage_score DESC
             """,
             (user_id,),
         )
@@ -274,100 +258,103 @@ def get_user_fonts_by_type(user_id: int) -> Dict[str, List[str]]:
         cursor.close()
         return_db_connection(conn)
 
+    return _progress_from_rows(rows)
+
+
+def _fonts_by_type_from_records(records: List[Dict[str, object]]) -> Dict[str, List[str]]:
     result: Dict[str, List[str]] = {key: [] for key in FONT_TYPE_ORDER}
     result["base"] = []
 
-    for (
-        path,
-        font_type,
-        supports_cyrillic_lower,
-        supports_cyrillic_upper,
-        supports_latin_lower,
-        supports_latin_upper,
-        supports_digits,
-        supports_symbols,
-        is_base,
-    ) in rows:
-        if is_base:
+    for record in records:
+        path = record["path"]
+        if record["is_base"]:
             result.setdefault("base", []).append(path)
-        result.setdefault(font_type, []).append(path)
-        if supports_digits:
+        result.setdefault(record["font_type"], []).append(path)
+        if record["supports_digits"]:
             result.setdefault("digits", []).append(path)
-        if supports_latin_lower or supports_latin_upper:
+        if record["supports_latin_lower"] or record["supports_latin_upper"]:
             result.setdefault("latin", []).append(path)
-        if supports_cyrillic_lower or supports_cyrillic_upper:
+        if record["supports_cyrillic_lower"] or record["supports_cyrillic_upper"]:
             result.setdefault("cyrillic_partial", []).append(path)
     return result
 
 
-def get_fonts_for_generation(user_id: int) -> Dict[str, List[Dict[str, object]]]:
-    """
-    Возвращает наборы шрифтов для генерации:
-    {
-        "base": {...} или None,
-        "cyrillic": [ {...}, ... ],
-        "latin": [...],
-        "digits": [...],
-        "other": [...],
-        "all": [...]
-    }
-    """
+def get_user_fonts_by_type(user_id: int) -> Dict[str, List[str]]:
+    """Возвращает шрифты пользователя, сгруппированные по типам."""
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        _ensure_fonts_table(cursor)
-        cursor.execute(
-            """
-            SELECT path,
-                   font_type,
-                   supports_cyrillic_lower,
-                   supports_cyrillic_upper,
-                   supports_latin_lower,
-                   supports_latin_upper,
-                   supports_digits,
-                   supports_symbols,
-                   coverage_score,
-                   is_base
-            FROM fonts
-            WHERE user_id = %s
-            ORDER BY is_base DESC, coverage_score DESC
-            """,
-            (user_id,),
-        )
-        rows = cursor.fetchall() or []
+        records = _fetch_font_records(cursor, user_id)
     finally:
         cursor.close()
         return_db_connection(conn)
 
-    records: List[Dict[str, object]] = []
-    for row in rows:
-        (
-            path,
-            font_type,
-            supports_cyrillic_lower,
-            supports_cyrillic_upper,
-            supports_latin_lower,
-            supports_latin_upper,
-            supports_digits,
-            supports_symbols,
-            coverage_score,
-            is_base,
-        ) = row
-        records.append(
-            {
-                "path": path,
-                "font_type": font_type,
-                "supports_cyrillic_lower": supports_cyrillic_lower,
-                "supports_cyrillic_upper": supports_cyrillic_upper,
-                "supports_latin_lower": supports_latin_lower,
-                "supports_latin_upper": supports_latin_upper,
-                "supports_digits": supports_digits,
-                "supports_symbols": supports_symbols,
-                "coverage_score": coverage_score,
-                "is_base": is_base,
-            }
-        )
+    return _fonts_by_type_from_records(records)
+
+
+_FONT_RECORD_FIELDS = (
+    "path",
+    "font_type",
+    "supports_cyrillic_lower",
+    "supports_cyrillic_upper",
+    "supports_latin_lower",
+    "supports_latin_upper",
+    "supports_digits",
+    "supports_symbols",
+    "coverage_score",
+    "is_base",
+    "codepoints",
+)
+
 
+def _fetch_font_records(cursor, user_id: int) -> List[Dict[str, object]]:
+    """Читает шрифты пользователя (базовый и лучшие по покрытию первыми)."""
+    cursor.execute(
+        """
+        SELECT path,
+               font_type,
+               supports_cyrillic_lower,
+               supports_cyrillic_upper,
+               supports_latin_lower,
+               supports_latin_upper,
+               supports_digits,
+               supports_symbols,
+               coverage_score,
+               is_base,
+               codepoints
+        FROM fonts
+        WHERE user_id = %s
+        ORDER BY is_base DESC, coverage_score DESC
+        """,
+        (user_id,),
+    )
+    rows = cursor.fetchall() or []
+    return [dict(zip(_FONT_RECORD_FIELDS, row)) for row in rows]
+
+
+def _fallback_base_record(base_path: str) -> Dict[str, object]:
+    """Запись базового шрифта из users.font_path, если его нет в таблице fonts."""
+    return {
+        "path": base_path,
+        "font_type": "cyrillic_full",
+        "supports_cyrillic_lower": True,
+        "supports_cyrillic_upper": True,
+        "supports_latin_lower": False,
+        "supports_latin_upper": False,
+        "supports_digits": False,
+        "supports_symbols": False,
+        "coverage_score": 0,
+        "is_base": True,
+        # Покрытие неизвестно — индекс прочитает cmap из файла
+        "codepoints": None,
+    }
+
+
+def _group_font_records(
+    records: List[Dict[str, object]],
+    fallback_base_path: Optional[str] = None,
+) -> Dict[str, List[Dict[str, object]]]:
+    """Раскладывает записи шрифтов по наборам для генерации."""
     base_record: Optional[Dict[str, object]] = None
     cyrillic_records: List[Dict[str, object]] = []
     latin_records: List[Dict[str, object]] = []
@@ -387,25 +374,10 @@ def get_fonts_for_generation(user_id: int) -> Dict[str, List[Dict[str, object]]]
         else:
             other_records.append(record)
 
-    # Если базовый шрифт отсутствует в таблице, пробуем взять из users.font_path
-    if base_record is None:
-        user = get_user_info(user_id)
-        base_path = user.get("font_path") if user else None
-        if base_path:
-            base_record = {
-                "path": base_path,
-                "font_type": "cyrillic_full",
-                "supports_cyrillic_lower": True,
-                "supports_cyrillic_upper": True,
-                "supports_latin_lower": False,
-                "supports_latin_upper": False,
-                "supports_digits": False,
-                "supports_symbols": False,
-                "coverage_score": 0,
-                "is_base": True,
-            }
+    if base_record is None and fallback_base_path:
+        base_record = _fallback_base_record(fallback_base_path)
 
-    all_records = records.copy()
+    all_records = list(records)
     if base_record and base_record not in all_records:
         all_records.insert(0, base_record)
 
@@ -419,6 +391,35 @@ def get_fonts_for_generation(user_id: int) -> Dict[str, List[Dict[str, object]]]
     }
 
 
+def get_fonts_for_generation(user_id: int) -> Dict[str, List[Dict[str, object]]]:
+    """
+    Возвращает наборы шрифтов для генерации:
+    {
+        "base": {...} или None,
+        "cyrillic": [ {...}, ... ],
+        "latin": [...],
+        "digits": [...],
+        "other": [...],
+        "all": [...]
+    }
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        records = _fetch_font_records(cursor, user_id)
+    finally:
+        cursor.close()
+        return_db_connection(conn)
+
+    # Если базовый шрифт отсутствует в таблице, пробуем взять из users.font_path
+    fallback_base_path = None
+    if not any(record["is_base"] for record in records):
+        user = get_user_info(user_id)
+        fallback_base_path = user.get("font_path") if user else None
+
+    return _group_font_records(records, fallback_base_path)
+
+
 def has_minimum_font_set(user_id: int) -> bool:
     """Проверяет, достаточно ли шрифтов для генерации PDF.
     Достаточно хотя бы одного кириллического шрифта."""
@@ -428,9 +429,7 @@ def has_minimum_font_set(user_id: int) -> bool:
     return len(cyrillic_fonts) > 0
 
 
-def sync_user_font_variants(user_id: int) -> None:
-    """Обновляет список вариативных шрифтов пользователя из таблицы fonts."""
-    fonts = get_fonts_for_generation(user_id)
+def _variant_paths(fonts: Dict[str, List[Dict[str, object]]]) -> List[str]:
     base = fonts.get("base")
     base_path = base["path"] if base else None
     cyrillic_variants = [
@@ -443,8 +442,13 @@ def sync_user_font_variants(user_id: int) -> None:
         for record in fonts.get("latin", []) + fonts.get("digits", [])
         if record["path"] != base_path
     ]
-    variants = cyrillic_variants + additional
-    update_user_variant_fonts(user_id, variants)
+    return cyrillic_variants + additional
+
+
+def sync_user_font_variants(user_id: int) -> None:
+    """Обновляет список вариативных шрифтов пользователя из таблицы fonts."""
+    fonts = get_fonts_for_generation(user_id)
+    update_user_variant_fonts(user_id, _variant_paths(fonts))
 
 
 def get_or_create_user(
@@ -454,49 +458,38 @@ def get_or_create_user(
     last_name: Optional[str] = None,
 ):
     """Получает пользователя из БД или создает нового, обновляя профиль."""
+    profile = {'username': username, 'first_name': first_name, 'last_name': last_name}
+    ctx = get_cached_context(user_id)
+    if ctx is not None and ctx.exists and all(
+        value is None or ctx.user.get(key) == value for key, value in profile.items()
+    ):
+        # Пользователь есть и профиль не изменился — upsert не нужен
+        # (last_seen_at пишет LastSeenMiddleware)
+        return {
+            'user_id': user_id,
+            'font_path': ctx.user.get('font_path'),
+            'page_format': ctx.user.get('page_format'),
+        }
+
     conn = get_db_connection()
     cursor = conn.cursor()
 
     try:
-        # Проверяем наличие колонок профиля
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='users' AND column_name IN ('username', 'first_name', 'last_name', 'last_seen_at')
-        """)
-        existing_columns = {row[0] for row in cursor.fetchall()}
-        
-        has_profile_fields = 'username' in existing_columns
-        
-        if has_profile_fields:
-            # Используем полный запрос с профильными полями
-            cursor.execute(
-                """
-                INSERT INTO users (user_id, page_format, username, first_name, last_name, last_seen_at)
-                VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-                ON CONFLICT (user_id) DO UPDATE SET
-                    username = COALESCE(EXCLUDED.username, users.username),
-                    first_name = COALESCE(EXCLUDED.first_name, users.first_name),
-                    last_name = COALESCE(EXCLUDED.last_name, users.last_name),
-                    last_seen_at = CURRENT_TIMESTAMP,
-                    updated_at = CURRENT_TIMESTAMP
-                RETURNING user_id, font_path, page_format
-                """,
-                (user_id, 'A5', username, first_name, last_name),
-            )
-        else:
-            # Используем упрощенный запрос без профильных полей
-            cursor.execute(
-                """
-                INSERT INTO users (user_id, page_format)
-                VALUES (%s, %s)
-                ON CONFLICT (user_id) DO UPDATE SET
-                    updated_at = CURRENT_TIMESTAMP
-                RETURNING user_id, font_path, page_format
-                """,
-                (user_id, 'A5'),
-            )
-        
+        cursor.execute(
+            """
+            INSERT INTO users (user_id, page_format, username, first_name, last_name, last_seen_at)
+            VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id) DO UPDATE SET
+                username = COALESCE(EXCLUDED.username, users.username),
+                first_name = COALESCE(EXCLUDED.first_name, users.first_name),
+                last_name = COALESCE(EXCLUDED.last_name, users.last_name),
+                last_seen_at = CURRENT_TIMESTAMP,
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING user_id, font_path, page_format, (xmax = 0) AS inserted
+            """,
+            (user_id, 'A5', username, first_name, last_name),
+        )
+
         user = cursor.fetchone()
         
         # Проверяем, является ли пользователь действительно новым (только что создан)
@@ -513,7 +506,6 @@ def get_or_create_user(
         user_created_info = cursor.fetchone()
         
         # Проверяем количество шрифтов
-        _ensure_fonts_table(cursor)
         cursor.execute("SELECT COUNT(*) FROM fonts WHERE user_id = %s", (user_id,))
         font_count = cursor.fetchone()[0]
         
@@ -526,6 +518,13 @@ def get_or_create_user(
             is_new_user = is_recently_created and font_count == 0
         
         conn.commit()
+        if user[3]:
+            # Новый пользователь: контекст, загруженный до вставки, устарел
+            invalidate_user_context(user_id)
+        else:
+            write_through_settings(
+                user_id, **{key: value for key, value in profile.items() if value is not None}
+            )
         
         # Автоматически добавляем шрифт создателя только для действительно новых пользователей
         if is_new_user:
@@ -565,6 +564,7 @@ def update_user_font(user_id: int, font_path: str):
             (font_path, user_id)
         )
         conn.commit()
+        invalidate_user_context(user_id)
         # Пишем в список последних шрифтов
         try:
             add_recent_font(user_id, font_path)
@@ -594,6 +594,7 @@ def update_user_page_format(user_id: int, page_format: str):
             (page_format, user_id)
         )
         conn.commit()
+        write_through_settings(user_id, page_format=page_format)
         return cursor.rowcount > 0
     finally:
         if cursor:
@@ -604,80 +605,46 @@ def update_user_page_format(user_id: int, page_format: str):
 
 def get_user_info(user_id: int):
     """Получает информацию о пользователе."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # Проверяем наличие колонок
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='users' AND column_name IN ('grid_enabled', 'variant_fonts', 'first_page_side', 'instruction_seen')
-        """)
-        existing_columns = {row[0] for row in cursor.fetchall()}
-        
-        has_grid = 'grid_enabled' in existing_columns
-        has_variants = 'variant_fonts' in existing_columns
-        has_first_page_side = 'first_page_side' in existing_columns
-        has_instruction_seen = 'instruction_seen' in existing_columns
-        
-        # Формируем запрос в зависимости от наличия колонок
-        select_fields = ["user_id", "font_path", "page_format"]
-        if has_grid:
-            select_fields.append("COALESCE(grid_enabled, FALSE)")
-        else:
-            select_fields.append("FALSE")
-        
-        if has_variants:
-            select_fields.append("variant_fonts")
-        else:
-            select_fields.append("NULL")
-        
-        if has_first_page_side:
-            select_fields.append("COALESCE(first_page_side, 'right')")
-        else:
-            select_fields.append("'right'")
-        
-        if has_instruction_seen:
-            select_fields.append("COALESCE(instruction_seen, FALSE)")
-        else:
-            select_fields.append("FALSE")
-        
-        query = f"SELECT {', '.join(select_fields)} FROM users WHERE user_id = %s"
-        cursor.execute(query, (user_id,))
+    ctx = get_cached_context(user_id)
+    if ctx is not None:
+        return dict(ctx.user) if ctx.user else None
+
+    with db_cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT user_id,
+                   font_path,
+                   page_format,
+                   COALESCE(grid_enabled, FALSE),
+                   variant_fonts,
+                   COALESCE(first_page_side, 'right'),
+                   COALESCE(instruction_seen, FALSE)
+            FROM users
+            WHERE user_id = %s
+            """,
+            (user_id,)
+        )
         user = cursor.fetchone()
-        
+
         if user:
             # Парсим JSON для variant_fonts
             variant_fonts = []
-            variant_idx = 4 if has_variants else None
-            if variant_idx is not None and len(user) > variant_idx and user[variant_idx]:
+            if user[4]:
                 try:
-                    variant_fonts = json.loads(user[variant_idx]) if isinstance(user[variant_idx], str) else user[variant_idx]
+                    variant_fonts = json.loads(user[4]) if isinstance(user[4], str) else user[4]
                 except (json.JSONDecodeError, TypeError):
                     variant_fonts = []
-            
-            first_page_side_idx = 5 if has_first_page_side else None
-            first_page_side = user[first_page_side_idx] if first_page_side_idx is not None and len(user) > first_page_side_idx else 'right'
-            
-            instruction_seen_idx = 6 if has_instruction_seen else None
-            instruction_seen = user[instruction_seen_idx] if instruction_seen_idx is not None and len(user) > instruction_seen_idx else False
-            
+
             return {
                 'user_id': user[0],
                 'font_path': user[1],
                 'page_format': user[2],
-                'grid_enabled': user[3] if len(user) > 3 else False,
+                'grid_enabled': user[3],
                 'variant_fonts': variant_fonts if isinstance(variant_fonts, list) else [],
-                'first_page_side': first_page_side,
-                'instruction_seen': instruction_seen
+                'first_page_side': user[5],
+                'instruction_seen': user[6]
             }
         return None
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
 
 
 def update_user_grid_setting(user_id: int, grid_enabled: bool):
@@ -686,21 +653,6 @@ def update_user_grid_setting(user_id: int, grid_enabled: bool):
     cursor = conn.cursor()
     
     try:
-        # Проверяем существует ли колонка
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='users' AND column_name='grid_enabled'
-        """)
-        
-        if not cursor.fetchone():
-            # Добавляем колонку если не существует
-            cursor.execute("""
-                ALTER TABLE users 
-                ADD COLUMN grid_enabled BOOLEAN DEFAULT FALSE
-            """)
-            conn.commit()
-        
         cursor.execute(
             """
             UPDATE users 
@@ -710,6 +662,7 @@ def update_user_grid_setting(user_id: int, grid_enabled: bool):
             (grid_enabled, user_id)
         )
         conn.commit()
+        write_through_settings(user_id, grid_enabled=grid_enabled)
         return cursor.rowcount > 0
     finally:
         if cursor:
@@ -727,21 +680,6 @@ def update_user_first_page_side(user_id: int, first_page_side: str):
     cursor = conn.cursor()
     
     try:
-        # Проверяем существует ли колонка
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='users' AND column_name='first_page_side'
-        """)
-        
-        if not cursor.fetchone():
-            # Добавляем колонку если не существует
-            cursor.execute("""
-                ALTER TABLE users 
-                ADD COLUMN first_page_side VARCHAR(10) DEFAULT 'right'
-            """)
-            conn.commit()
-        
         cursor.execute(
             """
             UPDATE users 
@@ -751,6 +689,7 @@ def update_user_first_page_side(user_id: int, first_page_side: str):
             (first_page_side, user_id)
         )
         conn.commit()
+        write_through_settings(user_id, first_page_side=first_page_side)
         return cursor.rowcount > 0
     finally:
         if cursor:
@@ -759,34 +698,54 @@ def update_user_first_page_side(user_id: int, first_page_side: str):
             return_db_connection(conn)
 
 
+def update_last_seen_batch(seen_at: Dict[int, float]) -> int:
+    """
+    Записывает накопленные времена визитов одним UPDATE ... FROM (VALUES ...).
+
+    seen_at: user_id -> unix-время последнего визита. Возвращает число обновлённых строк.
+    """
+    if not seen_at:
+        return 0
+
+    with db_cursor(commit=True) as cursor:
+        # Строки блокируются по возрастанию user_id — как и в параллельной пачке
+        # другого процесса, иначе две пачки могут заблокировать друг друга
+        cursor.execute(
+            "SELECT 1 FROM users WHERE user_id = ANY(%s) ORDER BY user_id FOR NO KEY UPDATE",
+            (list(seen_at),),
+        )
+        execute_values(
+            cursor,
+            """
+            UPDATE users
+            SET last_seen_at = GREATEST(users.last_seen_at, v.seen_at),
+                updated_at = CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS v(user_id, seen_at)
+            WHERE users.user_id = v.user_id
+            """,
+            list(seen_at.items()),
+            template="(%s::bigint, to_timestamp(%s)::timestamp)",
+            page_size=len(seen_at),
+        )
+        return cursor.rowcount
+
+
 def update_last_seen_at(user_id: int):
     """Обновляет время последнего визита пользователя."""
     conn = get_db_connection()
     cursor = conn.cursor()
-    
+
     try:
-        # Проверяем существует ли колонка last_seen_at
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='users' AND column_name='last_seen_at'
-        """)
-        
-        if cursor.fetchone():
-            # Колонка существует, обновляем
-            cursor.execute(
-                """
-                UPDATE users 
-                SET last_seen_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = %s
-                """,
-                (user_id,)
-            )
-            conn.commit()
-            return cursor.rowcount > 0
-        else:
-            # Колонка не существует, ничего не делаем
-            return False
+        cursor.execute(
+            """
+            UPDATE users
+            SET last_seen_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = %s
+            """,
+            (user_id,)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
     except Exception as e:
         # В случае ошибки просто игнорируем (не критично)
         return False
@@ -803,21 +762,6 @@ def mark_instruction_seen(user_id: int):
     cursor = conn.cursor()
     
     try:
-        # Проверяем существует ли колонка instruction_seen
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='users' AND column_name='instruction_seen'
-        """)
-        
-        if not cursor.fetchone():
-            # Добавляем колонку если не существует
-            cursor.execute("""
-                ALTER TABLE users 
-                ADD COLUMN instruction_seen BOOLEAN DEFAULT FALSE
-            """)
-            conn.commit()
-        
         # Обновляем флаг
         cursor.execute(
             """
@@ -828,6 +772,7 @@ def mark_instruction_seen(user_id: int):
             (user_id,)
         )
         conn.commit()
+        write_through_settings(user_id, instruction_seen=True)
         return cursor.rowcount > 0
     except Exception as e:
         # В случае ошибки просто игнорируем (не критично)
@@ -845,21 +790,6 @@ def set_user_pdf_mode(user_id: int, enabled: bool):
     cursor = conn.cursor()
     
     try:
-        # Проверяем существует ли колонка pdf_mode_enabled
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='users' AND column_name='pdf_mode_enabled'
-        """)
-        
-        if not cursor.fetchone():
-            # Добавляем колонку если не существует
-            cursor.execute("""
-                ALTER TABLE users 
-                ADD COLUMN pdf_mode_enabled BOOLEAN DEFAULT FALSE
-            """)
-            conn.commit()
-        
         # Обновляем флаг
         cursor.execute(
             """
@@ -870,6 +800,7 @@ def set_user_pdf_mode(user_id: int, enabled: bool):
             (enabled, user_id)
         )
         conn.commit()
+        write_through_settings(user_id, pdf_mode=enabled)
         return cursor.rowcount > 0
     except Exception as e:
         # В случае ошибки просто игнорируем (не критично)
@@ -883,31 +814,20 @@ def set_user_pdf_mode(user_id: int, enabled: bool):
 
 def is_user_in_pdf_mode(user_id: int) -> bool:
     """Проверяет, находится ли пользователь в режиме создания PDF"""
-    user_info = get_user_info(user_id)
-    if not user_info:
-        return False
-    
-    # Проверяем наличие колонки в БД
+    ctx = get_cached_context(user_id)
+    if ctx is not None:
+        return ctx.pdf_mode
+
     conn = get_db_connection()
     cursor = conn.cursor()
-    
+
     try:
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='users' AND column_name='pdf_mode_enabled'
-        """)
-        
-        if cursor.fetchone():
-            # Колонка существует, получаем значение
-            cursor.execute(
-                "SELECT pdf_mode_enabled FROM users WHERE user_id = %s",
-                (user_id,)
-            )
-            result = cursor.fetchone()
-            return result[0] if result and result[0] else False
-        else:
-            return False
+        cursor.execute(
+            "SELECT COALESCE(pdf_mode_enabled, FALSE) FROM users WHERE user_id = %s",
+            (user_id,)
+        )
+        result = cursor.fetchone()
+        return bool(result and result[0])
     except Exception:
         return False
     finally:
@@ -917,21 +837,91 @@ def is_user_in_pdf_mode(user_id: int) -> bool:
             return_db_connection(conn)
 
 
-def _ensure_recent_fonts_table(cursor):
-    """Гарантирует наличие таблицы для хранения последних шрифтов."""
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_recent_fonts (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            font_path TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """)
-    # Индекс по пользователю и времени
-    cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_user_recent_fonts_user_time
-        ON user_recent_fonts (user_id, created_at DESC);
-    """)
+def load_user_context(user_id: int) -> UserContext:
+    """
+    Загружает профиль, настройки, режим PDF и шрифты пользователя одним запросом.
+
+    Актуальный контекст берётся из кэша процесса без обращения к БД.
+    """
+    ctx = get_cached_context(user_id)
+    if ctx is not None:
+        return ctx
+
+    version = get_context_version(user_id)
+    font_json = ", ".join(f"'{name}', f.{name}" for name in _FONT_RECORD_FIELDS)
+    with db_cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT u.user_id,
+                   u.font_path,
+                   u.page_format,
+                   COALESCE(u.grid_enabled, FALSE),
+                   u.variant_fonts,
+                   COALESCE(u.first_page_side, 'right'),
+                   COALESCE(u.instruction_seen, FALSE),
+                   COALESCE(u.pdf_mode_enabled, FALSE),
+                   u.username,
+                   u.first_name,
+                   u.last_name,
+                   COALESCE(
+                       (
+                           SELECT json_agg(
+                               json_build_object({font_json})
+                               ORDER BY f.is_base DESC, f.coverage_score DESC
+                           )
+                           FROM fonts f
+                           WHERE f.user_id = u.user_id
+                       ),
+                       '[]'::json
+                   )
+            FROM users u
+            WHERE u.user_id = %s
+            """,
+            (user_id,)
+        )
+        row = cursor.fetchone()
+
+    user = None
+    pdf_mode = False
+    records: List[Dict[str, object]] = []
+    if row:
+        variant_fonts = row[4]
+        if isinstance(variant_fonts, str):
+            try:
+                variant_fonts = json.loads(variant_fonts)
+            except (json.JSONDecodeError, TypeError):
+                variant_fonts = []
+        user = {
+            'user_id': row[0],
+            'font_path': row[1],
+            'page_format': row[2],
+            'grid_enabled': row[3],
+            'variant_fonts': variant_fonts if isinstance(variant_fonts, list) else [],
+            'first_page_side': row[5],
+            'instruction_seen': row[6],
+            'username': row[8],
+            'first_name': row[9],
+            'last_name': row[10],
+        }
+        pdf_mode = bool(row[7])
+        records = [dict(record) for record in (row[11] or [])]
+
+    fallback_base_path = None
+    if user and not any(record["is_base"] for record in records):
+        fallback_base_path = user.get("font_path")
+
+    ctx = UserContext(
+        user_id=user_id,
+        version=version,
+        user=user,
+        pdf_mode=pdf_mode,
+        font_records=tuple(records),
+        font_sets=_group_font_records(records, fallback_base_path),
+        fonts_by_type=_fonts_by_type_from_records(records),
+        progress=_progress_from_records(records),
+    )
+    store_context(ctx)
+    return ctx
 
 
 def add_recent_font(user_id: int, font_path: str, keep_last: int = 10):
@@ -939,7 +929,6 @@ def add_recent_font(user_id: int, font_path: str, keep_last: int = 10):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        _ensure_recent_fonts_table(cursor)
         # Удалим старые дубликаты того же пути, чтобы поднять его наверх
         cursor.execute(
             "DELETE FROM user_recent_fonts WHERE user_id = %s AND font_path = %s",
@@ -976,7 +965,6 @@ def get_recent_fonts(user_id: int, limit: int = 3):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        _ensure_recent_fonts_table(cursor)
         cursor.execute(
             """
             SELECT font_path
@@ -996,27 +984,62 @@ def get_recent_fonts(user_id: int, limit: int = 3):
             return_db_connection(conn)
 
 
-def save_font_file(file, filename: str) -> str:
-    """Сохраняет файл шрифта и возвращает путь к нему."""
-    os.makedirs(FONTS_DIR, exist_ok=True)
-    file_path = os.path.join(FONTS_DIR, filename)
-    
-    # Читаем файл по частям если это файловый объект
-    with open(file_path, 'wb') as f:
-        if hasattr(file, 'read'):
-            # Если это BytesIO или файловый объект
-            content = file.read()
-            if isinstance(content, bytes):
-                f.write(content)
-            else:
-                # Если read() вернул что-то другое, читаем заново
-                file.seek(0)
-                f.write(file.read())
-        else:
-            # Если это просто bytes
-            f.write(file)
-    
-    return file_path
+def get_job(job_id: int) -> Optional[Dict[str, object]]:
+    """Возвращает владельца, чат, путь к PDF, время генерации, статус, ошибку и file_id PDF задачи."""
+    with db_cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT user_id, pdf_path, execution_time_ms, status, chat_id, error_message, render_params,
+                   telegram_file_id
+            FROM jobs
+            WHERE {JOB_BY_ID}
+            """,
+            job_id_params(job_id)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return {
+            "id": job_id,
+            "user_id": row[0],
+            "pdf_path": row[1],
+            "execution_time_ms": row[2],
+            "status": row[3],
+            "chat_id": row[4] or row[0],
+            "error_message": row[5],
+            "render_params": row[6] or {},
+            "telegram_file_id": row[7],
+        }
+
+
+def set_job_telegram_file_id(job_id: int, file_id: Optional[str]) -> None:
+    """Запоминает file_id загруженного в Telegram PDF задачи (None — сбросить)."""
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(f"UPDATE jobs SET telegram_file_id = %s WHERE {JOB_BY_ID}", (file_id, *job_id_params(job_id)))
+
+
+def get_telegram_file_id(file_key: str) -> Optional[str]:
+    """file_id статического документа (см. utils/telegram_files.py)."""
+    with db_cursor() as cursor:
+        cursor.execute("SELECT file_id FROM telegram_files WHERE file_key = %s", (file_key,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+def save_telegram_file_id(file_key: str, file_id: Optional[str]) -> None:
+    """Сохраняет (или удаляет при None) file_id статического документа."""
+    with db_cursor(commit=True) as cursor:
+        if file_id is None:
+            cursor.execute("DELETE FROM telegram_files WHERE file_key = %s", (file_key,))
+            return
+        cursor.execute(
+            """
+            INSERT INTO telegram_files (file_key, file_id)
+            VALUES (%s, %s)
+            ON CONFLICT (file_key) DO UPDATE SET file_id = EXCLUDED.file_id, created_at = CURRENT_TIMESTAMP
+            """,
+            (file_key, file_id)
+        )
 
 
 def update_job_pdf_path(job_id: int, pdf_path: str, execution_time_ms: int = None):
@@ -1027,22 +1050,22 @@ def update_job_pdf_path(job_id: int, pdf_path: str, execution_time_ms: int = Non
     try:
         if execution_time_ms is not None:
             cursor.execute(
-                """
+                f"""
                 UPDATE jobs 
                 SET pdf_path = %s, status = %s, completed_at = CURRENT_TIMESTAMP, 
                     execution_time_ms = %s
-                WHERE id = %s
+                WHERE {JOB_BY_ID}
                 """,
-                (pdf_path, 'completed', execution_time_ms, job_id)
+                (pdf_path, 'completed', execution_time_ms, *job_id_params(job_id))
             )
         else:
             cursor.execute(
-                """
+                f"""
                 UPDATE jobs 
                 SET pdf_path = %s, status = %s, completed_at = CURRENT_TIMESTAMP
-                WHERE id = %s
+                WHERE {JOB_BY_ID}
                 """,
-                (pdf_path, 'completed', job_id)
+                (pdf_path, 'completed', *job_id_params(job_id))
             )
         conn.commit()
         return cursor.rowcount > 0
@@ -1062,21 +1085,21 @@ def update_job_status_failed(job_id: int, error_message: str = None):
         if error_message:
             # Можно добавить поле error_message в таблицу jobs если нужно
             cursor.execute(
-                """
+                f"""
                 UPDATE jobs 
                 SET status = %s, completed_at = CURRENT_TIMESTAMP
-                WHERE id = %s
+                WHERE {JOB_BY_ID}
                 """,
-                ('failed', job_id)
+                ('failed', *job_id_params(job_id))
             )
         else:
             cursor.execute(
-                """
+                f"""
                 UPDATE jobs 
                 SET status = %s, completed_at = CURRENT_TIMESTAMP
-                WHERE id = %s
+                WHERE {JOB_BY_ID}
                 """,
-                ('failed', job_id)
+                ('failed', *job_id_params(job_id))
             )
         conn.commit()
         return cursor.rowcount > 0
@@ -1087,36 +1110,26 @@ def update_job_status_failed(job_id: int, error_message: str = None):
             return_db_connection(conn)
 
 
+def _store_variant_fonts(cursor, user_id: int, variant_fonts: list) -> None:
+    cursor.execute(
+        """
+        UPDATE users
+        SET variant_fonts = %s, updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = %s
+        """,
+        (json.dumps(variant_fonts), user_id)
+    )
+
+
 def update_user_variant_fonts(user_id: int, variant_fonts: list):
     """Обновляет список вариативных шрифтов пользователя."""
     conn = get_db_connection()
     cursor = conn.cursor()
-    
+
     try:
-        # Проверяем существует ли колонка
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='users' AND column_name='variant_fonts'
-        """)
-        
-        if not cursor.fetchone():
-            # Добавляем колонку если не существует
-            cursor.execute("""
-                ALTER TABLE users 
-                ADD COLUMN variant_fonts JSONB DEFAULT '[]'::jsonb
-            """)
-            conn.commit()
-        
-        cursor.execute(
-            """
-            UPDATE users 
-            SET variant_fonts = %s, updated_at = CURRENT_TIMESTAMP
-            WHERE user_id = %s
-            """,
-            (json.dumps(variant_fonts), user_id)
-        )
+        _store_variant_fonts(cursor, user_id, variant_fonts)
         conn.commit()
+        write_through_settings(user_id, variant_fonts=list(variant_fonts))
         return cursor.rowcount > 0
     finally:
         if cursor:
@@ -1157,7 +1170,6 @@ def reset_user_fonts(user_id: int):
     cursor = conn.cursor()
     
     try:
-        _ensure_fonts_table(cursor)
         
         # Получаем пути к файлам шрифтов перед удалением из БД
         cursor.execute("SELECT path FROM fonts WHERE user_id = %s", (user_id,))
@@ -1165,21 +1177,16 @@ def reset_user_fonts(user_id: int):
         
         # Удаляем шрифты из БД
         cursor.execute("DELETE FROM fonts WHERE user_id = %s", (user_id,))
-        
-        # Проверяем существует ли колонка variant_fonts
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='users' AND column_name='variant_fonts'
-        """)
-        
-        if not cursor.fetchone():
-            # Добавляем колонку если не существует
-            cursor.execute("""
-                ALTER TABLE users 
-                ADD COLUMN variant_fonts JSONB DEFAULT '[]'::jsonb
-            """)
-            conn.commit()
+        # Файлы хранятся по хэшу содержимого, один файл может быть и у других пользователей
+        cursor.execute(
+            """
+            SELECT path FROM fonts WHERE path = ANY(%s)
+            UNION
+            SELECT font_path FROM users WHERE font_path = ANY(%s) AND user_id <> %s
+            """,
+            (font_paths, font_paths, user_id)
+        )
+        shared_paths = {row[0] for row in cursor.fetchall()}
         
         cursor.execute(
             """
@@ -1191,10 +1198,13 @@ def reset_user_fonts(user_id: int):
         )
         conn.commit()
         reset_success = cursor.rowcount > 0
+        _on_user_fonts_changed(user_id)
         
         # Удаляем файлы шрифтов с диска
         for font_path in font_paths:
-            if font_path and os.path.exists(font_path):
+            if font_path in shared_paths:
+                continue
+            if font_path and _is_user_font_file(font_path) and os.path.exists(font_path):
                 try:
                     os.remove(font_path)
                 except Exception as e:
@@ -1207,274 +1217,78 @@ def reset_user_fonts(user_id: int):
         if conn:
             return_db_connection(conn)
 
-    if reset_success:
-        update_user_variant_fonts(user_id, [])
     return reset_success
 
 
-def update_job_status_failed(job_id: int, error_message: str = None):
-    """Обновляет статус задачи на failed."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        if error_message:
-            # Можно добавить поле error_message в таблицу jobs если нужно
-            cursor.execute(
-                """
-                UPDATE jobs 
-                SET status = %s, completed_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-                """,
-                ('failed', job_id)
-            )
-        else:
-            cursor.execute(
-                """
-                UPDATE jobs 
-                SET status = %s, completed_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-                """,
-                ('failed', job_id)
-            )
-        conn.commit()
-        return cursor.rowcount > 0
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
-
-
-def update_user_variant_fonts(user_id: int, variant_fonts: list):
-    """Обновляет список вариативных шрифтов пользователя."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # Проверяем существует ли колонка
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='users' AND column_name='variant_fonts'
-        """)
-        
-        if not cursor.fetchone():
-            # Добавляем колонку если не существует
-            cursor.execute("""
-                ALTER TABLE users 
-                ADD COLUMN variant_fonts JSONB DEFAULT '[]'::jsonb
-            """)
-            conn.commit()
-        
-        cursor.execute(
-            """
-            UPDATE users 
-            SET variant_fonts = %s, updated_at = CURRENT_TIMESTAMP
-            WHERE user_id = %s
-            """,
-            (json.dumps(variant_fonts), user_id)
-        )
-        conn.commit()
-        return cursor.rowcount > 0
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
-
-
-def add_variant_font(user_id: int, font_path: str):
-    """Добавляет шрифт в список вариативных шрифтов пользователя."""
-    user = get_user_info(user_id)
-    if not user:
-        return False
-    
-    variant_fonts = user.get('variant_fonts', [])
-    if font_path not in variant_fonts:
-        variant_fonts.append(font_path)
-        return update_user_variant_fonts(user_id, variant_fonts)
-    return True  # Шрифт уже есть - это не ошибка
-
-
-def remove_variant_font(user_id: int, font_path: str):
-    """Удаляет шрифт из списка вариативных шрифтов пользователя."""
-    user = get_user_info(user_id)
-    if not user:
-        return False
-    
-    variant_fonts = user.get('variant_fonts', [])
-    if font_path in variant_fonts:
-        variant_fonts.remove(font_path)
-        return update_user_variant_fonts(user_id, variant_fonts)
-    return False
-
-
-def get_creator_font_paths() -> List[str]:
-    """
-    Возвращает список путей ко всем шрифтам создателя.
-    Ищет ТОЛЬКО в папке sevafont/ - без fallback на другие папки.
-    """
-    font_paths = []
-    
-    # Используем ТОЛЬКО папку sevafont - без fallback
-    if not os.path.exists(CREATOR_FONT_DIR):
-        return font_paths
-    
-    for file in os.listdir(CREATOR_FONT_DIR):
-        if file.lower().endswith('.ttf') and not file.startswith('.'):
-            font_path = os.path.join(CREATOR_FONT_DIR, file)
-            if os.path.isfile(font_path):
-                font_paths.append(font_path)
-    
-    return font_paths
+def _is_user_font_file(font_path: str) -> bool:
+    """Файл лежит в FONTS_DIR (шрифты создателя из sevafont/ подключаются по ссылке и не удаляются)."""
+    fonts_dir = os.path.realpath(FONTS_DIR)
+    return os.path.realpath(font_path).startswith(fonts_dir + os.sep)
 
 
 def add_creator_font_to_user(user_id: int) -> Dict[str, object]:
     """
     Добавляет ограниченное количество шрифтов создателя пользователю для тестирования.
     Выбирает: 3 кириллических, 2 латинских, 2 для цифр и спецсимволов.
-    Проверяет, не добавлены ли уже шрифты создателя, чтобы избежать дублирования.
+    Шрифты берутся из заранее построенного каталога и подключаются по ссылке
+    (без копирования файлов) одной транзакцией.
     """
-    creator_font_paths = get_creator_font_paths()
-    if not creator_font_paths:
+    catalogue = get_creator_catalogue()
+    if not catalogue.paths:
         raise FileNotFoundError("Шрифты создателя не найдены. Обратитесь к администратору.")
-    
-    # Анализируем все шрифты и разделяем по типам
-    cyrillic_fonts = []  # cyrillic_full
-    latin_fonts = []      # latin
-    digits_fonts = []     # digits или с поддержкой цифр/символов
-    
-    for font_path in creator_font_paths:
-        if not os.path.exists(font_path):
-            continue
-        try:
-            capabilities = analyze_font(font_path)
-            if capabilities.is_cyrillic_full:
-                cyrillic_fonts.append((font_path, capabilities))
-            elif capabilities.font_type == "latin":
-                latin_fonts.append((font_path, capabilities))
-            elif capabilities.font_type == "digits" or (capabilities.supports_digits or capabilities.supports_symbols):
-                digits_fonts.append((font_path, capabilities))
-        except Exception as e:
-            # Пропускаем шрифты, которые не удалось проанализировать
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f"Не удалось проанализировать шрифт {font_path}: {e}")
-            continue
-    
-    # Сортируем по coverage_score (лучшие первыми) и берем нужное количество
-    cyrillic_fonts.sort(key=lambda x: x[1].coverage_score, reverse=True)
-    latin_fonts.sort(key=lambda x: x[1].coverage_score, reverse=True)
-    digits_fonts.sort(key=lambda x: x[1].coverage_score, reverse=True)
-    
-    # Выбираем только нужное количество каждого типа
-    selected_fonts = (
-        [f[0] for f in cyrillic_fonts[:3]] +  # 3 кириллических
-        [f[0] for f in latin_fonts[:2]] +      # 2 латинских
-        [f[0] for f in digits_fonts[:2]]       # 2 для цифр и спецсимволов
-    )
-    
+
+    selected_fonts = catalogue.selected
     if not selected_fonts:
         raise FileNotFoundError("Не найдено подходящих шрифтов создателя. Нужны: 3 кириллических, 2 латинских, 2 для цифр.")
-    
-    # Удаляем все старые шрифты создателя перед добавлением новых
+
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        _ensure_fonts_table(cursor)
-        
-        # Находим все старые шрифты создателя (с префиксом creator_{user_id}_)
+
+        # Старые шрифты создателя: ссылки на каталог и копии прежних версий (fonts/creator_{user_id}_*)
+        legacy_pattern = os.path.join(FONTS_DIR, f"creator_{user_id}_%")
         cursor.execute(
             """
-            SELECT path FROM fonts 
-            WHERE user_id = %s AND path LIKE %s
+            DELETE FROM fonts
+            WHERE user_id = %s AND (path = ANY(%s) OR path LIKE %s)
+            RETURNING path
             """,
-            (user_id, f"creator_{user_id}_%")
+            (user_id, catalogue.paths, legacy_pattern),
         )
-        old_font_paths = [row[0] for row in cursor.fetchall()]
-        
-        # Удаляем старые шрифты из БД и файловой системы
-        if old_font_paths:
-            cursor.execute(
-                """
-                DELETE FROM fonts 
-                WHERE user_id = %s AND path LIKE %s
-                """,
-                (user_id, f"creator_{user_id}_%")
-            )
-            conn.commit()
-            
-            # Удаляем файлы
-            for old_path in old_font_paths:
-                if os.path.exists(old_path):
-                    try:
-                        os.remove(old_path)
-                    except:
-                        pass
-        
-        added_count = 0
-        skipped_count = 0
-        errors = []
-        
-        # Добавляем только выбранные шрифты
-        for creator_font_path in selected_fonts:
-            if not os.path.exists(creator_font_path):
-                continue
-                
-            font_filename = os.path.basename(creator_font_path)
-            user_font_filename = f"creator_{user_id}_{font_filename}"
-            user_font_path = os.path.join(FONTS_DIR, user_font_filename)
-            
-            # Если файл существует - удаляем его (мы уже удалили из БД выше)
-            if os.path.exists(user_font_path):
-                try:
-                    os.remove(user_font_path)
-                except:
-                    pass
-            
-            try:
-                # Копируем файл
-                shutil.copy2(creator_font_path, user_font_path)
-                
-                # Регистрируем шрифт для пользователя
-                analyze_and_register_font(user_id, user_font_path)
-                added_count += 1
-            except Exception as e:
-                # Если ошибка, удаляем скопированный файл
-                if os.path.exists(user_font_path):
-                    try:
-                        os.remove(user_font_path)
-                    except:
-                        pass
-                errors.append(f"{font_filename}: {str(e)}")
-                continue
-        
-        # Если не добавили ни одного шрифта (все уже были добавлены)
-        if added_count == 0 and skipped_count > 0:
-            return {
-                "progress": get_font_requirement_progress(user_id),
-                "font_type": None,
-                "capabilities": None,
-            }
-        
-        # Если были ошибки, но что-то добавили
-        if errors:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f"Ошибки при добавлении некоторых шрифтов создателя для пользователя {user_id}: {errors}")
-        
-        # Возвращаем финальный прогресс
-        return {
-            "progress": get_font_requirement_progress(user_id),
-            "font_type": "multiple" if added_count > 1 else None,
-            "capabilities": None,
-            "added_count": added_count,
-            "skipped_count": skipped_count,
-        }
-        
+        legacy_files = [row[0] for row in cursor.fetchall() if _is_user_font_file(row[0])]
+
+        for capabilities in selected_fonts:
+            _insert_or_update_font(cursor, user_id, capabilities.path, capabilities, capabilities.is_cyrillic_full)
+
+        # Базовым становится лучший кириллический шрифт создателя
+        base_font = next((caps for caps in selected_fonts if caps.is_cyrillic_full), None)
+        if base_font:
+            _set_base_font(cursor, user_id, base_font.path)
+
+        records = _fetch_font_records(cursor, user_id)
+        _store_variant_fonts(cursor, user_id, _variant_paths(_group_font_records(records)))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            return_db_connection(conn)
+        cursor.close()
+        return_db_connection(conn)
+
+    _on_user_fonts_changed(user_id)
+
+    # Удаляем копии файлов, оставшиеся от старой схемы
+    for old_path in legacy_files:
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass
+
+    added_count = len(selected_fonts)
+    return {
+        "progress": _progress_from_records(records),
+        "font_type": "multiple" if added_count > 1 else None,
+        "capabilities": None,
+        "added_count": added_count,
+        "skipped_count": 0,
+    }
@@ -1,6 +1,15 @@
 """Thread pool для тяжелых синхронных операций"""
 from concurrent.futures import ThreadPoolExecutor
 
-# Пул из 4 потоков для генерации PDF
-pdf_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="pdf_generator")
+from config import DB_EXECUTOR_WORKERS, FAST_LANE_WORKERS, INLINE_RENDER_WORKERS
 
+# Пул для генерации PDF: по потоку на слот воркеров (см. utils/render_workers.py)
+pdf_executor = ThreadPoolExecutor(max_workers=max(1, INLINE_RENDER_WORKERS), thread_name_prefix="pdf_generator")
+
+# Потоки быстрой полосы при FAST_LANE_PROCESS=0: короткие тексты не ждут освобождения pdf_executor
+fast_pdf_executor = ThreadPoolExecutor(max_workers=max(1, FAST_LANE_WORKERS), thread_name_prefix="pdf_fast")
+
+
+# Пул для синхронных запросов к PostgreSQL из асинхронных хендлеров (см. utils/db_async.py).
+# Число потоков не больше размера пула соединений, иначе потоки будут ждать соединение.
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
@@ -9,6 +9,8 @@ from typing import Dict, Iterable, Set
 
 from fontTools.ttLib import TTFont
 
+from utils.coverage import encode_codepoint_ranges
+
 
 CYRILLIC_LOWER = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
 CYRILLIC_UPPER = CYRILLIC_LOWER.upper()
@@ -28,6 +30,8 @@ class FontCapabilities:
     supports_digits: bool
     supports_symbols: bool
     coverage_score: int
+    # Все кодовые точки cmap в виде диапазонов (см. utils.coverage)
+    codepoints: str = ""
 
     @property
     def is_cyrillic_full(self) -> bool:
@@ -73,15 +77,22 @@ def _collect_codepoints(tt_font: TTFont) -> Set[int]:
     return codepoints
 
 
+def collect_font_codepoints(font_path: str) -> Set[int]:
+    """Возвращает все кодовые точки из cmap шрифта."""
+    tt_font = TTFont(font_path, lazy=True)
+    try:
+        return _collect_codepoints(tt_font)
+    finally:
+        tt_font.close()
+
+
 def _has_all(codepoints: Set[int], chars: Iterable[str]) -> bool:
     return all(ord(ch) in codepoints for ch in chars)
 
 
 def analyze_font(font_path: str) -> FontCapabilities:
     """Возвращает информацию о поддерживаемых символах шрифта."""
-    tt_font = TTFont(font_path)
-    codepoints = _collect_codepoints(tt_font)
-    tt_font.close()
+    codepoints = collect_font_codepoints(font_path)
 
     supports_cyrillic_lower = _has_all(codepoints, CYRILLIC_LOWER)
     supports_cyrillic_upper = _has_all(codepoints, CYRILLIC_UPPER)
@@ -101,5 +112,6 @@ def analyze_font(font_path: str) -> FontCapabilities:
         supports_digits=supports_digits,
         supports_symbols=supports_symbols,
         coverage_score=coverage_score,
+        codepoints=encode_codepoint_ranges(codepoints),
     )
 
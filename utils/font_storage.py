@@ -0,0 +1,157 @@
+"""
+Потоковая загрузка шрифтов из Telegram в хранилище шрифтов.
+
+Файл пишется во временный файл по частям (без буферизации в памяти),
+размер ограничивается жёстким лимитом, хэш считается во время записи.
+Запись, fsync и проверка выполняются в потоке, а не в цикле событий.
+Перед переименованием файл проходит быструю проверку структуры
+(utils.font_validator); после неё атомарно переименовывается в FONTS_DIR
+под именем <sha256>.ttf. Одинаковые файлы разных пользователей хранятся
+одной копией, а разные файлы с одним именем не перезаписывают друг друга.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Optional
+
+from config import FONTS_DIR, MAX_FONT_FILE_SIZE
+from utils.font_validator import FontValidationError, validate_font_file
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class FontTooLargeError(FontValidationError):
+    """Файл шрифта превышает допустимый размер"""
+
+    def __init__(self, message: str):
+        super().__init__("too_large", message)
+
+
+@dataclass(frozen=True)
+class StoredFont:
+    path: str
+    size: int
+    sha256: str
+
+
+class _CappedHashingWriter:
+    """Пишет части файла на диск, считает хэш и размер."""
+
+    def __init__(self, file, max_bytes: int):
+        self._file = file
+        self._max_bytes = max_bytes
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes) -> int:
+        self.size += len(chunk)
+        if self.size > self._max_bytes:
+            raise FontTooLargeError(
+                f"Файл шрифта слишком большой (максимум {self._max_bytes // (1024 * 1024)} МБ)"
+            )
+        self._hash.update(chunk)
+        return self._file.write(chunk)
+
+    @property
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+def stored_font_path(sha256: str, extension: str = ".ttf") -> str:
+    """Путь файла шрифта в хранилище по хэшу содержимого"""
+    return os.path.join(FONTS_DIR, f"{sha256}{extension}")
+
+
+def safe_font_filename(filename: str) -> str:
+    """Убирает из имени файла компоненты пути"""
+    name = os.path.basename((filename or "").replace("\\", "/")).strip()
+    if not name or name.startswith("."):
+        raise ValueError("Некорректное имя файла шрифта")
+    return name
+
+
+def _sync_file(file) -> None:
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def _validate_and_store(tmp_path: str, final_path: str, max_bytes: int):
+    """Проверяет временный файл и переносит его в хранилище; такой же файл просто заменяется"""
+    header = validate_font_file(tmp_path, max_bytes=max_bytes)
+    os.replace(tmp_path, final_path)
+    return header
+
+
+async def download_font_file(
+    bot,
+    file_id: str,
+    filename: str,
+    declared_size: Optional[int] = None,
+    max_bytes: int = MAX_FONT_FILE_SIZE,
+) -> StoredFont:
+    """
+    Скачивает шрифт из Telegram прямо на диск и атомарно кладёт его в FONTS_DIR
+    под именем по хэшу содержимого (stored_font_path).
+
+    Args:
+        bot: экземпляр aiogram Bot
+        file_id: file_id документа
+        filename: исходное имя файла (для проверки и журнала)
+        declared_size: размер, заявленный Telegram (для ранней проверки)
+        max_bytes: жёсткий лимит размера файла
+
+    Returns:
+        StoredFont с путём, размером и sha256 сохранённого файла
+    """
+    target_name = safe_font_filename(filename)
+    extension = os.path.splitext(target_name)[1].lower() or ".ttf"
+    if declared_size is not None and declared_size > max_bytes:
+        metrics.record_font_rejection("too_large")
+        raise FontTooLargeError(
+            f"Файл шрифта слишком большой (максимум {max_bytes // (1024 * 1024)} МБ)"
+        )
+
+    os.makedirs(FONTS_DIR, exist_ok=True)
+    file_info = await bot.get_file(file_id)
+
+    # Временный файл в той же директории, чтобы os.replace был атомарным
+    fd, tmp_path = tempfile.mkstemp(prefix=".upload_", suffix=".part", dir=FONTS_DIR)
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            writer = _CappedHashingWriter(tmp_file, max_bytes)
+            stream = bot.session.stream_content(
+                url=bot.session.api.file_url(bot.token, file_info.file_path),
+                chunk_size=DOWNLOAD_CHUNK_SIZE,
+                raise_for_status=True,
+            )
+            try:
+                async for chunk in stream:
+                    await asyncio.to_thread(writer.write, chunk)
+            finally:
+                await stream.aclose()
+            await asyncio.to_thread(_sync_file, tmp_file)
+
+        final_path = stored_font_path(writer.hexdigest, extension)
+        header = await asyncio.to_thread(_validate_and_store, tmp_path, final_path, max_bytes)
+    except BaseException as e:
+        if isinstance(e, FontValidationError):
+            metrics.record_font_rejection(e.reason)
+            logger.info(f"Шрифт {target_name} отклонён: {e.reason} ({e})")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    metrics.record_font_accepted()
+    logger.info(
+        f"Шрифт {target_name} сохранён: {final_path} ({writer.size} байт, {header.num_glyphs} глифов)"
+    )
+    return StoredFont(path=final_path, size=writer.size, sha256=writer.hexdigest)
@@ -0,0 +1,122 @@
+"""
+Быстрая проверка загружаемых шрифтов.
+
+Читает только заголовок sfnt, каталог таблиц и пару полей из head/maxp —
+без fontTools. Битые, слишком большие и неподдерживаемые файлы отсекаются
+до полного анализа и регистрации в ReportLab.
+"""
+
+import os
+import struct
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+from config import MAX_FONT_FILE_SIZE, MAX_FONT_GLYPHS, MAX_FONT_TABLES
+
+SFNT_HEADER = struct.Struct(">4sHHHH")
+TABLE_RECORD = struct.Struct(">4sIII")
+HEAD_MAGIC = 0x5F0F3CF5
+
+# Без этих таблиц ReportLab не сможет отрисовать TrueType-шрифт
+REQUIRED_TABLES = (b"cmap", b"glyf", b"head", b"hhea", b"hmtx", b"loca", b"maxp")
+
+
+class FontValidationError(ValueError):
+    """Файл шрифта не прошёл проверку. reason — короткий код для метрик."""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+@dataclass(frozen=True)
+class FontHeader:
+    size: int
+    num_tables: int
+    num_glyphs: int
+
+
+def _read_tables(data: bytes, num_tables: int, file_size: int) -> Dict[bytes, Tuple[int, int]]:
+    tables: Dict[bytes, Tuple[int, int]] = {}
+    for i in range(num_tables):
+        tag, _checksum, offset, length = TABLE_RECORD.unpack_from(data, SFNT_HEADER.size + i * TABLE_RECORD.size)
+        if offset + length > file_size:
+            raise FontValidationError("bad_table_bounds", "Файл шрифта повреждён (таблица выходит за пределы файла)")
+        if tag in tables:
+            raise FontValidationError("duplicate_table", "Файл шрифта повреждён (повторяющиеся таблицы)")
+        tables[tag] = (offset, length)
+    return tables
+
+
+def validate_font_file(
+    path: str,
+    max_bytes: int = MAX_FONT_FILE_SIZE,
+    max_glyphs: int = MAX_FONT_GLYPHS,
+    max_tables: int = MAX_FONT_TABLES,
+) -> FontHeader:
+    """
+    Проверяет структуру TrueType-файла.
+
+    Raises:
+        FontValidationError: если файл не подходит (с кодом причины)
+    """
+    file_size = os.path.getsize(path)
+    if file_size == 0:
+        raise FontValidationError("empty", "Файл шрифта пуст")
+    if file_size > max_bytes:
+        raise FontValidationError(
+            "too_large", f"Файл шрифта слишком большой (максимум {max_bytes // (1024 * 1024)} МБ)"
+        )
+    if file_size < SFNT_HEADER.size:
+        raise FontValidationError("truncated", "Файл шрифта повреждён (слишком короткий)")
+
+    with open(path, "rb") as f:
+        header = f.read(SFNT_HEADER.size)
+        version, num_tables, _, _, _ = SFNT_HEADER.unpack(header)
+
+        if version == b"OTTO":
+            raise FontValidationError("cff_outlines", "Шрифты OpenType/CFF не поддерживаются, нужен TrueType (.ttf)")
+        if version == b"ttcf":
+            raise FontValidationError("collection", "Коллекции шрифтов (.ttc) не поддерживаются")
+        if version not in (b"\x00\x01\x00\x00", b"true"):
+            raise FontValidationError("bad_magic", "Файл не является шрифтом TrueType")
+
+        if num_tables == 0:
+            raise FontValidationError("no_tables", "Файл шрифта повреждён (нет таблиц)")
+        if num_tables > max_tables:
+            raise FontValidationError("too_many_tables", f"Слишком много таблиц в шрифте ({num_tables})")
+
+        directory_size = num_tables * TABLE_RECORD.size
+        directory = f.read(directory_size)
+        if len(directory) < directory_size:
+            raise FontValidationError("truncated", "Файл шрифта повреждён (обрезан каталог таблиц)")
+
+        tables = _read_tables(header + directory, num_tables, file_size)
+        missing = [tag.decode("ascii") for tag in REQUIRED_TABLES if tag not in tables]
+        if missing:
+            raise FontValidationError(
+                "missing_tables", f"В шрифте нет обязательных таблиц: {', '.join(missing)}"
+            )
+
+        head_offset, head_length = tables[b"head"]
+        if head_length < 16:
+            raise FontValidationError("bad_head", "Файл шрифта повреждён (таблица head)")
+        f.seek(head_offset + 12)
+        (magic,) = struct.unpack(">I", f.read(4))
+        if magic != HEAD_MAGIC:
+            raise FontValidationError("bad_head", "Файл шрифта повреждён (таблица head)")
+
+        maxp_offset, maxp_length = tables[b"maxp"]
+        if maxp_length < 6:
+            raise FontValidationError("bad_maxp", "Файл шрифта повреждён (таблица maxp)")
+        f.seek(maxp_offset + 4)
+        (num_glyphs,) = struct.unpack(">H", f.read(2))
+
+    if num_glyphs == 0:
+        raise FontValidationError("no_glyphs", "В шрифте нет глифов")
+    if num_glyphs > max_glyphs:
+        raise FontValidationError(
+            "too_many_glyphs", f"Слишком много глифов в шрифте ({num_glyphs}, максимум {max_glyphs})"
+        )
+
+    return FontHeader(size=file_size, num_tables=num_tables, num_glyphs=num_glyphs)
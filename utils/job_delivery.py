@@ -0,0 +1,339 @@
+"""
+Отправка результатов задач из очереди генерации пользователю.
+
+Воркер завершает задачу и шлёт NOTIFY в JOB_EVENTS_CHANNEL; бот получает
+уведомление (utils/pg_listener.py) и ставит задачу в DeliveryQueue. Состояние
+отправки хранится в строке задачи (delivery_* и notified_at), поэтому после
+перезапуска бота недоставленные результаты отправляются заново:
+
+    - DELIVERY_CONCURRENCY отправителей — не больше стольких загрузок сразу;
+    - загрузки PDF идут не чаще DELIVERY_UPLOADS_PER_SECOND в секунду на весь
+      бот (процессы делят темп поровну), а после TelegramRetryAfter пауза
+      действует на все загрузки процесса. Очередь к загрузке отстаивается до
+      аренды отправки, а сама загрузка ограничена половиной
+      DELIVERY_LEASE_SECONDS, поэтому аренда не истекает посреди отправки;
+    - неудачная попытка откладывается экспоненциально (или на retry_after от
+      Telegram) и сохраняется в delivery_available_at;
+    - после DELIVERY_MAX_ATTEMPTS попыток пользователь получает кнопку
+      «Повторить отправку PDF».
+
+Доставка «хотя бы один раз»: если процесс упал между загрузкой PDF и
+finish_job_delivery, PDF отправится повторно. Отправитель, чья аренда всё же
+истекла, не завершает и не откладывает чужую отправку (номер попытки — токен
+аренды, см. utils/job_queue.py).
+"""
+
+import asyncio
+import html
+import logging
+import math
+import os
+import random
+from typing import Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from config import (
+    BOT_PROCESSES,
+    DELIVERY_CONCURRENCY,
+    DELIVERY_LEASE_SECONDS,
+    DELIVERY_MAX_ATTEMPTS,
+    DELIVERY_RETRY_BASE,
+    DELIVERY_RETRY_MAX,
+    DELIVERY_UPLOADS_PER_SECOND,
+    JOB_POLL_INTERVAL,
+)
+from utils.admission import DEFER, REJECT, Admission
+from utils.db_async import (
+    claim_job_delivery,
+    fetch_due_deliveries,
+    finish_job_delivery,
+    get_job,
+    retry_job_delivery,
+    set_job_telegram_file_id,
+)
+from utils.metrics import metrics
+from utils.telegram_files import send_document
+from utils.telegram_limiter import PRIORITY_DELIVERY, outbound_priority
+from utils.telegram_retry import call_with_retries
+
+logger = logging.getLogger(__name__)
+
+# Пропущенные уведомления и отложенные повторы проверяются реже, чем очередь воркерами
+CATCHUP_INTERVAL = max(30.0, JOB_POLL_INTERVAL * 10)
+
+# Предельное время одной загрузки PDF: с запасом укладывается в аренду отправки
+UPLOAD_TIMEOUT = max(1, DELIVERY_LEASE_SECONDS // 2)
+
+# Ошибки, которые повтор не исправит: бот заблокирован, неверный запрос, нет файла
+PERMANENT_DELIVERY_ERRORS = (TelegramForbiddenError, TelegramBadRequest, FileNotFoundError)
+
+CAPTIONS = {
+    "text": "✓ PDF сгенерирован",
+    "markdown": "✓ PDF сгенерирован из Markdown",
+}
+
+FOLLOW_UPS = {
+    "text": "💡 Отправьте новый текст:\nя создам еще один конспект",
+    "markdown": "💡 Отправьте новый Markdown файл или текст:\nя создам еще один конспект",
+}
+
+
+def _minutes(seconds: float) -> int:
+    return max(1, math.ceil(seconds / 60))
+
+
+def admission_message(admission: Admission, source: str = "text") -> str:
+    """Ответ пользователю на отправленный текст по решению допуска в очередь"""
+    if admission.decision == REJECT:
+        return (
+            "⚠️ Сейчас слишком много задач на генерацию.\n\n"
+            f"Попробуйте отправить текст снова примерно через {_minutes(admission.eta_seconds)} мин."
+        )
+    what = "PDF из Markdown" if source == "markdown" else "PDF"
+    if admission.decision == DEFER:
+        return (
+            f"⏳ Очередь загружена: {what} будет готов примерно через "
+            f"{_minutes(admission.eta_seconds)} мин. Пришлю, как только он будет готов."
+        )
+    notice = f"\nПеред вами в очереди: {admission.position}" if admission.position else ""
+    return f"⏳ Генерирую {what}... (может занять до 1-2 минут){notice}"
+
+
+def cancel_keyboard(job_id: int) -> InlineKeyboardMarkup:
+    """Кнопка отмены под сообщением «Генерирую PDF»"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✖️ Отменить", callback_data=f"cancel_job_{job_id}")]
+    ])
+
+
+def delivery_backoff(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Задержка перед следующей попыткой отправки, секунды"""
+    if retry_after is not None:
+        return retry_after + 1.0
+    delay = min(DELIVERY_RETRY_MAX, DELIVERY_RETRY_BASE * 2 ** (attempt - 1))
+    # Разброс, чтобы отложенные отправки не повторялись одной пачкой
+    return delay * random.uniform(0.8, 1.2)
+
+
+async def _call_once(method, *args, **kwargs):
+    """Одна попытка вызова: повторами управляет очередь доставки"""
+    return await method(*args, **kwargs)
+
+
+class _UploadThrottle:
+    """Общий на процесс интервал между загрузками PDF"""
+
+    def __init__(self, per_second: float = DELIVERY_UPLOADS_PER_SECOND / BOT_PROCESSES):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            wait = self._next_at - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next_at = max(self._next_at, loop.time()) + self.interval
+
+    def pause(self, seconds: float) -> None:
+        """Telegram попросил подождать: откладываем все следующие загрузки"""
+        self._next_at = max(self._next_at, asyncio.get_running_loop().time() + seconds)
+
+
+def _needs_upload(job: dict) -> bool:
+    """Результат — PDF, который ещё не загружен в Telegram (нет file_id)"""
+    return job["status"] == "completed" and not job["telegram_file_id"]
+
+
+async def _send_result(bot: Bot, job: dict) -> None:
+    """
+    Отправляет PDF (или сообщение об ошибке) владельцу задачи; ошибки отправки пробрасывает.
+
+    Место в темпе загрузок (_UploadThrottle) вызывающий занимает заранее, до аренды.
+    """
+    from handlers.menu import get_main_menu_keyboard
+
+    chat_id = job["chat_id"]
+
+    if job["status"] != "completed":
+        error = job["error_message"] or "неизвестная ошибка"
+        await bot.send_message(
+            chat_id,
+            f"❌ Ошибка при генерации PDF: {html.escape(error)}\n\nПопробуйте снова или вернитесь в меню.",
+            reply_markup=get_main_menu_keyboard(),
+        )
+        return
+
+    pdf_path = job["pdf_path"]
+    file_id = job["telegram_file_id"]
+    if not file_id and (not pdf_path or not os.path.exists(pdf_path)):
+        await bot.send_message(chat_id, "❌ Ошибка: PDF файл не найден", reply_markup=get_main_menu_keyboard())
+        return
+
+    source = job["render_params"].get("source", "text")
+    _, uploaded = await send_document(
+        bot.send_document,
+        pdf_path,
+        file_id,
+        retry=_call_once,
+        chat_id=chat_id,
+        caption=f"{CAPTIONS.get(source, CAPTIONS['text'])}\nВремя: {job['execution_time_ms']}мс",
+        request_timeout=UPLOAD_TIMEOUT,
+    )
+    if uploaded:
+        try:
+            # Повторная отправка (кнопка «Повторить») пойдёт по file_id без загрузки
+            await set_job_telegram_file_id(job["id"], uploaded)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить file_id задачи {job['id']}: {e}")
+
+
+async def _send_follow_up(bot: Bot, job: dict) -> None:
+    """Подсказка после PDF; её потеря не повод отправлять PDF ещё раз"""
+    from handlers.menu import get_main_menu_keyboard
+
+    if job["status"] != "completed":
+        return
+    source = job["render_params"].get("source", "text")
+    try:
+        await call_with_retries(
+            bot.send_message,
+            job["chat_id"],
+            FOLLOW_UPS.get(source, FOLLOW_UPS["text"]),
+            reply_markup=get_main_menu_keyboard(),
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось отправить подсказку после PDF (job_id={job['id']}): {e}")
+
+
+async def _offer_manual_retry(bot: Bot, job: dict) -> None:
+    """Попытки кончились: предлагаем пользователю повторить отправку кнопкой"""
+    retry_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔄 Повторить отправку PDF", callback_data=f"retry_pdf_{job['id']}")]
+    ])
+    try:
+        await call_with_retries(
+            bot.send_message,
+            job["chat_id"],
+            "⚠️ Не удалось отправить PDF из-за проблем с сетью.\n\nНажмите кнопку ниже, чтобы повторить отправку.",
+            reply_markup=retry_keyboard,
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось предложить повтор отправки (job_id={job['id']}): {e}")
+
+
+class DeliveryQueue:
+    """Очередь отправки результатов задач в процессе бота"""
+
+    def __init__(self, bot: Bot, concurrency: int = DELIVERY_CONCURRENCY):
+        self.bot = bot
+        self.concurrency = max(1, concurrency)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._queued: Set[int] = set()
+        self._throttle = _UploadThrottle()
+
+    def submit(self, job_id: int) -> None:
+        """Ставит задачу в очередь отправки (повторная постановка игнорируется)"""
+        if job_id in self._queued:
+            return
+        self._queued.add(job_id)
+        self._queue.put_nowait(job_id)
+
+    def on_job_event(self, payload: str) -> None:
+        """Обработчик NOTIFY JOB_EVENTS_CHANNEL (payload — id задачи)"""
+        try:
+            job_id = int(payload)
+        except ValueError:
+            return
+        self.submit(job_id)
+
+    async def refill(self) -> int:
+        """Ставит в очередь пропущенные уведомления и повторы, срок которых наступил"""
+        job_ids = await fetch_due_deliveries()
+        for job_id in job_ids:
+            self.submit(job_id)
+        return len(job_ids)
+
+    def _submit_later(self, job_id: int, delay: float) -> None:
+        # Повтор сохранён в БД; таймер лишь избавляет от ожидания refill
+        asyncio.get_running_loop().call_later(delay, self.submit, job_id)
+
+    async def _deliver(self, job_id: int) -> None:
+        job = await get_job(job_id)
+        if job and _needs_upload(job):
+            # Ждём своей очереди к загрузке до аренды: ожидание (в том числе после
+            # retry_after) не расходует её срок
+            await self._throttle.acquire()
+        attempt = await claim_job_delivery(job_id)
+        if attempt is None:
+            return
+        try:
+            if not job:
+                await finish_job_delivery(job_id, attempt, "Задача не найдена")
+                return
+            with outbound_priority(PRIORITY_DELIVERY):
+                await _send_result(self.bot, job)
+        except Exception as exc:
+            await self._handle_failure(job_id, job, attempt, exc)
+            return
+        if not await finish_job_delivery(job_id, attempt):
+            logger.warning(f"Аренда отправки задачи {job_id} истекла до завершения попытки {attempt}")
+            return
+        metrics.record_delivery("delivered", attempt)
+        await _send_follow_up(self.bot, job)
+
+    async def _handle_failure(self, job_id: int, job: Optional[dict], attempt: int, exc: Exception) -> None:
+        error = f"{type(exc).__name__}: {exc}"
+        if isinstance(exc, PERMANENT_DELIVERY_ERRORS) or attempt >= DELIVERY_MAX_ATTEMPTS:
+            logger.error(f"Отправка результата задачи {job_id} прекращена после попытки {attempt}: {error}")
+            if not await finish_job_delivery(job_id, attempt, error):
+                return
+            metrics.record_delivery("abandoned", attempt)
+            if job and job["status"] == "completed" and not isinstance(exc, TelegramForbiddenError):
+                await _offer_manual_retry(self.bot, job)
+            return
+
+        retry_after = None
+        if isinstance(exc, TelegramRetryAfter):
+            retry_after = float(exc.retry_after)
+            self._throttle.pause(retry_after)
+        delay = delivery_backoff(attempt, retry_after)
+        logger.warning(f"Отправка результата задачи {job_id} не удалась (попытка {attempt}), повтор через {delay:.1f}с: {error}")
+        if not await retry_job_delivery(job_id, attempt, delay, error):
+            return
+        metrics.record_delivery("retried", attempt)
+        self._submit_later(job_id, delay)
+
+    async def _sender(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                await self._deliver(job_id)
+            except Exception as e:
+                # Ошибки БД: аренда отправки истечёт, и refill вернёт задачу
+                logger.error(f"Ошибка отправки результата задачи {job_id}: {e}", exc_info=True)
+
+    async def _catchup(self, interval: float) -> None:
+        while True:
+            try:
+                submitted = await self.refill()
+                if submitted:
+                    logger.info(f"✓ В очередь отправки добавлено результатов: {submitted}")
+            except Exception as e:
+                logger.error(f"Ошибка проверки неотправленных результатов: {e}")
+            await asyncio.sleep(interval)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def run(self, catchup_interval: float = CATCHUP_INTERVAL) -> None:
+        """Фоновая задача: отправители и периодическая сверка с БД (при старте — сразу)"""
+        await asyncio.gather(
+            self._catchup(catchup_interval),
+            *(self._sender() for _ in range(self.concurrency)),
+        )
@@ -0,0 +1,588 @@
+"""
+Очередь генерации PDF на таблице jobs.
+
+Жизненный цикл задачи:
+
+    pending ──lease_job──▶ processing ──complete_job──▶ completed
+       ▲  │                    │
+       └──┼─ fail_job / ───────┤ (попытки остались, с задержкой)
+          │  reap_expired_jobs ├──────────────────────▶ failed
+          │                    ├──── render_job ──────▶ timeout (истёк JOB_RENDER_TIMEOUT)
+          └──── cancel_job ────┴──────────────────────▶ cancelled
+
+Порядок выбора — по fair_key (справедливость между пользователями и классы
+приоритета, см. utils/job_scheduling.py).
+
+Воркер забирает задачу через SELECT ... FOR UPDATE SKIP LOCKED и арендует её
+на JOB_LEASE_SECONDS. Процессы с воркерами отмечаются в render_workers
+(heartbeat_render_worker) — по сумме их слотов оценивается ожидание при допуске. Если воркер упал, аренда истекает и reap_expired_jobs
+возвращает задачу в очередь (или помечает failed, если попытки кончились).
+
+Отмена ожидающей задачи мгновенная. У задачи в работе cancel_job ставит
+cancel_requested_at; генерация прерывается на ближайшей точке проверки
+(utils/render_control.py), а воркер освобождается.
+
+Уведомления PostgreSQL:
+    RENDER_JOBS_CHANNEL — появилась новая задача (будит воркеров);
+    JOB_EVENTS_CHANNEL  — задача завершена (completed/failed/timeout), payload — id;
+                          бот отправляет результат пользователю.
+
+Отправка результата — отдельная очередь на тех же строках (utils/job_delivery.py):
+claim_job_delivery арендует отправку, finish_job_delivery ставит notified_at,
+retry_job_delivery откладывает повтор через delivery_available_at. Номер попытки
+из claim_job_delivery — токен аренды: если аренда истекла и отправку взял другой
+отправитель, прежний уже не может ни завершить её, ни отложить.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    DELIVERY_LEASE_SECONDS,
+    JOB_COST_BASE_MS,
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_RENDER_TIMEOUT,
+    JOB_RETRY_DELAY,
+    RENDER_WORKER_HEARTBEAT_TTL,
+)
+from database.connection import db_cursor
+from database.partitions import JOB_BY_ID, job_id_params
+from utils.admission import Admission, decide_admission
+from utils.job_scheduling import PRIORITY_CLASSES, classify_job, compute_fair_key, cost_model
+from utils.job_texts import store_job_text, decode_job_text
+from utils.metrics import metrics
+from utils.render_control import RenderControl, RenderInterrupted, clear_local_cancel
+
+logger = logging.getLogger(__name__)
+
+RENDER_JOBS_CHANNEL = "render_jobs"
+JOB_EVENTS_CHANNEL = "job_events"
+
+# Ошибки во входных данных: повтор не поможет
+NON_RETRYABLE_ERRORS = (ValueError, FileNotFoundError)
+
+
+def enqueue_job(user_id: int, chat_id: int, text_content: str, render_params: dict) -> Admission:
+    """
+    Ставит задачу в очередь, если позволяет загрузка (utils/admission.py), и будит воркеров.
+
+    Возвращает решение; при отказе задача не создаётся и job_id = None.
+    """
+    text_length = len(text_content)
+    priority_class = classify_job(text_length)
+    with db_cursor(commit=True) as cursor:
+        # Время — по часам БД, чтобы ключи разных процессов были сравнимы
+        cursor.execute(
+            """
+            SELECT
+                EXTRACT(EPOCH FROM LOCALTIMESTAMP),
+                (
+                    SELECT MAX(fair_key)
+                    FROM jobs
+                    WHERE user_id = %s AND priority_class = %s
+                      AND status IN ('pending', 'processing')
+                )
+            """,
+            (user_id, priority_class)
+        )
+        now, user_last_key = cursor.fetchone()
+        fair_key = compute_fair_key(float(now), user_last_key, text_length, priority_class)
+
+        # Работа, которую воркеры возьмут раньше этой задачи, и остаток генерируемых сейчас
+        cursor.execute(
+            """
+            SELECT
+                COUNT(*) FILTER (WHERE status = 'pending'),
+                COUNT(*) FILTER (WHERE status = 'pending' AND fair_key < %s),
+                COALESCE(SUM(text_length) FILTER (WHERE status = 'pending' AND fair_key < %s), 0),
+                COALESCE(SUM(GREATEST(
+                    0,
+                    %s + %s * text_length - EXTRACT(EPOCH FROM LOCALTIMESTAMP - started_at) * 1000
+                )) FILTER (WHERE status = 'processing'), 0),
+                (
+                    SELECT COALESCE(SUM(slots), 0)
+                    FROM render_workers
+                    WHERE heartbeat_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+                )
+            FROM jobs
+            WHERE status IN ('pending', 'processing')
+            """,
+            (fair_key, fair_key, JOB_COST_BASE_MS, cost_model.per_char_ms, RENDER_WORKER_HEARTBEAT_TTL)
+        )
+        pending_total, ahead_count, ahead_chars, in_flight_ms, live_slots = cursor.fetchone()
+        admission = decide_admission(
+            pending_total, ahead_count, int(ahead_chars), text_length, float(in_flight_ms), int(live_slots)
+        )
+        metrics.record_admission(admission.decision)
+        if not admission.accepted:
+            logger.warning(
+                f"Задача пользователя {user_id} отклонена: в очереди {pending_total}, "
+                f"ожидание ~{admission.eta_seconds:.0f}с"
+            )
+            return admission
+
+        digest = store_job_text(cursor, text_content)
+        cursor.execute(
+            """
+            INSERT INTO jobs (
+                user_id, chat_id, text_hash, render_params, status, max_attempts,
+                priority_class, text_length, fair_key
+            )
+            VALUES (%s, %s, %s, %s, 'pending', %s, %s, %s, %s)
+            RETURNING id
+            """,
+            (
+                user_id, chat_id, digest, json.dumps(render_params), JOB_MAX_ATTEMPTS,
+                priority_class, text_length, fair_key,
+            )
+        )
+        admission.job_id = cursor.fetchone()[0]
+        # Уведомление уходит при коммите вместе с задачей
+        cursor.execute("SELECT pg_notify(%s, %s)", (RENDER_JOBS_CHANNEL, str(admission.job_id)))
+    return admission
+
+
+def lease_job(
+    worker_id: str,
+    lease_seconds: int = JOB_LEASE_SECONDS,
+    max_text_length: Optional[int] = None,
+) -> Optional[Dict[str, object]]:
+    """
+    Забирает готовую задачу с наименьшим fair_key. None — очередь пуста.
+
+    max_text_length — только тексты не длиннее (быстрая полоса воркеров).
+    """
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            """
+            WITH leased AS (
+                UPDATE jobs
+                SET status = 'processing',
+                    attempts = attempts + 1,
+                    leased_by = %s,
+                    leased_until = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                    started_at = CURRENT_TIMESTAMP
+                WHERE (id, created_at) = (
+                    SELECT id, created_at
+                    FROM jobs
+                    WHERE status = 'pending' AND available_at <= CURRENT_TIMESTAMP
+                      AND (%s::integer IS NULL OR text_length <= %s)
+                    ORDER BY fair_key, id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING id, user_id, chat_id, text_hash, render_params, attempts, max_attempts,
+                          priority_class, EXTRACT(EPOCH FROM started_at - created_at) * 1000 AS wait_ms
+            )
+            SELECT l.id, l.user_id, l.chat_id, t.body, l.render_params, l.attempts, l.max_attempts,
+                   l.priority_class, l.wait_ms
+            FROM leased l
+            LEFT JOIN job_texts t ON t.text_hash = l.text_hash
+            """,
+            (worker_id, lease_seconds, max_text_length, max_text_length)
+        )
+        row = cursor.fetchone()
+    if not row:
+        return None
+    return {
+        "id": row[0],
+        "user_id": row[1],
+        "chat_id": row[2],
+        # None — текст удалён по сроку хранения (render_job завершит задачу ошибкой)
+        "text_content": decode_job_text(row[3]) if row[3] is not None else None,
+        "render_params": row[4] or {},
+        "attempts": row[5],
+        "max_attempts": row[6],
+        "priority_class": row[7],
+        "wait_ms": float(row[8] or 0),
+    }
+
+
+def complete_job(job_id: int, worker_id: str, pdf_path: str, execution_time_ms: int) -> Optional[str]:
+    """
+    Отмечает задачу выполненной.
+
+    Возвращает 'completed', 'cancelled' (пользователь отменил задачу, пока шла
+    генерация) или None — аренда уже потеряна (задачу забрал другой воркер).
+    """
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            f"""
+            UPDATE jobs
+            SET status = CASE WHEN cancel_requested_at IS NULL THEN 'completed' ELSE 'cancelled' END,
+                pdf_path = %s,
+                execution_time_ms = %s,
+                completed_at = CURRENT_TIMESTAMP,
+                leased_by = NULL,
+                leased_until = NULL,
+                error_message = NULL
+            WHERE {JOB_BY_ID} AND status = 'processing' AND leased_by = %s
+            RETURNING status
+            """,
+            (pdf_path, execution_time_ms, *job_id_params(job_id), worker_id)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        if row[0] == 'completed':
+            cursor.execute("SELECT pg_notify(%s, %s)", (JOB_EVENTS_CHANNEL, str(job_id)))
+    return row[0]
+
+
+def fail_job(job_id: int, worker_id: str, error_message: str, retryable: bool = True) -> Optional[str]:
+    """
+    Записывает неудачную попытку.
+
+    Возвращает новый статус: 'pending' (будет повтор), 'failed', 'cancelled'
+    (отмена запрошена во время попытки) или None, если аренда уже потеряна.
+    """
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            f"""
+            UPDATE jobs
+            SET status = CASE
+                    WHEN cancel_requested_at IS NOT NULL THEN 'cancelled'
+                    WHEN %s AND attempts < max_attempts THEN 'pending'
+                    ELSE 'failed'
+                END,
+                available_at = CURRENT_TIMESTAMP + make_interval(secs => %s * attempts),
+                completed_at = CASE
+                    WHEN cancel_requested_at IS NULL AND %s AND attempts < max_attempts THEN NULL
+                    ELSE CURRENT_TIMESTAMP
+                END,
+                leased_by = NULL,
+                leased_until = NULL,
+                error_message = %s
+            WHERE {JOB_BY_ID} AND status = 'processing' AND leased_by = %s
+            RETURNING status
+            """,
+            (retryable, JOB_RETRY_DELAY, retryable, error_message[:1000], *job_id_params(job_id), worker_id)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        if row[0] == 'failed':
+            cursor.execute("SELECT pg_notify(%s, %s)", (JOB_EVENTS_CHANNEL, str(job_id)))
+    return row[0]
+
+
+def heartbeat_render_worker(worker_id: str, slots: int) -> None:
+    """Отмечает процесс с воркерами генерации в реестре render_workers (для оценки допуска)"""
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            """
+            INSERT INTO render_workers (worker_id, slots, heartbeat_at)
+            VALUES (%s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (worker_id) DO UPDATE SET slots = EXCLUDED.slots, heartbeat_at = EXCLUDED.heartbeat_at
+            """,
+            (worker_id, slots)
+        )
+        # Записи процессов, завершившихся без unregister_render_worker
+        cursor.execute(
+            "DELETE FROM render_workers WHERE heartbeat_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'",
+            (RENDER_WORKER_HEARTBEAT_TTL * 10,)
+        )
+
+
+def unregister_render_worker(worker_id: str) -> None:
+    """Убирает процесс из реестра render_workers при остановке"""
+    with db_cursor(commit=True) as cursor:
+        cursor.execute("DELETE FROM render_workers WHERE worker_id = %s", (worker_id,))
+
+
+def reap_expired_jobs() -> int:
+    """Возвращает в очередь задачи упавших воркеров (истекла аренда). Возвращает их число."""
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            """
+            UPDATE jobs
+            SET status = CASE
+                    WHEN cancel_requested_at IS NOT NULL THEN 'cancelled'
+                    WHEN attempts < max_attempts THEN 'pending'
+                    ELSE 'failed'
+                END,
+                available_at = CURRENT_TIMESTAMP,
+                completed_at = CASE
+                    WHEN cancel_requested_at IS NULL AND attempts < max_attempts THEN NULL
+                    ELSE CURRENT_TIMESTAMP
+                END,
+                error_message = 'Истекло время обработки задачи воркером ' || COALESCE(leased_by, ''),
+                leased_by = NULL,
+                leased_until = NULL
+            WHERE status = 'processing' AND leased_until < CURRENT_TIMESTAMP
+            RETURNING id, status
+            """
+        )
+        rows = cursor.fetchall()
+        for job_id, status in rows:
+            if status == 'failed':
+                cursor.execute("SELECT pg_notify(%s, %s)", (JOB_EVENTS_CHANNEL, str(job_id)))
+    if rows:
+        logger.warning(f"Возвращено в очередь задач с истёкшей арендой: {len(rows)}")
+    return len(rows)
+
+
+# Результат ещё не отправлен, и отправку сейчас не ведёт другой процесс бота
+_DELIVERY_DUE = """
+    notified_at IS NULL AND status IN ('completed', 'failed', 'timeout')
+    AND (delivery_available_at IS NULL OR delivery_available_at <= CURRENT_TIMESTAMP)
+    AND (delivery_leased_until IS NULL OR delivery_leased_until < CURRENT_TIMESTAMP)
+"""
+
+
+def claim_job_delivery(job_id: int, lease_seconds: int = DELIVERY_LEASE_SECONDS) -> Optional[int]:
+    """
+    Берёт отправку результата задачи в аренду.
+
+    Возвращает номер попытки отправки или None, если результат уже отправлен,
+    отправка отложена или её ведёт другой процесс бота. Если процесс упал
+    посреди загрузки, аренда истекает и отправка повторяется.
+    """
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            f"""
+            UPDATE jobs
+            SET delivery_attempts = delivery_attempts + 1,
+                delivery_leased_until = CURRENT_TIMESTAMP + make_interval(secs => %s)
+            WHERE {JOB_BY_ID} AND {_DELIVERY_DUE}
+            RETURNING delivery_attempts
+            """,
+            (lease_seconds, *job_id_params(job_id))
+        )
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+def finish_job_delivery(job_id: int, attempt: int, error_message: Optional[str] = None) -> bool:
+    """
+    Результат отправлен; с error_message — отправка прекращена после ошибок.
+
+    attempt — номер попытки из claim_job_delivery. Возвращает False, если
+    отправку уже взял другой отправитель (аренда истекла).
+    """
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            f"""
+            UPDATE jobs
+            SET notified_at = CURRENT_TIMESTAMP,
+                delivery_leased_until = NULL,
+                delivery_error = %s
+            WHERE {JOB_BY_ID} AND delivery_attempts = %s AND notified_at IS NULL
+            """,
+            (error_message[:1000] if error_message else None, *job_id_params(job_id), attempt)
+        )
+        return cursor.rowcount > 0
+
+
+def retry_job_delivery(job_id: int, attempt: int, delay_seconds: float, error_message: str) -> bool:
+    """Откладывает следующую попытку отправки на delay_seconds; False — аренда уже чужая"""
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            f"""
+            UPDATE jobs
+            SET delivery_available_at = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                delivery_leased_until = NULL,
+                delivery_error = %s
+            WHERE {JOB_BY_ID} AND delivery_attempts = %s AND notified_at IS NULL
+            """,
+            (delay_seconds, error_message[:1000], *job_id_params(job_id), attempt)
+        )
+        return cursor.rowcount > 0
+
+
+def fetch_due_deliveries(limit: int = 100) -> List[int]:
+    """Задачи, результат которых пора отправить: пропущенные уведомления и отложенные повторы"""
+    with db_cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT id
+            FROM jobs
+            WHERE {_DELIVERY_DUE}
+            ORDER BY id
+            LIMIT %s
+            """,
+            (limit,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def cancel_job(job_id: int, user_id: int) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Отменяет задачу пользователя.
+
+    Возвращает (статус, воркер): ('cancelled', None) — задача ещё ждала и снята
+    сразу; ('processing', воркер) — генерация прервётся на ближайшей точке
+    проверки; (None, None) — задача уже завершена или чужая.
+    """
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            f"""
+            UPDATE jobs
+            SET status = CASE WHEN status = 'pending' THEN 'cancelled' ELSE status END,
+                completed_at = CASE WHEN status = 'pending' THEN CURRENT_TIMESTAMP ELSE completed_at END,
+                cancel_requested_at = CURRENT_TIMESTAMP
+            WHERE {JOB_BY_ID} AND user_id = %s AND status IN ('pending', 'processing')
+            RETURNING status, leased_by
+            """,
+            (*job_id_params(job_id), user_id)
+        )
+        row = cursor.fetchone()
+    if not row:
+        return None, None
+    metrics.record_job_interrupted("cancel_requested")
+    return row[0], row[1]
+
+
+def is_cancel_requested(job_id: int) -> bool:
+    with db_cursor() as cursor:
+        cursor.execute(f"SELECT cancel_requested_at IS NOT NULL FROM jobs WHERE {JOB_BY_ID}", job_id_params(job_id))
+        row = cursor.fetchone()
+        return bool(row and row[0])
+
+
+def interrupt_job(job_id: int, worker_id: str, status: str, error_message: str) -> bool:
+    """Завершает прерванную генерацию статусом cancelled или timeout. False — аренда потеряна."""
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            f"""
+            UPDATE jobs
+            SET status = %s,
+                completed_at = CURRENT_TIMESTAMP,
+                leased_by = NULL,
+                leased_until = NULL,
+                error_message = %s
+            WHERE {JOB_BY_ID} AND status = 'processing' AND leased_by = %s
+            """,
+            (status, error_message[:1000], *job_id_params(job_id), worker_id)
+        )
+        if cursor.rowcount == 0:
+            return False
+        if status == 'timeout':
+            cursor.execute("SELECT pg_notify(%s, %s)", (JOB_EVENTS_CHANNEL, str(job_id)))
+    return True
+
+
+def get_queue_depth() -> Dict[str, object]:
+    """Число задач в очереди и в работе, плюс ожидающие по классам приоритета"""
+    with db_cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT status, priority_class, COUNT(*)
+            FROM jobs
+            WHERE status IN ('pending', 'processing')
+            GROUP BY status, priority_class
+            """
+        )
+        depth = {"pending": 0, "processing": 0, "pending_by_class": dict.fromkeys(PRIORITY_CLASSES, 0)}
+        for status, priority_class, count in cursor.fetchall():
+            depth[status] += count
+            if status == 'pending':
+                depth["pending_by_class"][priority_class] = count
+        return depth
+
+
+def load_render_cost_samples(limit: int = 200) -> List[Tuple[int, int]]:
+    """(длина текста, время генерации мс) недавних задач — начальная оценка cost_model"""
+    with db_cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT text_length, execution_time_ms
+            FROM jobs
+            WHERE status = 'completed' AND text_length IS NOT NULL AND execution_time_ms IS NOT NULL
+            ORDER BY completed_at DESC NULLS LAST
+            LIMIT %s
+            """,
+            (limit,)
+        )
+        return cursor.fetchall()
+
+
+def seed_render_cost_model() -> None:
+    try:
+        cost_model.seed(load_render_cost_samples())
+    except Exception as e:
+        logger.warning(f"Не удалось загрузить историю времени генерации: {e}")
+        return
+    logger.info(
+        f"Оценка генерации: {cost_model.per_char_ms:.3f} мс/символ, "
+        f"быстрая полоса — тексты до {cost_model.fast_lane_max_chars()} символов"
+    )
+
+
+def render_job(job: Dict[str, object], worker_id: str) -> Optional[str]:
+    """
+    Генерирует PDF для арендованной задачи и записывает результат.
+
+    Синхронная: вызывается в потоке pdf_executor бота или в render_worker.py.
+    Возвращает итоговый статус задачи (см. complete_job / fail_job / interrupt_job).
+    """
+    try:
+        return _render_job(job, worker_id)
+    finally:
+        clear_local_cancel(job["id"])
+
+
+def _render_job(job: Dict[str, object], worker_id: str) -> Optional[str]:
+    from pdf_generator import generate_pdf_for_job
+    from utils.db_utils import get_fonts_for_generation
+
+    job_id = job["id"]
+    user_id = job["user_id"]
+    params = job["render_params"]
+    start_time = time.time()
+    metrics.record_queue_wait(job.get("priority_class", "standard"), job.get("wait_ms", 0))
+    # Срок генерации меньше аренды, иначе задачу заберёт reap_expired_jobs
+    control = RenderControl(job_id, min(JOB_RENDER_TIMEOUT, JOB_LEASE_SECONDS * 0.9), is_cancel_requested)
+
+    try:
+        if job["text_content"] is None:
+            raise ValueError("Текст задачи удалён по сроку хранения")
+        font_sets = get_fonts_for_generation(user_id)
+        base_meta = font_sets.get("base")
+        base_path = base_meta.get("path") if base_meta else None
+        if not base_path or not os.path.exists(base_path):
+            raise FileNotFoundError("Шрифты не найдены. Загрузите или переустановите шрифты.")
+
+        pdf_path = generate_pdf_for_job(
+            job_id,
+            job["text_content"],
+            font_sets,
+            params.get("page_format"),
+            params.get("grid_enabled", False),
+            params.get("first_page_side", 'right'),
+            user_id,
+            checkpoint=control.checkpoint,
+        )
+        if not os.path.exists(pdf_path):
+            raise FileNotFoundError("PDF файл не найден")
+    except RenderInterrupted as e:
+        metrics.record_job_interrupted(e.status)
+        interrupt_job(job_id, worker_id, e.status, str(e))
+        logger.warning(f"Job {job_id} пользователя {user_id} прерван ({e.status}): {e}")
+        return e.status
+    except Exception as e:
+        metrics.record_error(type(e).__name__)
+        retryable = not isinstance(e, NON_RETRYABLE_ERRORS)
+        status = fail_job(job_id, worker_id, str(e), retryable=retryable)
+        logger.error(
+            f"Error generating PDF for user {user_id}, job {job_id} "
+            f"(попытка {job['attempts']}/{job['max_attempts']}, статус {status}): {e}",
+            exc_info=True,
+        )
+        return status
+
+    execution_time_ms = int((time.time() - start_time) * 1000)
+    cost_model.observe(len(job["text_content"]), execution_time_ms)
+    metrics.record_pdf_time(execution_time_ms)
+    metrics.record_request(user_id)
+
+    status = complete_job(job_id, worker_id, pdf_path, execution_time_ms)
+    if status is None:
+        logger.warning(f"Job {job_id}: аренда потеряна до завершения, результат отброшен")
+        return None
+    logger.info(f"PDF generated for user {user_id}, job {job_id}, time: {execution_time_ms}ms ({status})")
+    return status
@@ -0,0 +1,114 @@
+"""
+Справедливое планирование очереди генерации.
+
+Каждой задаче при постановке в очередь присваивается fair_key — виртуальное
+время окончания (start-time fair queueing):
+
+    start    = max(сейчас, fair_key последней незавершённой задачи пользователя в этом классе)
+    fair_key = start + оценка_времени_генерации / вес_класса
+
+Воркеры берут задачи по возрастанию fair_key. Поэтому десять длинных текстов
+одного пользователя выстраиваются друг за другом, а короткая заметка другого
+пользователя получает ключ «сейчас + доли секунды» и обгоняет их. Голодания
+нет: ключ ограничен реальным временем постановки плюс оценкой.
+
+Классы приоритета (по длине текста):
+    interactive — короткие заметки, вес 4;
+    standard    — обычные тексты, вес 2;
+    bulk        — длинные тексты, вес 1.
+
+Стоимость символа не константа: cost_model уточняет её скользящим средним
+(EWMA) по фактическому времени генерации. От неё же зависит порог длины
+текста для быстрой полосы воркеров (utils/render_workers.py).
+"""
+
+import threading
+from typing import Optional
+
+from config import (
+    FAST_LANE_TARGET_MS,
+    JOB_BULK_TEXT_CHARS,
+    JOB_COST_BASE_MS,
+    JOB_COST_PER_CHAR_MS,
+    JOB_SHORT_TEXT_CHARS,
+    RENDER_COST_EWMA_ALPHA,
+)
+
+PRIORITY_CLASSES = ("interactive", "standard", "bulk")
+
+CLASS_WEIGHTS = {
+    "interactive": 4.0,
+    "standard": 2.0,
+    "bulk": 1.0,
+}
+
+
+def classify_job(text_length: int) -> str:
+    """Класс приоритета по длине текста"""
+    if text_length <= JOB_SHORT_TEXT_CHARS:
+        return "interactive"
+    if text_length >= JOB_BULK_TEXT_CHARS:
+        return "bulk"
+    return "standard"
+
+
+# Короткие тексты почти целиком состоят из накладных расходов и портят оценку символа
+MIN_COST_SAMPLE_CHARS = 500
+# Нижняя граница порога быстрой полосы — чтобы полоса не простаивала после медленных замеров
+MIN_FAST_LANE_CHARS = 300
+
+
+class RenderCostModel:
+    """Оценка времени генерации: JOB_COST_BASE_MS + стоимость символа (EWMA) * длина"""
+
+    def __init__(self, per_char_ms: float = JOB_COST_PER_CHAR_MS, alpha: float = RENDER_COST_EWMA_ALPHA):
+        self.per_char_ms = per_char_ms
+        self.alpha = alpha
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def observe(self, text_length: int, execution_ms: float) -> None:
+        """Учитывает фактическое время генерации задачи"""
+        if text_length < MIN_COST_SAMPLE_CHARS:
+            return
+        sample = max(0.0, execution_ms - JOB_COST_BASE_MS) / text_length
+        with self._lock:
+            self.per_char_ms = self.alpha * sample + (1 - self.alpha) * self.per_char_ms
+            self.samples += 1
+
+    def seed(self, samples) -> None:
+        """Начальная оценка по недавним задачам из БД: [(длина текста, время мс), ...]"""
+        per_char = [
+            max(0.0, execution_ms - JOB_COST_BASE_MS) / text_length
+            for text_length, execution_ms in samples
+            if text_length >= MIN_COST_SAMPLE_CHARS
+        ]
+        if not per_char:
+            return
+        per_char.sort()
+        with self._lock:
+            self.per_char_ms = per_char[len(per_char) // 2]
+            self.samples = len(per_char)
+
+    def estimate_ms(self, text_length: int) -> float:
+        return JOB_COST_BASE_MS + self.per_char_ms * text_length
+
+    def fast_lane_max_chars(self) -> int:
+        """Самый длинный текст, который по оценке генерируется за FAST_LANE_TARGET_MS"""
+        budget = max(0.0, FAST_LANE_TARGET_MS - JOB_COST_BASE_MS)
+        return max(MIN_FAST_LANE_CHARS, int(budget / max(self.per_char_ms, 1e-6)))
+
+
+# Оценка процесса: уточняется по задачам, сгенерированным в этом процессе
+cost_model = RenderCostModel()
+
+
+def estimate_render_ms(text_length: int) -> float:
+    """Оценка времени генерации PDF, мс"""
+    return cost_model.estimate_ms(text_length)
+
+
+def compute_fair_key(now: float, user_last_key: Optional[float], text_length: int, priority_class: str) -> float:
+    """fair_key новой задачи; now и user_last_key — секунды (epoch)"""
+    start = max(now, user_last_key or 0.0)
+    return start + estimate_render_ms(text_length) / 1000.0 / CLASS_WEIGHTS[priority_class]
@@ -0,0 +1,60 @@
+"""
+Хранилище текстов задач генерации.
+
+Текст задачи хранится не в jobs, а в job_texts: ключ — sha256 текста,
+значение — UTF-8, сжатый zlib. Одинаковые тексты (повторная отправка,
+повтор после ошибки) хранятся один раз. Таблица jobs остаётся узкой:
+статус, пути и время. Тексты, не использовавшиеся дольше
+JOB_TEXT_RETENTION_DAYS, удаляет purge_job_texts (у старых задач text_hash
+становится NULL).
+"""
+
+import hashlib
+import logging
+import zlib
+
+from config import JOB_TEXT_RETENTION_DAYS
+from database.connection import db_cursor
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_LEVEL = 6
+
+
+def store_job_text(cursor, text: str) -> bytes:
+    """Сохраняет текст (в транзакции вызывающего) и возвращает его ключ"""
+    raw = text.encode("utf-8")
+    digest = hashlib.sha256(raw).digest()
+    cursor.execute(
+        """
+        INSERT INTO job_texts (text_hash, body, original_size)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (text_hash) DO UPDATE SET last_used_at = CURRENT_TIMESTAMP
+        """,
+        (digest, zlib.compress(raw, COMPRESSION_LEVEL), len(raw))
+    )
+    return digest
+
+
+def decode_job_text(body) -> str:
+    return zlib.decompress(bytes(body)).decode("utf-8")
+
+
+def purge_job_texts(retention_days: int = JOB_TEXT_RETENTION_DAYS) -> int:
+    """Удаляет давно не использованные тексты, кроме нужных незавершённым задачам"""
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(
+            """
+            DELETE FROM job_texts t
+            WHERE t.last_used_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+              AND NOT EXISTS (
+                  SELECT 1 FROM jobs j
+                  WHERE j.text_hash = t.text_hash AND j.status IN ('pending', 'processing')
+              )
+            """,
+            (retention_days,)
+        )
+        deleted = cursor.rowcount
+    if deleted:
+        logger.info(f"✓ Удалено текстов задач старше {retention_days} дн.: {deleted}")
+    return deleted
@@ -0,0 +1,64 @@
+"""
+Буфер отложенной записи last_seen_at.
+
+Middleware только отмечает визит в памяти (touch); фоновая задача раз в
+LAST_SEEN_FLUSH_INTERVAL секунд записывает накопленное одним
+UPDATE ... FROM (VALUES ...). Повторные визиты одного пользователя между
+сбросами схлопываются в одну строку. При остановке бота буфер сбрасывается.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict
+
+from config import LAST_SEEN_FLUSH_INTERVAL
+from utils.db_async import update_last_seen_batch
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LastSeenBuffer:
+    """Накапливает user_id -> время последнего визита до очередного сброса"""
+
+    def __init__(self):
+        self._pending: Dict[int, float] = {}
+        self._flush_lock = asyncio.Lock()
+
+    def touch(self, user_id: int) -> None:
+        """Отмечает визит пользователя (без обращения к БД)"""
+        self._pending[user_id] = time.time()
+        metrics.record_last_seen_touch()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def flush(self) -> int:
+        """Записывает накопленные визиты в БД. Возвращает число обновлённых строк."""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            try:
+                rows = await update_last_seen_batch(batch)
+            except Exception as e:
+                # Возвращаем пачку в буфер, не затирая более свежие отметки
+                for user_id, seen_at in batch.items():
+                    if seen_at > self._pending.get(user_id, 0):
+                        self._pending[user_id] = seen_at
+                logger.warning(f"Не удалось записать last_seen_at ({len(batch)} польз.): {e}")
+                return 0
+            metrics.record_last_seen_flush(rows)
+            return rows
+
+    async def run_periodic(self, interval: float = LAST_SEEN_FLUSH_INTERVAL) -> None:
+        """Фоновая задача: сбрасывает буфер каждые interval секунд"""
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+
+# Глобальный буфер
+last_seen_buffer = LastSeenBuffer()
@@ -14,6 +14,35 @@ class Metrics:
         self.request_counts = defaultdict(int)
         self.error_counts = defaultdict(int)
         self.total_pdfs = 0
+        self.font_rejections = defaultdict(int)
+        self.fonts_accepted = 0
+        self.last_seen_touches = 0
+        self.last_seen_rows_written = 0
+        self.last_seen_flushes = 0
+        self.user_cache_hits = 0
+        self.user_cache_misses = 0
+        # Ожидание в очереди генерации по классам приоритета (последние 100 значений)
+        self.queue_wait_times = defaultdict(list)
+        # Решения допуска задач в очередь: accept / defer / reject
+        self.admission_decisions = defaultdict(int)
+        # Отмены и таймауты генерации: cancel_requested / cancelled / timeout
+        self.jobs_interrupted = defaultdict(int)
+        # Отправка документов: загрузка файла или по сохранённому file_id
+        self.documents_uploaded = 0
+        self.documents_by_reference = 0
+        # Очередь отправки результатов: delivered / retried / abandoned
+        self.deliveries = defaultdict(int)
+        self.delivery_attempts_max = 0
+        # Исходящие запросы к Telegram: сколько придержал наш лимитер и сколько раз ограничил Telegram
+        self.outbound_calls = defaultdict(int)
+        self.outbound_throttled = defaultdict(int)
+        self.outbound_throttle_wait_ms = 0.0
+        self.telegram_retry_after = defaultdict(int)
+        # Очередь апдейтов webhook: время от приёма до начала обработки и отказы при переполнении
+        self.webhook_updates = 0
+        self.webhook_update_wait_ms = 0.0
+        self.webhook_update_wait_max_ms = 0.0
+        self.webhook_updates_rejected = 0
         
     def record_pdf_time(self, duration_ms: int):
         """Записывает время генерации PDF"""
@@ -33,6 +62,94 @@ class Metrics:
         """Записывает ошибку"""
         self.error_counts[error_type] += 1
     
+    def record_font_rejection(self, reason: str):
+        """Записывает отклонённую на этапе проверки загрузку шрифта"""
+        self.font_rejections[reason] += 1
+
+    def record_font_accepted(self):
+        """Записывает шрифт, прошедший проверку"""
+        self.fonts_accepted += 1
+
+    def record_last_seen_touch(self):
+        """Записывает обращение пользователя (до слияния в буфере last_seen)"""
+        self.last_seen_touches += 1
+
+    def record_last_seen_flush(self, rows: int):
+        """Записывает пакетную запись last_seen_at в БД"""
+        self.last_seen_flushes += 1
+        self.last_seen_rows_written += rows
+
+    def record_user_cache(self, hit: bool):
+        """Записывает обращение к кэшу контекста пользователя"""
+        if hit:
+            self.user_cache_hits += 1
+        else:
+            self.user_cache_misses += 1
+
+    def record_queue_wait(self, priority_class: str, wait_ms: float):
+        """Записывает время ожидания задачи в очереди до начала генерации"""
+        waits = self.queue_wait_times[priority_class]
+        waits.append(wait_ms)
+        if len(waits) > 100:
+            del waits[:-100]
+
+    def record_admission(self, decision: str):
+        """Записывает решение о допуске задачи в очередь"""
+        self.admission_decisions[decision] += 1
+
+    def record_job_interrupted(self, status: str):
+        """Записывает запрос отмены или прерванную генерацию"""
+        self.jobs_interrupted[status] += 1
+
+    def record_document_send(self, by_reference: bool):
+        """Записывает отправку документа в Telegram"""
+        if by_reference:
+            self.documents_by_reference += 1
+        else:
+            self.documents_uploaded += 1
+
+    def record_delivery(self, outcome: str, attempt: int):
+        """Записывает исход попытки отправки результата задачи"""
+        self.deliveries[outcome] += 1
+        self.delivery_attempts_max = max(self.delivery_attempts_max, attempt)
+
+    def record_outbound_call(self, priority: str, wait_ms: float):
+        """Записывает запрос к Telegram и время, которое он ждал в лимитере"""
+        self.outbound_calls[priority] += 1
+        if wait_ms >= 1:
+            self.outbound_throttled[priority] += 1
+            self.outbound_throttle_wait_ms += wait_ms
+
+    def record_telegram_retry_after(self, method: str):
+        """Записывает ответ Telegram RetryAfter (flood control)"""
+        self.telegram_retry_after[method] += 1
+
+    def record_webhook_update(self, wait_ms: float):
+        """Записывает, сколько апдейт ждал в очереди webhook"""
+        self.webhook_updates += 1
+        self.webhook_update_wait_ms += wait_ms
+        self.webhook_update_wait_max_ms = max(self.webhook_update_wait_max_ms, wait_ms)
+
+    def record_webhook_update_rejected(self):
+        """Апдейт не принят: очередь webhook переполнена"""
+        self.webhook_updates_rejected += 1
+
+    def queue_wait_stats(self) -> dict:
+        return {
+            priority_class: {
+                "count": len(waits),
+                "avg_ms": round(sum(waits) / len(waits), 1),
+                "p95_ms": round(sorted(waits)[int(len(waits) * 0.95)], 1) if len(waits) >= 20 else None,
+                "max_ms": round(max(waits), 1),
+            }
+            for priority_class, waits in self.queue_wait_times.items()
+            if waits
+        }
+
+    def user_cache_hit_ratio(self) -> float:
+        total = self.user_cache_hits + self.user_cache_misses
+        return round(self.user_cache_hits / total, 3) if total else 0.0
+
     def get_stats(self) -> dict:
         """Возвращает статистику"""
         if not self.pdf_generation_times:
@@ -43,7 +160,30 @@ class Metrics:
                 "total_pdfs": self.total_pdfs,
                 "total_requests": sum(self.request_counts.values()),
                 "total_errors": sum(self.error_counts.values()),
-                "error_breakdown": dict(self.error_counts)
+                "error_breakdown": dict(self.error_counts),
+                "fonts_accepted": self.fonts_accepted,
+                "font_rejections": dict(self.font_rejections),
+                "last_seen_touches": self.last_seen_touches,
+                "last_seen_rows_written": self.last_seen_rows_written,
+                "last_seen_flushes": self.last_seen_flushes,
+                "user_cache_hits": self.user_cache_hits,
+                "user_cache_misses": self.user_cache_misses,
+                "user_cache_hit_ratio": self.user_cache_hit_ratio(),
+                "queue_wait": self.queue_wait_stats(),
+                "admission": dict(self.admission_decisions),
+                "jobs_interrupted": dict(self.jobs_interrupted),
+                "documents_uploaded": self.documents_uploaded,
+                "documents_by_reference": self.documents_by_reference,
+                "deliveries": dict(self.deliveries),
+                "delivery_attempts_max": self.delivery_attempts_max,
+                "outbound_calls": dict(self.outbound_calls),
+                "outbound_throttled": dict(self.outbound_throttled),
+                "outbound_throttle_wait_ms": round(self.outbound_throttle_wait_ms, 1),
+                "telegram_retry_after": dict(self.telegram_retry_after),
+                "webhook_updates": self.webhook_updates,
+                "webhook_update_wait_avg_ms": round(self.webhook_update_wait_ms / self.webhook_updates, 2) if self.webhook_updates else 0,
+                "webhook_update_wait_max_ms": round(self.webhook_update_wait_max_ms, 2),
+                "webhook_updates_rejected": self.webhook_updates_rejected,
             }
         
         return {
@@ -54,6 +194,29 @@ class Metrics:
             "total_requests": sum(self.request_counts.values()),
             "total_errors": sum(self.error_counts.values()),
             "error_breakdown": dict(self.error_counts),
+            "fonts_accepted": self.fonts_accepted,
+            "font_rejections": dict(self.font_rejections),
+            "last_seen_touches": self.last_seen_touches,
+            "last_seen_rows_written": self.last_seen_rows_written,
+            "last_seen_flushes": self.last_seen_flushes,
+            "user_cache_hits": self.user_cache_hits,
+            "user_cache_misses": self.user_cache_misses,
+            "user_cache_hit_ratio": self.user_cache_hit_ratio(),
+            "queue_wait": self.queue_wait_stats(),
+            "admission": dict(self.admission_decisions),
+            "jobs_interrupted": dict(self.jobs_interrupted),
+            "documents_uploaded": self.documents_uploaded,
+            "documents_by_reference": self.documents_by_reference,
+            "deliveries": dict(self.deliveries),
+            "delivery_attempts_max": self.delivery_attempts_max,
+            "outbound_calls": dict(self.outbound_calls),
+            "outbound_throttled": dict(self.outbound_throttled),
+            "outbound_throttle_wait_ms": round(self.outbound_throttle_wait_ms, 1),
+            "telegram_retry_after": dict(self.telegram_retry_after),
+            "webhook_updates": self.webhook_updates,
+            "webhook_update_wait_avg_ms": round(self.webhook_update_wait_ms / self.webhook_updates, 2) if self.webhook_updates else 0,
+            "webhook_update_wait_max_ms": round(self.webhook_update_wait_max_ms, 2),
+            "webhook_updates_rejected": self.webhook_updates_rejected,
             "last_100_avg": round(sum(self.pdf_generation_times[-100:]) / min(100, len(self.pdf_generation_times)), 2) if self.pdf_generation_times else 0
         }
     
@@ -65,6 +228,53 @@ class Metrics:
         logger.info(f"   Всего запросов: {stats['total_requests']}")
         logger.info(f"   Среднее время генерации: {stats['avg_time_ms']}ms")
         logger.info(f"   Минимум: {stats['min_time_ms']}ms, Максимум: {stats['max_time_ms']}ms")
+        if stats['font_rejections']:
+            rejected = sum(stats['font_rejections'].values())
+            logger.info(
+                f"   Шрифтов принято: {stats['fonts_accepted']}, отклонено при проверке: {rejected} "
+                f"({stats['font_rejections']})"
+            )
+        if stats['last_seen_flushes']:
+            logger.info(
+                f"   last_seen: обращений {stats['last_seen_touches']}, "
+                f"записано строк {stats['last_seen_rows_written']} за {stats['last_seen_flushes']} пачек"
+            )
+        if stats['user_cache_hits'] or stats['user_cache_misses']:
+            logger.info(
+                f"   Кэш пользователей: попаданий {stats['user_cache_hits']}, "
+                f"промахов {stats['user_cache_misses']} (hit ratio {stats['user_cache_hit_ratio']})"
+            )
+        for priority_class, wait in stats['queue_wait'].items():
+            logger.info(
+                f"   Ожидание в очереди ({priority_class}): среднее {wait['avg_ms']}ms, "
+                f"p95 {wait['p95_ms']}ms, макс {wait['max_ms']}ms, задач {wait['count']}"
+            )
+        if stats['admission']:
+            logger.info(f"   Допуск в очередь: {stats['admission']}")
+        if stats['jobs_interrupted']:
+            logger.info(f"   Отмены и таймауты генерации: {stats['jobs_interrupted']}")
+        if stats['documents_uploaded'] or stats['documents_by_reference']:
+            logger.info(
+                f"   Документы: загружено {stats['documents_uploaded']}, "
+                f"отправлено по file_id {stats['documents_by_reference']}"
+            )
+        if stats['deliveries']:
+            logger.info(
+                f"   Отправка результатов: {stats['deliveries']}, "
+                f"максимум попыток {stats['delivery_attempts_max']}"
+            )
+        if stats['outbound_calls']:
+            logger.info(
+                f"   Запросы к Telegram: {stats['outbound_calls']}, придержано лимитером "
+                f"{stats['outbound_throttled']} (всего {stats['outbound_throttle_wait_ms']}ms), "
+                f"RetryAfter от Telegram {stats['telegram_retry_after']}"
+            )
+        if stats['webhook_updates'] or stats['webhook_updates_rejected']:
+            logger.info(
+                f"   Апдейты webhook: {stats['webhook_updates']}, ожидание в очереди "
+                f"среднее {stats['webhook_update_wait_avg_ms']}ms, макс {stats['webhook_update_wait_max_ms']}ms, "
+                f"отклонено {stats['webhook_updates_rejected']}"
+            )
         if stats['total_errors'] > 0:
             logger.warning(f"   Ошибок: {stats['total_errors']} ({stats['error_breakdown']})")
         return stats
@@ -0,0 +1,88 @@
+"""
+Приём уведомлений PostgreSQL (LISTEN/NOTIFY) в event loop бота.
+
+Держит отдельное соединение вне пула и читает его сокет через loop.add_reader,
+поэтому ожидание уведомлений не занимает ни потоков, ни соединений пула.
+При обрыве соединения переподключается и вызывает on_reconnect-обработчики:
+уведомления, пришедшие во время обрыва, потеряны, и подписчики должны
+догнать состояние по таблицам.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List
+
+from database.connection import create_listen_connection
+from utils.executors import db_executor
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 5
+
+
+class PgListener:
+    """Подписка на каналы NOTIFY; обработчики вызываются в event loop"""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable[[str], None]]] = {}
+        self._on_reconnect: List[Callable[[], Awaitable[None]]] = []
+
+    def subscribe(self, channel: str, handler: Callable[[str], None]) -> None:
+        """handler(payload) — синхронный, должен быстро вернуть управление"""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def on_reconnect(self, handler: Callable[[], Awaitable[None]]) -> None:
+        self._on_reconnect.append(handler)
+
+    def _dispatch(self, conn) -> None:
+        conn.poll()
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            for handler in self._handlers.get(notify.channel, []):
+                try:
+                    handler(notify.payload)
+                except Exception as e:
+                    logger.error(f"Ошибка обработчика NOTIFY {notify.channel}: {e}", exc_info=True)
+
+    async def run(self) -> None:
+        """Слушает каналы до отмены задачи, переподключаясь при обрывах"""
+        loop = asyncio.get_running_loop()
+        first = True
+        while True:
+            try:
+                conn = await loop.run_in_executor(db_executor, create_listen_connection, *self._handlers)
+            except Exception as e:
+                logger.warning(f"LISTEN: не удалось подключиться к БД: {e}")
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+
+            lost = loop.create_future()
+
+            def on_readable():
+                try:
+                    self._dispatch(conn)
+                except Exception as e:
+                    if not lost.done():
+                        lost.set_exception(e)
+
+            fd = conn.fileno()
+            loop.add_reader(fd, on_readable)
+            logger.info(f"✓ LISTEN: {', '.join(self._handlers)}")
+            if not first:
+                for handler in self._on_reconnect:
+                    asyncio.create_task(handler())
+            first = False
+
+            try:
+                await lost
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"LISTEN: соединение потеряно ({e}), переподключение")
+            finally:
+                loop.remove_reader(fd)
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            await asyncio.sleep(RECONNECT_DELAY)
@@ -1,14 +1,147 @@
-"""Rate limiting для защиты от спама"""
-from collections import defaultdict
-from datetime import datetime, timedelta
+"""
+Rate limiting для защиты от спама.
 
-# Хранение: user_id -> [timestamp1, timestamp2, ...]
-_user_requests = defaultdict(list)
+Скользящее окно: не больше MAX_REQUESTS_PER_MINUTE запросов за минуту и
+MAX_REQUESTS_PER_HOUR за час. Бэкенд выбирается RATE_LIMIT_BACKEND:
+
+    memory   — в памяти процесса: у пользователя отсортированный список не
+               более MAX_REQUESTS_PER_HOUR отметок времени, поэтому проверка
+               за постоянное время (deque занимает ~600 байт даже с одной
+               отметкой, а у большинства пользователей их одна-две);
+               пользователи без запросов за час удаляются раз в
+               RATE_LIMIT_SWEEP_INTERVAL секунд;
+    postgres — счётчики по минутам в таблице rate_limit_hits, общие для всех
+               процессов бота. Минутное окно оценивается по текущей и
+               взвешенной предыдущей минуте, часовое — суммой за 60 минут.
+"""
+
+import asyncio
+import bisect
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import RATE_LIMIT_BACKEND, RATE_LIMIT_SWEEP_INTERVAL
 
 # Лимиты
 MAX_REQUESTS_PER_MINUTE = 10
 MAX_REQUESTS_PER_HOUR = 50
 
+MINUTE = 60.0
+HOUR = 3600.0
+
+LIMIT_MESSAGES = {
+    "minute": "⚠️ Слишком много запросов! Подождите минуту перед следующим PDF.",
+    "hour": f"⚠️ Превышен лимит запросов на час ({MAX_REQUESTS_PER_HOUR} PDF). Попробуйте позже.",
+}
+
+
+class SlidingWindowLimiter:
+    """Лимитер в памяти процесса"""
+
+    def __init__(
+        self,
+        per_minute: int = MAX_REQUESTS_PER_MINUTE,
+        per_hour: int = MAX_REQUESTS_PER_HOUR,
+        sweep_interval: float = RATE_LIMIT_SWEEP_INTERVAL,
+    ):
+        self.per_minute = per_minute
+        self.per_hour = per_hour
+        self.sweep_interval = sweep_interval
+        # user_id -> отметки времени разрешённых запросов за последний час (по возрастанию)
+        self._requests: Dict[int, List[float]] = {}
+        self._next_sweep = time.monotonic() + sweep_interval
+        self._lock = threading.Lock()
+
+    def check(self, user_id: int, now: Optional[float] = None) -> Optional[str]:
+        """Учитывает запрос; возвращает None или превышенное окно ('minute' / 'hour')"""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            requests = self._requests.get(user_id)
+            if requests is None:
+                requests = self._requests[user_id] = []
+            expired = bisect.bisect_right(requests, now - HOUR)
+            if expired:
+                del requests[:expired]
+            if len(requests) >= self.per_minute and requests[-self.per_minute] > now - MINUTE:
+                return "minute"
+            if len(requests) >= self.per_hour:
+                return "hour"
+            requests.append(now)
+            return None
+
+    def counts(self, user_id: int, now: Optional[float] = None) -> tuple:
+        """(запросов за минуту, запросов за час)"""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            requests = self._requests.get(user_id, ())
+            return (
+                sum(1 for t in requests if t > now - MINUTE),
+                sum(1 for t in requests if t > now - HOUR),
+            )
+
+    def _sweep(self, now: float) -> None:
+        self._next_sweep = now + self.sweep_interval
+        idle = [user_id for user_id, requests in self._requests.items() if not requests or requests[-1] <= now - HOUR]
+        for user_id in idle:
+            del self._requests[user_id]
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+
+def _pg_check(user_id: int) -> Optional[str]:
+    from database.connection import db_cursor
+
+    with db_cursor(commit=True) as cursor:
+        # Параллельные запросы одного пользователя из разных процессов — по очереди
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtextextended('rate_limit:' || %s, 0))", (user_id,))
+        cursor.execute(
+            """
+            SELECT
+                COALESCE(SUM(hits) FILTER (WHERE bucket = date_trunc('minute', LOCALTIMESTAMP)), 0),
+                COALESCE(SUM(hits) FILTER (WHERE bucket = date_trunc('minute', LOCALTIMESTAMP) - INTERVAL '1 minute'), 0),
+                EXTRACT(SECOND FROM LOCALTIMESTAMP),
+                COALESCE(SUM(hits), 0)
+            FROM rate_limit_hits
+            WHERE user_id = %s AND bucket > LOCALTIMESTAMP - INTERVAL '1 hour'
+            """,
+            (user_id,)
+        )
+        current, previous, seconds, hour_total = cursor.fetchone()
+        minute_estimate = current + previous * (1 - float(seconds) / MINUTE)
+        if minute_estimate >= MAX_REQUESTS_PER_MINUTE:
+            return "minute"
+        if hour_total >= MAX_REQUESTS_PER_HOUR:
+            return "hour"
+        cursor.execute(
+            """
+            INSERT INTO rate_limit_hits (user_id, bucket, hits)
+            VALUES (%s, date_trunc('minute', LOCALTIMESTAMP), 1)
+            ON CONFLICT (user_id, bucket) DO UPDATE SET hits = rate_limit_hits.hits + 1
+            """,
+            (user_id,)
+        )
+        return None
+
+
+def purge_rate_limit_hits() -> int:
+    """Удаляет минутные счётчики старше часа (для бэкенда postgres)"""
+    if RATE_LIMIT_BACKEND != "postgres":
+        return 0
+    from database.connection import db_cursor
+
+    with db_cursor(commit=True) as cursor:
+        cursor.execute("DELETE FROM rate_limit_hits WHERE bucket < LOCALTIMESTAMP - INTERVAL '1 hour'")
+        return cursor.rowcount
+
+
+_memory_limiter = SlidingWindowLimiter()
+
 
 def check_rate_limit(user_id: int) -> tuple[bool, str]:
     """
@@ -20,44 +153,30 @@ def check_rate_limit(user_id: int) -> tuple[bool, str]:
     Returns:
         (allowed, message) - разрешено ли действие и сообщение об ошибке
     """
-    now = datetime.now()
-    
-    # Очищаем старые записи (старше часа)
-    user_requests = _user_requests[user_id]
-    user_requests[:] = [req for req in user_requests 
-                       if now - req < timedelta(hours=1)]
-    
-    # Проверяем лимит на минуту
-    recent_minute = [req for req in user_requests 
-                    if now - req < timedelta(minutes=1)]
-    if len(recent_minute) >= MAX_REQUESTS_PER_MINUTE:
-        return False, "⚠️ Слишком много запросов! Подождите минуту перед следующим PDF."
-    
-    # Проверяем лимит на час
-    if len(user_requests) >= MAX_REQUESTS_PER_HOUR:
-        return False, "⚠️ Превышен лимит запросов на час (50 PDF). Попробуйте позже."
-    
-    # Добавляем текущий запрос
-    user_requests.append(now)
+    if RATE_LIMIT_BACKEND == "postgres":
+        exceeded = _pg_check(user_id)
+    else:
+        exceeded = _memory_limiter.check(user_id)
+    if exceeded:
+        return False, LIMIT_MESSAGES[exceeded]
     return True, ""
 
 
+async def check_rate_limit_async(user_id: int) -> tuple[bool, str]:
+    """check_rate_limit для хендлеров: запрос к Postgres выполняется в db_executor"""
+    if RATE_LIMIT_BACKEND != "postgres":
+        return check_rate_limit(user_id)
+    from utils.executors import db_executor
+
+    return await asyncio.get_running_loop().run_in_executor(db_executor, check_rate_limit, user_id)
+
+
 def get_user_stats(user_id: int) -> dict:
-    """Возвращает статистику запросов пользователя"""
-    now = datetime.now()
-    user_requests = _user_requests[user_id]
-    
-    # Очищаем старые
-    user_requests[:] = [req for req in user_requests 
-                       if now - req < timedelta(hours=1)]
-    
-    recent_minute = [req for req in user_requests 
-                    if now - req < timedelta(minutes=1)]
-    
+    """Возвращает статистику запросов пользователя (бэкенд memory)"""
+    minute, hour = _memory_limiter.counts(user_id)
     return {
-        "requests_last_minute": len(recent_minute),
-        "requests_last_hour": len(user_requests),
+        "requests_last_minute": minute,
+        "requests_last_hour": hour,
         "limit_per_minute": MAX_REQUESTS_PER_MINUTE,
         "limit_per_hour": MAX_REQUESTS_PER_HOUR
     }
-
@@ -0,0 +1,84 @@
+"""
+Отмена и ограничение времени генерации PDF.
+
+generate_pdf вызывает checkpoint() на каждом абзаце, строке и слове. RenderControl
+прерывает генерацию исключением, если истёк срок задачи или пользователь
+нажал «Отменить». Отмену из другого процесса видно через БД (не чаще раза в
+JOB_CANCEL_CHECK_INTERVAL секунд), в своём процессе — сразу через
+request_local_cancel.
+"""
+
+import os
+import socket
+import threading
+import time
+from typing import Callable, Optional, Set
+
+from config import JOB_CANCEL_CHECK_INTERVAL
+
+
+class RenderInterrupted(Exception):
+    """Генерация прервана до завершения"""
+
+    status = "failed"
+
+
+class RenderCancelled(RenderInterrupted):
+    """Пользователь отменил задачу"""
+
+    status = "cancelled"
+
+
+class RenderTimeout(RenderInterrupted):
+    """Истекло время, отведённое на генерацию"""
+
+    status = "timeout"
+
+
+_local_cancels: Set[int] = set()
+_lock = threading.Lock()
+
+
+def is_local_worker(worker_id: Optional[str]) -> bool:
+    """Воркер работает в этом процессе (id вида host:pid:...)"""
+    return bool(worker_id) and worker_id.startswith(f"{socket.gethostname()}:{os.getpid()}:")
+
+
+def request_local_cancel(job_id: int) -> None:
+    """Отмена задачи, которую может генерировать этот процесс"""
+    with _lock:
+        _local_cancels.add(job_id)
+
+
+def clear_local_cancel(job_id: int) -> None:
+    with _lock:
+        _local_cancels.discard(job_id)
+
+
+class RenderControl:
+    """Точка проверки для одной задачи: срок и запрос отмены"""
+
+    def __init__(
+        self,
+        job_id: int,
+        timeout: float,
+        is_cancel_requested: Callable[[int], bool],
+        cancel_check_interval: float = JOB_CANCEL_CHECK_INTERVAL,
+    ):
+        self.job_id = job_id
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+        self._is_cancel_requested = is_cancel_requested
+        self._cancel_check_interval = cancel_check_interval
+        self._next_cancel_check = time.monotonic() + cancel_check_interval
+
+    def checkpoint(self) -> None:
+        now = time.monotonic()
+        if self.job_id in _local_cancels:
+            raise RenderCancelled(f"Задача {self.job_id} отменена пользователем")
+        if now > self.deadline:
+            raise RenderTimeout(f"Превышено время генерации ({int(self.timeout)} с)")
+        if now >= self._next_cancel_check:
+            self._next_cancel_check = now + self._cancel_check_interval
+            if self._is_cancel_requested(self.job_id):
+                raise RenderCancelled(f"Задача {self.job_id} отменена пользователем")
@@ -0,0 +1,130 @@
+"""
+Воркеры очереди генерации внутри процесса бота.
+
+Каждый слот забирает задачу из jobs (lease_job) и генерирует PDF в
+pdf_executor. Между задачами слоты ждут NOTIFY о новой задаче (wake) или
+JOB_POLL_INTERVAL секунд. Отдельные процессы render_worker.py работают с той
+же очередью, поэтому INLINE_RENDER_WORKERS=0 переносит всю генерацию в них.
+
+Полосы:
+    быстрая     — FAST_LANE_WORKERS слотов, берут только тексты не длиннее
+                  cost_model.fast_lane_max_chars(); короткие заметки не ждут,
+                  пока освободятся слоты с длинными текстами. С
+                  FAST_LANE_PROCESS=1 слоты работают в дочернем процессе
+                  render_worker.py --lane fast (FastLaneProcess) и не делят GIL
+                  с генерацией и event loop бота; с 0 — в своём пуле потоков,
+                  это только приоритет в очереди;
+    основная    — остальные слоты, берут любые задачи по fair_key.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import sys
+
+from config import FAST_LANE_WORKERS, JOB_POLL_INTERVAL, INLINE_RENDER_WORKERS, JOB_RENDER_TIMEOUT
+from utils.db_async import heartbeat_render_worker, lease_job, reap_expired_jobs
+from utils.executors import fast_pdf_executor, pdf_executor
+from utils.job_queue import render_job
+from utils.job_scheduling import cost_model
+
+logger = logging.getLogger(__name__)
+
+
+class InlineRenderWorkers:
+    """Слоты генерации PDF, работающие в event loop бота"""
+
+    def __init__(self, slots: int = INLINE_RENDER_WORKERS, fast_slots: int = FAST_LANE_WORKERS):
+        self.slots = slots
+        self.fast_slots = fast_slots
+        self._wakeup = asyncio.Event()
+        self._worker_prefix = f"{socket.gethostname()}:{os.getpid()}:bot"
+
+    def wake(self, payload: str = "") -> None:
+        """Обработчик NOTIFY RENDER_JOBS_CHANNEL"""
+        self._wakeup.set()
+
+    async def _wait_for_work(self) -> None:
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _slot(self, number: int, fast: bool = False) -> None:
+        worker_id = f"{self._worker_prefix}:{'fast' if fast else ''}{number}"
+        executor = fast_pdf_executor if fast else pdf_executor
+        loop = asyncio.get_running_loop()
+        while True:
+            max_text_length = cost_model.fast_lane_max_chars() if fast else None
+            try:
+                job = await lease_job(worker_id, max_text_length=max_text_length)
+            except Exception as e:
+                logger.error(f"{worker_id}: не удалось взять задачу: {e}")
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+                continue
+            if job is None:
+                await self._wait_for_work()
+                continue
+            try:
+                await loop.run_in_executor(executor, render_job, job, worker_id)
+            except Exception as e:
+                # render_job сам записывает ошибки генерации; сюда попадают ошибки БД
+                logger.error(f"{worker_id}: ошибка обработки задачи {job['id']}: {e}", exc_info=True)
+
+    async def _reaper(self) -> None:
+        while True:
+            try:
+                await heartbeat_render_worker(self._worker_prefix, self.slots + self.fast_slots)
+            except Exception as e:
+                logger.warning(f"Не удалось отметиться в реестре воркеров: {e}")
+            await asyncio.sleep(JOB_POLL_INTERVAL * 5)
+            try:
+                if await reap_expired_jobs():
+                    self.wake()
+            except Exception as e:
+                logger.error(f"Ошибка возврата задач с истёкшей арендой: {e}")
+
+    async def run(self) -> None:
+        await asyncio.gather(
+            self._reaper(),
+            *(self._slot(n) for n in range(self.slots)),
+            *(self._slot(n, fast=True) for n in range(self.fast_slots)),
+        )
+
+
+class FastLaneProcess:
+    """Дочерний render_worker.py --lane fast: быстрая полоса бота в отдельном процессе"""
+
+    RENDER_WORKER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "render_worker.py")
+
+    def __init__(self, slots: int = FAST_LANE_WORKERS):
+        self.slots = slots
+        self._process = None
+        self._stopping = False
+
+    async def run(self) -> None:
+        """Запускает процесс и перезапускает его, если он завершился"""
+        while not self._stopping:
+            self._process = await asyncio.create_subprocess_exec(
+                sys.executable, self.RENDER_WORKER,
+                "--lane", "fast", "--fast-slots", str(self.slots), "--parent-pid", str(os.getpid()),
+            )
+            logger.info(f"✓ Быстрая полоса запущена отдельным процессом (pid {self._process.pid})")
+            code = await self._process.wait()
+            if not self._stopping:
+                logger.error(f"Процесс быстрой полосы завершился с кодом {code}, перезапуск")
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    async def stop(self) -> None:
+        """SIGTERM и ожидание текущих задач процесса"""
+        self._stopping = True
+        process = self._process
+        if process is None or process.returncode is not None:
+            return
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), timeout=JOB_RENDER_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
@@ -0,0 +1,81 @@
+"""Кэш скомпилированных селекторов шрифтов (по пользователю и версии набора шрифтов)"""
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+# Сколько селекторов держим в памяти одновременно
+MAX_CACHED_SELECTORS = 256
+
+_VERSION_FIELDS = (
+    "path",
+    "font_type",
+    "supports_cyrillic_lower",
+    "supports_cyrillic_upper",
+    "supports_latin_lower",
+    "supports_latin_upper",
+    "supports_digits",
+    "supports_symbols",
+    "is_base",
+)
+
+# Кэш: (user_id, версия набора шрифтов) -> селектор
+_selector_cache: "OrderedDict[Tuple[Optional[int], Hashable], object]" = OrderedDict()
+_lock = threading.Lock()
+_hits = 0
+_misses = 0
+
+
+def _record_key(record: Optional[dict]) -> Optional[tuple]:
+    if not record:
+        return None
+    return tuple(record.get(field) for field in _VERSION_FIELDS)
+
+
+def font_set_version(font_sets: Dict[str, list]) -> Hashable:
+    """Версия набора шрифтов — отпечаток всех записей, влияющих на выбор шрифта."""
+    return (
+        _record_key(font_sets.get("base")),
+        tuple(
+            tuple(_record_key(record) for record in font_sets.get(key) or [])
+            for key in ("cyrillic", "latin", "digits", "other", "all")
+        ),
+    )
+
+
+def get_or_build_selector(user_id: Optional[int], font_sets: Dict[str, list], builder: Callable[[], object]):
+    """Возвращает селектор из кэша или строит его через builder()."""
+    global _hits, _misses
+    key = (user_id, font_set_version(font_sets))
+    with _lock:
+        selector = _selector_cache.get(key)
+        if selector is not None:
+            _selector_cache.move_to_end(key)
+            _hits += 1
+            return selector
+        _misses += 1
+
+    # Сборку делаем вне блокировки: регистрация шрифтов может быть долгой
+    selector = builder()
+    with _lock:
+        _selector_cache[key] = selector
+        _selector_cache.move_to_end(key)
+        while len(_selector_cache) > MAX_CACHED_SELECTORS:
+            _selector_cache.popitem(last=False)
+    return selector
+
+
+def invalidate_user_selectors(user_id: int) -> None:
+    """Удаляет селекторы пользователя (вызывается при изменении его шрифтов)."""
+    with _lock:
+        for key in [key for key in _selector_cache if key[0] == user_id]:
+            del _selector_cache[key]
+
+
+def get_cache_stats() -> dict:
+    """Возвращает статистику кэша"""
+    with _lock:
+        return {
+            "cached_selectors": len(_selector_cache),
+            "hits": _hits,
+            "misses": _misses,
+        }
@@ -0,0 +1,84 @@
+"""
+Отправка документов по file_id.
+
+Загруженный в Telegram файл можно отправлять повторно по его file_id —
+мгновенно и без загрузки. file_id PDF задачи хранится в jobs.telegram_file_id,
+file_id статических документов (шаблоны из templates/) — в таблице
+telegram_files и в памяти процесса. Ключ статического файла включает размер
+и время изменения, поэтому изменённый шаблон загружается заново.
+"""
+
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+from config import BOT_TOKEN
+from utils.db_async import get_telegram_file_id, save_telegram_file_id
+from utils.metrics import metrics
+from utils.telegram_retry import call_with_retries
+
+logger = logging.getLogger(__name__)
+
+# file_id действителен только для бота, который загрузил файл
+_BOT_ID = (BOT_TOKEN or "").split(":", 1)[0]
+
+_static_file_ids: Dict[str, str] = {}
+
+
+async def send_document(
+    send: Callable[..., Awaitable[Any]],
+    path: Optional[str],
+    file_id: Optional[str] = None,
+    retry: Callable[..., Awaitable[Any]] = call_with_retries,
+    **kwargs: Any,
+) -> Tuple[Message, Optional[str]]:
+    """
+    Отправляет документ по file_id, если он известен, иначе загружает файл.
+
+    Возвращает (сообщение, новый file_id). Новый file_id не None, только если
+    файл пришлось загрузить — его нужно сохранить вместо прежнего.
+    """
+    if file_id:
+        try:
+            message = await retry(send, document=file_id, **kwargs)
+            metrics.record_document_send(by_reference=True)
+            return message, None
+        except TelegramBadRequest as e:
+            logger.warning(f"Telegram не принял file_id ({e}), загружаем файл заново: {path}")
+    if not path or not os.path.exists(path):
+        raise FileNotFoundError(f"Файл для отправки не найден: {path}")
+
+    message = await retry(send, document=FSInputFile(path), **kwargs)
+    metrics.record_document_send(by_reference=False)
+    document = getattr(message, "document", None)
+    return message, document.file_id if document else None
+
+
+def _static_file_key(path: str) -> str:
+    stat = os.stat(path)
+    return f"{_BOT_ID}:{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+async def send_static_document(send: Callable[..., Awaitable[Any]], path: str, **kwargs: Any) -> Message:
+    """Отправляет неизменяемый файл бота; после первой загрузки — по file_id"""
+    key = _static_file_key(path)
+    file_id = _static_file_ids.get(key)
+    if file_id is None:
+        try:
+            file_id = await get_telegram_file_id(key)
+        except Exception as e:
+            logger.warning(f"Не удалось получить file_id для {path}: {e}")
+        if file_id:
+            _static_file_ids[key] = file_id
+
+    message, uploaded = await send_document(send, path, file_id, **kwargs)
+    if uploaded:
+        _static_file_ids[key] = uploaded
+        try:
+            await save_telegram_file_id(key, uploaded)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить file_id для {path}: {e}")
+    return message
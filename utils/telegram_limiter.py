@@ -0,0 +1,211 @@
+"""
+Ограничение исходящих запросов к Telegram.
+
+Раньше бот узнавал о превышении лимитов только из TelegramRetryAfter, после
+чего ждали все. Теперь каждый запрос бота проходит через
+TelegramRateLimitMiddleware (middleware сессии aiogram) и заранее берёт
+жетоны из двух token bucket:
+
+    чат   — TELEGRAM_CHAT_RATE в секунду, всплеск TELEGRAM_CHAT_BURST;
+    общий — TELEGRAM_GLOBAL_RATE в секунду, всплеск TELEGRAM_GLOBAL_BURST;
+            при нескольких процессах бота (BOT_PROCESSES) каждому — равная доля.
+
+Когда общих жетонов не хватает, первыми их получают запросы с более высоким
+приоритетом: отправка результатов, затем ответы пользователю, затем
+обновления меню (редактирование сообщений). Приоритет выбирается по методу
+или задаётся явно через outbound_priority().
+
+Служебные запросы (getUpdates, ответы на callback, настройка webhook) не
+ограничиваются. TelegramRetryAfter по-прежнему обрабатывает
+utils/telegram_retry.py; лимитер лишь придерживает запросы в этот чат.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import BOT_PROCESSES, TELEGRAM_CHAT_BURST, TELEGRAM_CHAT_RATE, TELEGRAM_GLOBAL_BURST, TELEGRAM_GLOBAL_RATE
+from utils.metrics import metrics
+
+PRIORITY_DELIVERY = 0
+PRIORITY_REPLY = 1
+PRIORITY_MENU = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_DELIVERY: "delivery",
+    PRIORITY_REPLY: "reply",
+    PRIORITY_MENU: "menu",
+}
+
+# Не расходуют лимиты на отправку сообщений
+EXEMPT_METHODS = frozenset({
+    "getUpdates", "getMe", "getFile", "getWebhookInfo", "setWebhook", "deleteWebhook",
+    "answerCallbackQuery", "setMyCommands", "close", "logOut",
+})
+
+METHOD_PRIORITIES = {
+    "sendDocument": PRIORITY_DELIVERY,
+    "editMessageText": PRIORITY_MENU,
+    "editMessageReplyMarkup": PRIORITY_MENU,
+    "editMessageCaption": PRIORITY_MENU,
+}
+
+# Бакеты чатов, не использовавшиеся столько секунд, удаляются
+CHAT_BUCKET_IDLE_SECONDS = 300.0
+
+_priority: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("telegram_priority", default=None)
+
+
+@contextmanager
+def outbound_priority(priority: int):
+    """Приоритет запросов к Telegram внутри блока (в том числе через call_with_retries)"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """Жетоны пополняются со скоростью rate в секунду до capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        """Берёт жетон в долг; возвращает, сколько секунд ждать до его появления"""
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def try_take(self, now: float) -> float:
+        """Берёт жетон, если он есть (0), иначе — секунды до появления жетона"""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, now: float, seconds: float) -> None:
+        """Не выдавать жетонов ближайшие seconds секунд"""
+        self._refill(now)
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class OutboundLimiter:
+    """Общий и по-чатовые token bucket с приоритетной очередью к общему"""
+
+    def __init__(
+        self,
+        global_rate: float = TELEGRAM_GLOBAL_RATE / BOT_PROCESSES,
+        global_burst: int = max(1, TELEGRAM_GLOBAL_BURST // BOT_PROCESSES),
+        chat_rate: float = TELEGRAM_CHAT_RATE,
+        chat_burst: int = TELEGRAM_CHAT_BURST,
+    ):
+        self._global = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chats: Dict[object, TokenBucket] = {}
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+        self._next_sweep = time.monotonic() + CHAT_BUCKET_IDLE_SECONDS
+
+    def _chat_bucket(self, chat_id, now: float) -> Optional[TokenBucket]:
+        if chat_id is None or self._chat_rate <= 0:
+            return None
+        if now >= self._next_sweep:
+            self._next_sweep = now + CHAT_BUCKET_IDLE_SECONDS
+            idle_before = now - CHAT_BUCKET_IDLE_SECONDS
+            for key in [k for k, b in self._chats.items() if b.updated < idle_before]:
+                del self._chats[key]
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    async def acquire(self, chat_id=None, priority: int = PRIORITY_REPLY) -> float:
+        """Ждёт разрешения на запрос; возвращает время ожидания, секунды"""
+        started = time.monotonic()
+        bucket = self._chat_bucket(chat_id, started)
+        if bucket is not None:
+            wait = bucket.reserve(started)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        if self._global is not None:
+            if self._waiters or self._global.try_take(time.monotonic()) > 0:
+                future = asyncio.get_running_loop().create_future()
+                heapq.heappush(self._waiters, (priority, next(self._seq), future))
+                if self._pump is None or self._pump.done():
+                    self._pump = asyncio.create_task(self._run_pump())
+                await future
+        return time.monotonic() - started
+
+    async def _run_pump(self) -> None:
+        """Выдаёт общие жетоны ожидающим по приоритету, затем по порядку прихода"""
+        while self._waiters:
+            wait = self._global.try_take(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+            else:
+                # Все ожидавшие отменены — жетон возвращается
+                self._global.tokens += 1
+
+    def penalize(self, chat_id, seconds: float) -> None:
+        """Telegram ответил RetryAfter: придерживаем запросы в этот чат"""
+        now = time.monotonic()
+        bucket = self._chat_bucket(chat_id, now)
+        if bucket is not None:
+            bucket.block(now, seconds)
+
+    def stats(self) -> dict:
+        return {"waiting": len(self._waiters), "chats": len(self._chats)}
+
+
+limiter = OutboundLimiter()
+
+
+class TelegramRateLimitMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: все исходящие запросы проходят через limiter"""
+
+    def __init__(self, outbound_limiter: OutboundLimiter = limiter):
+        self.limiter = outbound_limiter
+
+    async def __call__(self, make_request, bot, method):
+        api_method = method.__api_method__
+        if api_method in EXEMPT_METHODS:
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        priority = _priority.get()
+        if priority is None:
+            priority = METHOD_PRIORITIES.get(api_method, PRIORITY_REPLY)
+        waited = await self.limiter.acquire(chat_id, priority)
+        metrics.record_outbound_call(PRIORITY_NAMES[priority], waited * 1000)
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as exc:
+            metrics.record_telegram_retry_after(api_method)
+            self.limiter.penalize(chat_id, exc.retry_after)
+            raise
@@ -0,0 +1,177 @@
+"""
+Контекст пользователя на время обработки одного апдейта.
+
+Профиль, настройки, режим PDF и шрифты загружаются одним запросом
+(utils.db_utils.load_user_context) в UserContextMiddleware и передаются
+хендлерам как user_ctx. Любая запись в БД, меняющая эти данные, даёт
+пользователю новую версию — уже загруженный контекст становится устаревшим
+(is_stale), и хендлер перечитывает его.
+
+Версии берутся из общего растущего счётчика. Хранятся версии последних
+MAX_TRACKED_VERSIONS записей; у остальных пользователей версия — наибольшая
+из вытесненных (_version_floor). Поэтому вытеснение никогда не делает
+устаревший контекст актуальным, а в худшем случае вызывает лишнее
+перечитывание.
+
+Загруженные контексты хранятся в ограниченном TTL/LRU-кэше процесса.
+Изменения настроек записываются в кэш вместе с БД (write_through_settings),
+изменения шрифтов сбрасывают запись (invalidate_user_context). Если процессов
+бота несколько, о каждом изменении узнают остальные (set_change_publisher,
+utils/cluster.py).
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import USER_CACHE_TTL, USER_CACHE_MAX_SIZE
+from utils.metrics import metrics
+
+# Сколько последних записей помнит _versions
+MAX_TRACKED_VERSIONS = 10000
+
+# Версии контекстов: user_id -> номер последней записи (порядок — по записям)
+_versions: "OrderedDict[int, int]" = OrderedDict()
+# Последний выданный номер и наибольший из вытесненных из _versions
+_last_version = 0
+_version_floor = 0
+# Кэш: user_id -> последний загруженный контекст (порядок — LRU)
+_cache: "OrderedDict[int, UserContext]" = OrderedDict()
+_lock = threading.Lock()
+# Оповещение других процессов бота об изменении пользователя; None — процесс один
+_publisher: Optional[Callable[[int], None]] = None
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class UserContext:
+    user_id: int
+    version: int
+    # Как в get_user_info (+ username, first_name, last_name); None — пользователя ещё нет в БД
+    user: Optional[dict]
+    pdf_mode: bool
+    font_records: Tuple[dict, ...]
+    # Как в get_fonts_for_generation
+    font_sets: Dict[str, object] = field(repr=False)
+    # Как в get_user_fonts_by_type
+    fonts_by_type: Dict[str, List[str]] = field(repr=False)
+    # Как в get_font_requirement_progress
+    progress: Dict[str, Dict[str, int]] = field(repr=False)
+    loaded_at: float = field(default_factory=time.monotonic, compare=False)
+
+    @property
+    def exists(self) -> bool:
+        return self.user is not None
+
+    @property
+    def ready_to_generate(self) -> bool:
+        """Как has_minimum_font_set: есть базовый кириллический шрифт."""
+        return bool(self.fonts_by_type.get("base"))
+
+    @property
+    def is_stale(self) -> bool:
+        return get_context_version(self.user_id) != self.version
+
+
+def get_context_version(user_id: int) -> int:
+    with _lock:
+        return _versions.get(user_id, _version_floor)
+
+
+def _bump_version(user_id: int) -> int:
+    """Новая версия пользователя; вызывается под _lock"""
+    global _last_version, _version_floor
+    _last_version += 1
+    _versions[user_id] = _last_version
+    _versions.move_to_end(user_id)
+    while len(_versions) > MAX_TRACKED_VERSIONS:
+        _, _version_floor = _versions.popitem(last=False)
+    return _last_version
+
+
+def set_change_publisher(publisher: Optional[Callable[[int], None]]) -> None:
+    global _publisher
+    _publisher = publisher
+
+
+def _publish(user_id: int) -> None:
+    if _publisher is None:
+        return
+    try:
+        _publisher(user_id)
+    except Exception as e:
+        # Другие процессы увидят изменение не позже USER_CACHE_TTL
+        logger.warning(f"Не удалось оповестить процессы об изменении пользователя {user_id}: {e}")
+
+
+def invalidate_user_context(user_id: int, publish: bool = True) -> None:
+    """Помечает загруженные контексты пользователя как устаревшие и убирает их из кэша."""
+    with _lock:
+        _bump_version(user_id)
+        _cache.pop(user_id, None)
+    if publish:
+        _publish(user_id)
+
+
+def get_cached_context(user_id: int) -> Optional[UserContext]:
+    """Актуальный контекст из кэша или None (промах учитывается в метриках)."""
+    with _lock:
+        ctx = _cache.get(user_id)
+        if ctx is not None:
+            if (
+                ctx.version == _versions.get(user_id, _version_floor)
+                and time.monotonic() - ctx.loaded_at < USER_CACHE_TTL
+            ):
+                _cache.move_to_end(user_id)
+                metrics.record_user_cache(hit=True)
+                return ctx
+            del _cache[user_id]
+    metrics.record_user_cache(hit=False)
+    return None
+
+
+def store_context(ctx: UserContext) -> None:
+    """Кладёт загруженный контекст в кэш, если за время загрузки не было записей."""
+    if USER_CACHE_MAX_SIZE <= 0:
+        return
+    with _lock:
+        if ctx.version != _versions.get(ctx.user_id, _version_floor):
+            return
+        _cache[ctx.user_id] = ctx
+        _cache.move_to_end(ctx.user_id)
+        while len(_cache) > USER_CACHE_MAX_SIZE:
+            _cache.popitem(last=False)
+
+
+def write_through_settings(user_id: int, pdf_mode: Optional[bool] = None, **fields) -> None:
+    """
+    Отражает в кэше уже закоммиченное изменение настроек пользователя.
+
+    fields — ключи словаря user (page_format, grid_enabled, first_page_side, ...).
+    Контексты, загруженные до записи, становятся устаревшими.
+    """
+    with _lock:
+        version = _bump_version(user_id)
+        ctx = _cache.get(user_id)
+        if ctx is not None and ctx.user is None:
+            del _cache[user_id]
+        elif ctx is not None:
+            _cache[user_id] = replace(
+                ctx,
+                version=version,
+                user={**ctx.user, **fields},
+                pdf_mode=ctx.pdf_mode if pdf_mode is None else pdf_mode,
+                loaded_at=ctx.loaded_at,
+            )
+    _publish(user_id)
+
+
+def clear_user_context_cache() -> None:
+    with _lock:
+        _cache.clear()
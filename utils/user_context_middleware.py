@@ -0,0 +1,36 @@
+"""
+Middleware, загружающее контекст пользователя одним запросом
+"""
+
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from utils.db_async import load_user_context
+
+logger = logging.getLogger(__name__)
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Кладёт в data['user_ctx'] профиль, настройки, режим PDF и шрифты пользователя"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user_id = None
+        if isinstance(event, (Message, CallbackQuery)) and event.from_user:
+            user_id = event.from_user.id
+
+        if user_id:
+            try:
+                data["user_ctx"] = await load_user_context(user_id)
+            except Exception as e:
+                # Хендлеры загрузят данные сами (user_ctx=None)
+                logger.warning(f"Не удалось загрузить контекст пользователя {user_id}: {e}")
+
+        return await handler(event, data)
@@ -0,0 +1,165 @@
+"""
+Очередь апдейтов webhook.
+
+Telegram получает ответ сразу после разбора тела запроса, а апдейт
+обрабатывается позже из ограниченной очереди процесса:
+
+    - апдейты одного чата обрабатываются строго по очереди, разных чатов —
+      параллельно (до WEBHOOK_QUEUE_WORKERS сразу, чаты по кругу). С
+      WEBHOOK_PROCESSES > 1 супервизор (utils/cluster.py) отправляет апдейты
+      одного чата всегда в один процесс, так что порядок тот же;
+    - в очереди не больше WEBHOOK_QUEUE_SIZE апдейтов; сверх этого webhook
+      отвечает 503, и Telegram доставит апдейт повторно;
+    - stats() показывает глубину очереди и возраст самого старого апдейта —
+      если возраст растёт, обработка не успевает за поступлением.
+
+Очередь в памяти. По SIGTERM/SIGINT bot.py останавливает aiohttp
+(runner.cleanup), и close() дорабатывает принятые апдейты — не дольше
+WEBHOOK_SHUTDOWN_TIMEOUT. Не успевшие апдейты и апдейты процесса, убитого
+без сигнала, теряются: Telegram их уже считает доставленными.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+from config import WEBHOOK_QUEUE_SIZE, WEBHOOK_QUEUE_WORKERS, WEBHOOK_SHUTDOWN_TIMEOUT
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_CHAT_FIELDS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "business_message", "edited_business_message",
+)
+
+
+def update_chat_key(update: dict) -> Optional[int]:
+    """Чат (или пользователь), в рамках которого важен порядок апдейтов"""
+    for name in _CHAT_FIELDS:
+        obj = update.get(name)
+        if obj and obj.get("chat"):
+            return obj["chat"]["id"]
+    for name, obj in update.items():
+        if not isinstance(obj, dict):
+            continue
+        message = obj.get("message")
+        if isinstance(message, dict) and message.get("chat"):
+            return message["chat"]["id"]
+        sender = obj.get("from") or obj.get("user")
+        if isinstance(sender, dict) and "id" in sender:
+            # В личном чате id чата совпадает с id пользователя
+            return sender["id"]
+    return None
+
+
+class UpdateQueue:
+    """Ограниченная очередь апдейтов с порядком внутри чата"""
+
+    def __init__(self, capacity: int = WEBHOOK_QUEUE_SIZE, workers: int = WEBHOOK_QUEUE_WORKERS):
+        self.capacity = capacity
+        self.workers = max(1, workers)
+        # Чат -> ожидающие апдейты (время постановки, апдейт); чат есть здесь, пока у него
+        # есть ожидающие апдейты или один обрабатывается
+        self._chats: Dict[object, Deque[Tuple[float, Any]]] = {}
+        # Чаты, чей следующий апдейт можно брать в обработку
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._size = 0
+        self._active = 0
+        self._process: Optional[Callable[[Any], Awaitable[None]]] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self, process: Callable[[Any], Awaitable[None]]) -> None:
+        self._process = process
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def offer(self, key: Optional[object], item: Any) -> bool:
+        """Ставит апдейт в очередь; False — очередь переполнена"""
+        if self._size >= self.capacity:
+            metrics.record_webhook_update_rejected()
+            return False
+        if key is None:
+            # Без чата порядок не важен
+            key = object()
+        pending = self._chats.get(key)
+        if pending is None:
+            pending = self._chats[key] = deque()
+            self._ready.put_nowait(key)
+        pending.append((time.monotonic(), item))
+        self._size += 1
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            pending = self._chats[key]
+            enqueued_at, item = pending.popleft()
+            self._size -= 1
+            self._active += 1
+            metrics.record_webhook_update((time.monotonic() - enqueued_at) * 1000)
+            try:
+                await self._process(item)
+            except Exception as e:
+                logger.error(f"Ошибка обработки апдейта: {e}", exc_info=True)
+            finally:
+                self._active -= 1
+                if pending:
+                    # Следующий апдейт чата — в конец, чтобы активный чат не занимал воркера целиком
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        oldest = min((pending[0][0] for pending in self._chats.values() if pending), default=now)
+        return {
+            "depth": self._size,
+            "processing": self._active,
+            "chats": len(self._chats),
+            "oldest_age_s": round(now - oldest, 2),
+        }
+
+    async def drain(self, timeout: float = max(1.0, WEBHOOK_SHUTDOWN_TIMEOUT - 5)) -> None:
+        """Дорабатывает принятые апдейты (не дольше timeout) и останавливает воркеров"""
+        deadline = time.monotonic() + timeout
+        while (self._size or self._active) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._size:
+            logger.warning(f"Остановка: не обработано апдейтов из очереди webhook: {self._size}")
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+
+update_queue = UpdateQueue()
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """SimpleRequestHandler, который отвечает Telegram сразу и обрабатывает апдейты через update_queue"""
+
+    def __init__(self, *args: Any, queue: UpdateQueue = update_queue, **kwargs: Any):
+        kwargs["handle_in_background"] = True
+        super().__init__(*args, **kwargs)
+        self.updates = queue
+        self.updates.start(self._process_queued)
+
+    async def _process_queued(self, item: Tuple[Bot, dict]) -> None:
+        bot, update = item
+        await self._background_feed_update(bot=bot, update=update)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        if not self.updates.offer(update_chat_key(update), (bot, update)):
+            return web.Response(status=503, text="Update queue is full")
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self) -> None:
+        await self.updates.drain()
+        await super().close()